@@ -8,38 +8,1565 @@ Disciplina: Tecnologias Emergentes
 
 import flet as ft
 import sqlite3
-from datetime import datetime
-from typing import List, Optional, Dict, Any
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, NamedTuple
+from collections import deque, OrderedDict
+from functools import lru_cache, wraps
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from pathlib import Path
+from array import array
+import argparse
+import asyncio
 import os
 import json
+import calendar
+import gzip
+import hashlib
+import itertools
+import math
+import multiprocessing
+import queue
+import random
+import re
+import shutil
+import sys
+import time
+import threading
+import uuid
 import warnings
+import weakref
 
-class DatabaseManager:
-    """Gerencia todo o nosso banco de Dados"""
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # backend PostgreSQL é opcional
+    psycopg2 = None
+
+class QueryMetrics:
+    """Coleta métricas de execução das queries (instrumentação opcional)"""
+    
+    # Limites superiores (ms) das faixas do histograma de latência
+    HISTOGRAM_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+    
+    def __init__(self, slow_threshold_ms: float = 100.0, slow_log_size: int = 100):
+        self.enabled = False
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Zera todas as métricas coletadas"""
+        with self._lock:
+            self.statements = {}
+            self.commit_count = 0
+            self.commit_total_ms = 0.0
+            self.slow_queries.clear()
+    
+    @staticmethod
+    def normalize(sql: str) -> str:
+        """Normaliza o SQL para agrupar execuções do mesmo comando"""
+        return ' '.join(sql.split())
+    
+    def record(self, sql: str, params: tuple, elapsed_ms: float, rows: int, plan: Optional[List[str]] = None):
+        """Registra a execução de um comando SQL"""
+        key = self.normalize(sql)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = {
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'histogram': [0] * (len(self.HISTOGRAM_BUCKETS_MS) + 1)
+                }
+                self.statements[key] = stats
+            
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['rows'] += rows
+            stats['histogram'][self._bucket_index(elapsed_ms)] += 1
+            
+            if elapsed_ms >= self.slow_threshold_ms:
+                self.slow_queries.append({
+                    'sql': key,
+                    'params': params,
+                    'elapsed_ms': elapsed_ms,
+                    'rows': rows,
+                    'plan': plan or [],
+                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
+    
+    def record_commit(self, elapsed_ms: float):
+        """Registra o custo de um commit"""
+        with self._lock:
+            self.commit_count += 1
+            self.commit_total_ms += elapsed_ms
+    
+    def is_slow(self, elapsed_ms: float) -> bool:
+        return self.enabled and elapsed_ms >= self.slow_threshold_ms
     
-    _instance = None
-    _connection = None
+    def _bucket_index(self, elapsed_ms: float) -> int:
+        for index, limit in enumerate(self.HISTOGRAM_BUCKETS_MS):
+            if elapsed_ms <= limit:
+                return index
+        return len(self.HISTOGRAM_BUCKETS_MS)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Retorna uma cópia das métricas para consulta/exibição"""
+        with self._lock:
+            statements = []
+            for sql, stats in self.statements.items():
+                statements.append({
+                    'sql': sql,
+                    'count': stats['count'],
+                    'total_ms': stats['total_ms'],
+                    'avg_ms': stats['total_ms'] / stats['count'],
+                    'max_ms': stats['max_ms'],
+                    'rows': stats['rows'],
+                    'histogram': dict(zip(
+                        [f"<={limit}ms" for limit in self.HISTOGRAM_BUCKETS_MS] + [f">{self.HISTOGRAM_BUCKETS_MS[-1]}ms"],
+                        stats['histogram']
+                    ))
+                })
+            statements.sort(key=lambda s: s['total_ms'], reverse=True)
+            
+            return {
+                'enabled': self.enabled,
+                'slow_threshold_ms': self.slow_threshold_ms,
+                'statements': statements,
+                'commits': {
+                    'count': self.commit_count,
+                    'total_ms': self.commit_total_ms,
+                    'avg_ms': self.commit_total_ms / self.commit_count if self.commit_count else 0.0
+                },
+                'slow_queries': list(self.slow_queries)
+            }
+
+class TimedRLock:
+    """RLock que mede a espera pela posse (contenção entre sessões)
     
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(DatabaseManager, cls).__new__(cls)
-        return cls._instance
+    A aquisição sem disputa custa uma tentativa não bloqueante; só quando
+    outra thread detém o lock o tempo de espera é medido. O total por
+    thread permite atribuir a espera a cada operação (testes de carga).
+    """
     
     def __init__(self):
-        if self._connection is None:
-            self.init_database()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self.reset()
+    
+    def reset(self):
+        """Zera os contadores (as esperas por thread continuam acumulando)"""
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+    
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if not self._lock.acquire(blocking=False):
+            if not blocking:
+                return False
+            start = time.perf_counter()
+            if not self._lock.acquire(timeout=timeout):
+                return False
+            waited = (time.perf_counter() - start) * 1000
+            # Contadores só mudam com o lock em mãos
+            self.contended += 1
+            self.wait_ms += waited
+            self.max_wait_ms = max(self.max_wait_ms, waited)
+            self._local.wait_ms = self.thread_wait_ms() + waited
+        self.acquisitions += 1
+        return True
+    
+    def release(self):
+        self._lock.release()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    def thread_wait_ms(self) -> float:
+        """Espera acumulada pela thread atual"""
+        return getattr(self._local, 'wait_ms', 0.0)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'aquisicoes': self.acquisitions,
+            'disputadas': self.contended,
+            'espera_total_ms': round(self.wait_ms, 3),
+            'espera_max_ms': round(self.max_wait_ms, 3),
+        }
+
+class QueryCache:
+    """Cache LRU de resultados de consultas de relatórios e agregados
+    
+    Cada entrada depende das tabelas que a consulta lê (ou de tags como
+    'produto:42'). Uma escrita incrementa a geração das tabelas que altera
+    (de novo ao fim da transação, pois leitores podem ter visto dados ainda
+    não confirmados), e a entrada cuja geração mudou é descartada na próxima
+    leitura. O TTL cobre escritas feitas por outros processos.
+    """
+    
+    _READ_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+(?:main\.)?([A-Za-z_]\w*)', re.IGNORECASE)
+    _WRITE_TABLE = re.compile(
+        r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+(?:main\.)?([A-Za-z_]\w*)',
+        re.IGNORECASE
+    )
+    # Visões mapeadas para a tabela de que dependem
+    ALIASES = {'movimentacoes_todas': 'movimentacoes'}
+    
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024, ttl_seconds: float = 30.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._dirty = set()
+        self.hits = self.misses = self.evictions = 0
+        self.clear()
+    
+    def clear(self):
+        """Descarta todas as entradas (restauração de backup, arquivamento)"""
+        with self._lock:
+            self._entries = OrderedDict()  # chave -> (linhas, dependências, gerações, expira, bytes)
+            self.bytes = 0
+            self._generations = {key: value + 1 for key, value in self._generations.items()}
+    
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def tables_read(cls, sql: str) -> tuple:
+        return tuple(sorted({cls.ALIASES.get(name.lower(), name.lower()) for name in cls._READ_TABLES.findall(sql)}))
+    
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def table_written(cls, sql: str) -> Optional[str]:
+        match = cls._WRITE_TABLE.match(sql)
+        return match.group(1).lower() if match else None
+    
+    @staticmethod
+    def _estimate_size(rows: tuple) -> int:
+        size = sys.getsizeof(rows)
+        for row in rows:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+        return size
+    
+    def generations(self, deps: tuple) -> tuple:
+        with self._lock:
+            return tuple(self._generations.get(dep, 0) for dep in deps)
+    
+    def get(self, key: tuple) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                rows, deps, generations, expires, size = entry
+                current = tuple(self._generations.get(dep, 0) for dep in deps)
+                if current == generations and expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return rows
+                del self._entries[key]
+                self.bytes -= size
+            self.misses += 1
+            return None
+    
+    def put(self, key: tuple, rows: tuple, deps: tuple, generations: tuple, ttl: float = None):
+        """Guarda o resultado calculado com as gerações lidas ANTES da consulta"""
+        size = self._estimate_size(rows)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl_seconds if ttl is None else ttl)
+        with self._lock:
+            if tuple(self._generations.get(dep, 0) for dep in deps) != generations:
+                return  # houve escrita durante a consulta
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[4]
+            self._entries[key] = (rows, deps, generations, expires, size)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[4]
+                self.evictions += 1
+    
+    def invalidate(self, *deps: str, in_transaction: bool = False):
+        """Invalida tabelas ou tags; dentro de transação, de novo ao final dela"""
+        with self._lock:
+            for dep in deps:
+                self._generations[dep] = self._generations.get(dep, 0) + 1
+            if in_transaction:
+                self._dirty.update(deps)
+    
+    def invalidate_sql(self, sql: str, in_transaction: bool):
+        """Invalida a tabela alterada por um comando de escrita"""
+        table = self.table_written(sql)
+        if table is not None:
+            self.invalidate(table, in_transaction=in_transaction)
+    
+    def end_transaction(self):
+        """Fim da transação (commit ou rollback): invalida de novo o que ela alterou"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self.invalidate(*dirty)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entradas': len(self._entries), 'bytes': self.bytes,
+                'acertos': self.hits, 'falhas': self.misses, 'descartes': self.evictions,
+                'taxa_acerto': self.hits / lookups if lookups else 0.0
+            }
+
+class ProductRecord(NamedTuple):
+    """Registro leve de produto (mapeamento posicional, sem sqlite3.Row)"""
+    id: int
+    nome: str
+    descricao: Optional[str]
+    categoria_id: Optional[int]
+    fornecedor_id: Optional[int]
+    preco_compra: float
+    preco_venda: float
+    estoque_atual: int
+    estoque_minimo: int
+    estoque_maximo: int
+    unidade_medida: str
+    ativo: int
+    created_at: str
+    updated_at: str
+    sku: Optional[str]
+    ean: Optional[str]
+    categoria_nome: Optional[str]
+    fornecedor_nome: Optional[str]
+    status_estoque: str
+    classe_abc: Optional[str]
+    classe_xyz: Optional[str]
+
+class MovementRecord(NamedTuple):
+    """Registro leve de movimentação (mapeamento posicional, sem sqlite3.Row)"""
+    id: int
+    produto_id: int
+    tipo: str
+    quantidade: int
+    valor_unitario: float
+    valor_total: float
+    observacao: Optional[str]
+    data_movimentacao: str
+    data_epoch: int
+    usuario: str
+    produto_nome: str
+
+class StatementRegistry:
+    """Registro central dos comandos SQL nomeados
+    
+    Cada comando é mantido como um texto fixo, de modo que o cache de
+    statements do sqlite3 reaproveita a versão já compilada a cada execução.
+    """
+    
+    _PRODUCT_SELECT = '''
+        SELECT
+            p.id, p.nome, p.descricao, p.categoria_id, p.fornecedor_id,
+            p.preco_compra, p.preco_venda, p.estoque_atual, p.estoque_minimo,
+            p.estoque_maximo, p.unidade_medida, p.ativo, p.created_at, p.updated_at,
+            p.sku, p.ean,
+            c.nome as categoria_nome,
+            f.nome as fornecedor_nome,
+            CASE 
+                WHEN EXISTS (SELECT 1 FROM kits_componentes k WHERE k.kit_id = p.id) THEN 'NORMAL'
+                WHEN p.estoque_atual <= p.estoque_minimo THEN 'BAIXO'
+                WHEN p.estoque_atual >= p.estoque_maximo THEN 'ALTO'
+                ELSE 'NORMAL'
+            END as status_estoque,
+            p.classe_abc, p.classe_xyz
+        FROM produtos p
+        LEFT JOIN categorias c ON p.categoria_id = c.id
+        LEFT JOIN fornecedores f ON p.fornecedor_id = f.id
+    '''
+    
+    _MOVEMENT_SELECT = '''
+        SELECT
+            m.id, m.produto_id, m.tipo, m.quantidade, m.valor_unitario,
+            m.valor_total, m.observacao, m.data_movimentacao, m.data_epoch, m.usuario,
+            p.nome as produto_nome
+        FROM movimentacoes m
+        JOIN produtos p ON m.produto_id = p.id
+    '''
+    
+    _statements: Dict[str, str] = {
+        'produtos.listar_ativos': _PRODUCT_SELECT + ' WHERE p.ativo = 1 ORDER BY p.nome',
+        'produtos.listar_todos': _PRODUCT_SELECT + ' ORDER BY p.nome',
+        'produtos.por_id': _PRODUCT_SELECT + ' WHERE p.id = ?',
+        'produtos.por_classe': _PRODUCT_SELECT + '''
+            WHERE p.classe_abc BETWEEN ? AND ? AND p.classe_xyz BETWEEN ? AND ? AND p.ativo = 1
+            ORDER BY p.nome
+        ''',
+        'produtos.inserir': '''
+            INSERT INTO produtos (
+                nome, descricao, categoria_id, fornecedor_id, 
+                preco_compra, preco_venda, estoque_atual, 
+                estoque_minimo, estoque_maximo, unidade_medida, sku, ean
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+        'produtos.atualizar': '''
+            UPDATE produtos SET
+                nome = ?, descricao = ?, categoria_id = ?, fornecedor_id = ?,
+                preco_compra = ?, preco_venda = ?, estoque_minimo = ?,
+                estoque_maximo = ?, unidade_medida = ?, sku = ?, ean = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''',
+        'produtos.estoque': 'SELECT estoque_atual FROM produtos WHERE id = ?',
+        'produtos.codigos': '''
+            SELECT id, sku, ean FROM produtos
+            WHERE ativo = 1 AND (sku IS NOT NULL OR ean IS NOT NULL)
+        ''',
+        'produtos.desativar': 'UPDATE produtos SET ativo = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        'produtos.excluir': 'DELETE FROM produtos WHERE id = ?',
+        'produtos.entrada': '''
+            UPDATE produtos SET 
+                estoque_atual = estoque_atual + ?,
+                updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''',
+        'produtos.saida': '''
+            UPDATE produtos SET 
+                estoque_atual = estoque_atual - ?,
+                updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''',
+        'movimentacoes.inserir': '''
+            INSERT INTO movimentacoes (
+                produto_id, tipo, quantidade, valor_unitario, 
+                valor_total, observacao, local_id, data_movimentacao, data_epoch, transferencia_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+        'movimentacoes.contar_por_produto': '''
+            SELECT (
+                EXISTS (SELECT 1 FROM movimentacoes WHERE produto_id = ?)
+                OR EXISTS (SELECT 1 FROM movimentacoes_resumo WHERE produto_id = ?)
+            ) as count
+        ''',
+        'movimentacoes.por_produto': _MOVEMENT_SELECT + ' WHERE m.produto_id = ? ORDER BY m.data_epoch DESC',
+        'movimentacoes.recentes': _MOVEMENT_SELECT + ' ORDER BY m.data_epoch DESC LIMIT 100',
+        'movimentacoes.intervalo': _MOVEMENT_SELECT + '''
+            WHERE m.data_epoch >= ? AND m.data_epoch < ?
+            ORDER BY m.data_epoch DESC LIMIT ?
+        ''',
+        'movimentacoes.intervalo_produto': _MOVEMENT_SELECT + '''
+            WHERE m.produto_id = ? AND m.data_epoch >= ? AND m.data_epoch < ?
+            ORDER BY m.data_epoch DESC LIMIT ?
+        ''',
+        'movimentacoes.totais_intervalo': '''
+            SELECT
+                COUNT(*) as qtd_movimentacoes,
+                COALESCE(SUM(CASE WHEN tipo = 'ENTRADA' THEN quantidade ELSE 0 END), 0) as entradas,
+                COALESCE(SUM(CASE WHEN tipo = 'SAIDA' THEN quantidade ELSE 0 END), 0) as saidas,
+                COALESCE(SUM(CASE WHEN tipo = 'ENTRADA' THEN valor_total ELSE 0 END), 0.0) as valor_entradas,
+                COALESCE(SUM(CASE WHEN tipo = 'SAIDA' THEN valor_total ELSE 0 END), 0.0) as valor_saidas
+            FROM movimentacoes
+            WHERE data_epoch >= ? AND data_epoch < ?
+        ''',
+        'produtos.estoque_baixo': _PRODUCT_SELECT + '''
+            WHERE p.ativo = 1 AND p.estoque_atual <= p.estoque_minimo
+                AND NOT EXISTS (SELECT 1 FROM kits_componentes k WHERE k.kit_id = p.id)
+            ORDER BY p.nome LIMIT ?
+        ''',
+        'snapshot.produtos': '''
+            SELECT p.id, p.categoria_id, p.estoque_atual, p.estoque_minimo, p.estoque_maximo,
+                p.preco_venda, EXISTS (SELECT 1 FROM kits_componentes k WHERE k.kit_id = p.id)
+            FROM produtos p WHERE p.ativo = 1 ORDER BY p.id
+        ''',
+        'snapshot.ultima_movimentacao': 'SELECT COALESCE(MAX(id), 0) FROM movimentacoes',
+        'snapshot.movimentacoes_desde': '''
+            SELECT id, produto_id, tipo, quantidade FROM movimentacoes
+            WHERE id > ? ORDER BY id
+        ''',
+        'historico.por_produto': '''
+            SELECT
+                m.id, m.produto_id, m.tipo, m.quantidade, m.valor_unitario,
+                m.valor_total, m.observacao, m.data_movimentacao, m.data_epoch, m.usuario,
+                COALESCE(p.nome, pa.nome) as produto_nome
+            FROM movimentacoes_todas m
+            LEFT JOIN produtos p ON m.produto_id = p.id
+            LEFT JOIN produtos_arquivados pa ON m.produto_id = pa.id
+            WHERE m.produto_id = ? AND m.data_epoch >= ? AND m.data_epoch < ?
+            ORDER BY m.data_epoch DESC
+        ''',
+        'historico.periodo': '''
+            SELECT
+                m.id, m.produto_id, m.tipo, m.quantidade, m.valor_unitario,
+                m.valor_total, m.observacao, m.data_movimentacao, m.data_epoch, m.usuario,
+                COALESCE(p.nome, pa.nome) as produto_nome
+            FROM movimentacoes_todas m
+            LEFT JOIN produtos p ON m.produto_id = p.id
+            LEFT JOIN produtos_arquivados pa ON m.produto_id = pa.id
+            WHERE m.data_epoch >= ? AND m.data_epoch < ?
+            ORDER BY m.data_epoch DESC
+        ''',
+        'historico.resumo_por_produto': '''
+            SELECT * FROM movimentacoes_resumo WHERE produto_id = ? ORDER BY periodo
+        ''',
+        'locais.listar': 'SELECT * FROM locais WHERE ativo = 1 ORDER BY id',
+        'locais.inserir': 'INSERT INTO locais (nome, descricao) VALUES (?, ?)',
+        'estoque_local.saldo': '''
+            SELECT quantidade FROM estoque_local WHERE produto_id = ? AND local_id = ?
+        ''',
+        'estoque_local.movimentar': '''
+            INSERT INTO estoque_local (produto_id, local_id, quantidade) VALUES (?, ?, ?)
+            ON CONFLICT (produto_id, local_id) DO UPDATE SET quantidade = estoque_local.quantidade + excluded.quantidade
+        ''',
+        'estoque_local.por_produto': '''
+            SELECT l.id as local_id, l.nome as local_nome, COALESCE(el.quantidade, 0) as quantidade,
+                   COALESCE(el.reservado, 0) as reservado
+            FROM locais l
+            LEFT JOIN estoque_local el ON el.local_id = l.id AND el.produto_id = ?
+            WHERE l.ativo = 1
+            ORDER BY l.id
+        ''',
+        'estoque_local.por_local': '''
+            SELECT
+                p.id, p.nome, p.unidade_medida, el.quantidade,
+                el.quantidade * p.preco_venda as valor
+            FROM estoque_local el
+            JOIN produtos p ON p.id = el.produto_id
+            WHERE el.local_id = ? AND el.quantidade <> 0 AND p.ativo = 1
+            ORDER BY p.nome
+        ''',
+        'estoque_local.totais': '''
+            SELECT
+                l.id as local_id, l.nome as local_nome,
+                COUNT(el.produto_id) as qtd_produtos,
+                COALESCE(SUM(el.quantidade), 0) as quantidade,
+                COALESCE(SUM(el.quantidade * p.preco_venda), 0.0) as valor
+            FROM locais l
+            LEFT JOIN estoque_local el ON el.local_id = l.id AND el.quantidade <> 0
+            LEFT JOIN produtos p ON p.id = el.produto_id
+            WHERE l.ativo = 1
+            GROUP BY l.id
+            ORDER BY l.id
+        ''',
+        'estoque_local.total_geral': '''
+            SELECT COUNT(*) as qtd_produtos,
+                   COALESCE(SUM(estoque_atual), 0) as quantidade,
+                   COALESCE(SUM(estoque_atual * preco_venda), 0.0) as valor
+            FROM produtos WHERE ativo = 1
+        ''',
+        'lotes.creditar': '''
+            INSERT INTO lotes (produto_id, local_id, numero_lote, data_validade, quantidade_inicial, saldo)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (produto_id, local_id, numero_lote) DO UPDATE SET
+                quantidade_inicial = lotes.quantidade_inicial + excluded.quantidade_inicial,
+                saldo = lotes.saldo + excluded.saldo,
+                data_validade = COALESCE(excluded.data_validade, lotes.data_validade)
+        ''',
+        'lotes.por_chave': '''
+            SELECT id FROM lotes WHERE produto_id = ? AND local_id = ? AND numero_lote = ?
+        ''',
+        'lotes.fefo': '''
+            SELECT id, numero_lote, data_validade, saldo
+            FROM lotes
+            WHERE produto_id = ? AND local_id = ? AND saldo > 0
+            ORDER BY data_validade IS NULL, data_validade, id
+        ''',
+        'lotes.baixar': 'UPDATE lotes SET saldo = saldo - ? WHERE id = ?',
+        'lotes.vencendo': '''
+            SELECT
+                l.id, l.produto_id, p.nome as produto_nome, l.local_id, lc.nome as local_nome,
+                l.numero_lote, l.data_validade, l.saldo
+            FROM lotes l
+            JOIN produtos p ON p.id = l.produto_id
+            JOIN locais lc ON lc.id = l.local_id
+            WHERE l.saldo > 0 AND l.data_validade <= ?
+            ORDER BY l.data_validade
+            LIMIT ?
+        ''',
+        'lotes.por_produto': '''
+            SELECT l.*, lc.nome as local_nome
+            FROM lotes l
+            JOIN locais lc ON lc.id = l.local_id
+            WHERE l.produto_id = ? AND l.saldo > 0
+            ORDER BY l.data_validade IS NULL, l.data_validade, l.id
+        ''',
+        'movimentacoes_lotes.inserir': '''
+            INSERT INTO movimentacoes_lotes (movimentacao_id, lote_id, quantidade) VALUES (?, ?, ?)
+        ''',
+        'custos.por_produto': 'SELECT * FROM custos_produto WHERE produto_id = ?',
+        'custos.entrada': '''
+            INSERT INTO custos_produto (produto_id, quantidade, custo_medio, valor_fifo)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (produto_id) DO UPDATE SET
+                custo_medio = CASE
+                    WHEN custos_produto.quantidade + excluded.quantidade > 0 AND custos_produto.quantidade > 0
+                        THEN (custos_produto.quantidade * custos_produto.custo_medio
+                              + excluded.quantidade * excluded.custo_medio)
+                             / (custos_produto.quantidade + excluded.quantidade)
+                    ELSE excluded.custo_medio
+                END,
+                quantidade = custos_produto.quantidade + excluded.quantidade,
+                valor_fifo = custos_produto.valor_fifo + excluded.valor_fifo,
+                updated_at = CURRENT_TIMESTAMP
+        ''',
+        'custos.saida': '''
+            UPDATE custos_produto SET
+                quantidade = quantidade - ?,
+                valor_fifo = MAX(valor_fifo - ?, 0.0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE produto_id = ?
+        ''',
+        'custos.camada_inserir': '''
+            INSERT INTO camadas_custo (produto_id, movimentacao_id, quantidade_inicial, saldo, custo_unitario)
+            VALUES (?, ?, ?, ?, ?)
+        ''',
+        'custos.camadas_abertas': '''
+            SELECT id, saldo, custo_unitario FROM camadas_custo
+            WHERE produto_id = ? AND saldo > 0
+            ORDER BY id
+        ''',
+        'custos.camada_baixar': 'UPDATE camadas_custo SET saldo = saldo - ? WHERE id = ?',
+        'custos.existe': 'SELECT EXISTS (SELECT 1 FROM custos_produto)',
+        'custos.valorizacao': '''
+            SELECT
+                p.id, p.nome, p.estoque_atual, p.preco_venda,
+                COALESCE(cp.custo_medio, 0.0) as custo_medio,
+                p.estoque_atual * COALESCE(cp.custo_medio, 0.0) as valor_custo_medio,
+                COALESCE(cp.valor_fifo, 0.0) as valor_fifo,
+                p.estoque_atual * p.preco_venda as valor_venda
+            FROM produtos p
+            LEFT JOIN custos_produto cp ON cp.produto_id = p.id
+            WHERE p.ativo = 1
+            ORDER BY p.nome
+        ''',
+        'custos.totais': '''
+            SELECT
+                COALESCE(SUM(p.estoque_atual * COALESCE(cp.custo_medio, 0.0)), 0.0) as valor_custo_medio,
+                COALESCE(SUM(cp.valor_fifo), 0.0) as valor_fifo,
+                COALESCE(SUM(p.estoque_atual * p.preco_venda), 0.0) as valor_venda
+            FROM produtos p
+            LEFT JOIN custos_produto cp ON cp.produto_id = p.id
+            WHERE p.ativo = 1
+        ''',
+        'jobs.inserir': '''
+            INSERT INTO jobs (tipo, parametros, max_tentativas, intervalo_segundos, agendado_para)
+            VALUES (?, ?, ?, ?, datetime('now', ?))
+        ''',
+        'jobs.proximo': '''
+            SELECT id FROM jobs
+            WHERE status = 'PENDENTE' AND agendado_para <= datetime('now')
+            ORDER BY agendado_para, id
+            LIMIT 1
+        ''',
+        'jobs.iniciar': '''
+            UPDATE jobs SET status = 'EXECUTANDO', started_at = CURRENT_TIMESTAMP,
+                tentativas = tentativas + 1, progresso = 0.0
+            WHERE id = ? AND status = 'PENDENTE'
+        ''',
+        'jobs.por_id': 'SELECT * FROM jobs WHERE id = ?',
+        'jobs.progresso': 'UPDATE jobs SET progresso = ?, mensagem = ? WHERE id = ?',
+        'jobs.finalizar': '''
+            UPDATE jobs SET status = ?, progresso = ?, mensagem = ?, resultado = ?,
+                finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''',
+        'jobs.reagendar': '''
+            UPDATE jobs SET status = 'PENDENTE', mensagem = ?, agendado_para = datetime('now', ?)
+            WHERE id = ?
+        ''',
+        'jobs.cancelar': '''
+            UPDATE jobs SET cancelar = 1,
+                status = CASE WHEN status = 'PENDENTE' THEN 'CANCELADO' ELSE status END,
+                finished_at = CASE WHEN status = 'PENDENTE' THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE id = ? AND status IN ('PENDENTE', 'EXECUTANDO')
+        ''',
+        'jobs.cancelamento_pedido': 'SELECT cancelar FROM jobs WHERE id = ?',
+        'jobs.recuperar': '''
+            UPDATE jobs SET status = 'PENDENTE', mensagem = 'Reiniciado após interrupção'
+            WHERE status = 'EXECUTANDO'
+        ''',
+        'jobs.recorrente_pendente': '''
+            SELECT id FROM jobs
+            WHERE tipo = ? AND parametros = ? AND intervalo_segundos IS NOT NULL
+                AND status IN ('PENDENTE', 'EXECUTANDO')
+            LIMIT 1
+        ''',
+        'jobs.listar': 'SELECT * FROM jobs ORDER BY id DESC LIMIT ?',
+        'compras.sugestoes': '''
+            SELECT
+                p.id as produto_id, p.nome as produto_nome, p.fornecedor_id,
+                f.nome as fornecedor_nome, p.estoque_atual, p.estoque_minimo, p.estoque_maximo,
+                COALESCE(pend.quantidade, 0) as em_pedido,
+                p.estoque_maximo - p.estoque_atual - COALESCE(pend.quantidade, 0) as quantidade,
+                p.preco_compra as custo_unitario
+            FROM produtos p
+            LEFT JOIN fornecedores f ON f.id = p.fornecedor_id
+            LEFT JOIN (
+                SELECT i.produto_id, SUM(i.quantidade) as quantidade
+                FROM pedidos_compra_itens i
+                JOIN pedidos_compra pc ON pc.id = i.pedido_id
+                WHERE pc.status = 'ABERTO'
+                GROUP BY i.produto_id
+            ) pend ON pend.produto_id = p.id
+            WHERE p.ativo = 1
+                AND p.estoque_atual <= p.estoque_minimo
+                AND p.estoque_maximo - p.estoque_atual - COALESCE(pend.quantidade, 0) > 0
+                AND NOT EXISTS (SELECT 1 FROM kits_componentes k WHERE k.kit_id = p.id)
+            ORDER BY f.nome, p.nome
+        ''',
+        'compras.pedido_inserir': '''
+            INSERT INTO pedidos_compra (fornecedor_id, observacao) VALUES (?, ?)
+        ''',
+        'compras.item_inserir': '''
+            INSERT INTO pedidos_compra_itens (pedido_id, produto_id, quantidade, custo_unitario)
+            VALUES (?, ?, ?, ?)
+        ''',
+        'compras.pedidos_abertos': '''
+            SELECT
+                pc.id, pc.fornecedor_id, f.nome as fornecedor_nome, pc.status, pc.created_at,
+                COUNT(i.id) as qtd_itens,
+                COALESCE(SUM(i.quantidade * i.custo_unitario), 0.0) as valor_total
+            FROM pedidos_compra pc
+            JOIN fornecedores f ON f.id = pc.fornecedor_id
+            LEFT JOIN pedidos_compra_itens i ON i.pedido_id = pc.id
+            WHERE pc.status = 'ABERTO'
+            GROUP BY pc.id
+            ORDER BY pc.id
+        ''',
+        'compras.pedido_por_id': 'SELECT * FROM pedidos_compra WHERE id = ?',
+        'compras.itens': '''
+            SELECT i.*, p.nome as produto_nome
+            FROM pedidos_compra_itens i
+            JOIN produtos p ON p.id = i.produto_id
+            WHERE i.pedido_id = ?
+            ORDER BY i.id
+        ''',
+        'compras.pedido_status': '''
+            UPDATE pedidos_compra SET status = ?,
+                received_at = CASE WHEN ? = 'RECEBIDO' THEN CURRENT_TIMESTAMP ELSE received_at END
+            WHERE id = ? AND status = 'ABERTO'
+        ''',
+        'contagens.inserir': 'INSERT INTO contagens (local_id, observacao) VALUES (?, ?)',
+        'contagens.congelar': '''
+            INSERT INTO contagens_itens (contagem_id, produto_id, estoque_congelado)
+            SELECT ?, p.id, COALESCE(el.quantidade, 0)
+            FROM produtos p
+            LEFT JOIN estoque_local el ON el.produto_id = p.id AND el.local_id = ?
+            WHERE p.ativo = 1
+        ''',
+        'contagens.por_id': 'SELECT * FROM contagens WHERE id = ?',
+        'contagens.abertas': '''
+            SELECT
+                c.id, c.local_id, l.nome as local_nome, c.observacao, c.created_at,
+                COUNT(ci.produto_id) as qtd_itens,
+                COUNT(ci.quantidade_contada) as qtd_contados
+            FROM contagens c
+            JOIN locais l ON l.id = c.local_id
+            LEFT JOIN contagens_itens ci ON ci.contagem_id = c.id
+            WHERE c.status = 'ABERTA'
+            GROUP BY c.id, l.nome
+            ORDER BY c.id
+        ''',
+        'contagens.produtos': 'SELECT produto_id FROM contagens_itens WHERE contagem_id = ?',
+        'contagens.definir': '''
+            UPDATE contagens_itens SET quantidade_contada = ?
+            WHERE contagem_id = ? AND produto_id = ?
+        ''',
+        'contagens.somar': '''
+            UPDATE contagens_itens SET quantidade_contada = COALESCE(quantidade_contada, 0) + ?
+            WHERE contagem_id = ? AND produto_id = ?
+        ''',
+        'contagens.zerar_nao_contados': '''
+            UPDATE contagens_itens SET quantidade_contada = 0
+            WHERE contagem_id = ? AND quantidade_contada IS NULL
+        ''',
+        'contagens.divergencias': '''
+            SELECT
+                ci.produto_id, p.nome as produto_nome, p.preco_compra,
+                ci.estoque_congelado, ci.quantidade_contada,
+                ci.quantidade_contada - ci.estoque_congelado as diferenca,
+                COALESCE(el.quantidade, 0) as estoque_local
+            FROM contagens_itens ci
+            JOIN contagens c ON c.id = ci.contagem_id
+            JOIN produtos p ON p.id = ci.produto_id
+            LEFT JOIN estoque_local el ON el.produto_id = ci.produto_id AND el.local_id = c.local_id
+            WHERE ci.contagem_id = ? AND ci.quantidade_contada IS NOT NULL
+              AND ci.quantidade_contada <> ci.estoque_congelado
+            ORDER BY ABS(ci.quantidade_contada - ci.estoque_congelado) DESC, ci.produto_id
+        ''',
+        'contagens.status': '''
+            UPDATE contagens SET status = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'ABERTA'
+        ''',
+        'reservas.inserir': '''
+            INSERT INTO reservas (produto_id, local_id, quantidade, referencia, expira_epoch)
+            VALUES (?, ?, ?, ?, ?)
+        ''',
+        'reservas.reter_local': '''
+            UPDATE estoque_local SET reservado = reservado + ?
+            WHERE produto_id = ? AND local_id = ? AND quantidade - reservado >= ?
+        ''',
+        'reservas.soltar_local': '''
+            UPDATE estoque_local SET reservado = reservado - ?
+            WHERE produto_id = ? AND local_id = ?
+        ''',
+        'reservas.ajustar_produto': '''
+            UPDATE produtos SET estoque_reservado = estoque_reservado + ? WHERE id = ?
+        ''',
+        'reservas.por_id': 'SELECT * FROM reservas WHERE id = ?',
+        'reservas.finalizar': '''
+            UPDATE reservas SET status = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'ATIVA'
+        ''',
+        'reservas.vencidas': '''
+            SELECT id, produto_id, local_id, quantidade FROM reservas
+            WHERE status = 'ATIVA' AND expira_epoch <= ?
+            ORDER BY expira_epoch LIMIT ?
+        ''',
+        'reservas.ativas': '''
+            SELECT r.id, r.produto_id, p.nome as produto_nome, r.local_id, r.quantidade,
+                   r.referencia, r.expira_epoch, r.created_at
+            FROM reservas r
+            JOIN produtos p ON p.id = r.produto_id
+            WHERE r.status = 'ATIVA' AND (? IS NULL OR r.produto_id = ?)
+            ORDER BY r.expira_epoch
+        ''',
+        'reservas.disponivel_local': '''
+            SELECT quantidade - reservado FROM estoque_local WHERE produto_id = ? AND local_id = ?
+        ''',
+        'reservas.disponivel': 'SELECT estoque_atual - estoque_reservado FROM produtos WHERE id = ?',
+        'kits.estrutura': 'SELECT kit_id, componente_id, quantidade FROM kits_componentes',
+        'kits.explodidos': 'SELECT kit_id, componente_id, quantidade FROM kits_explodidos',
+        'kits.limpar': 'DELETE FROM kits_componentes WHERE kit_id = ?',
+        'kits.inserir': 'INSERT INTO kits_componentes (kit_id, componente_id, quantidade) VALUES (?, ?, ?)',
+        'kits.limpar_explosao': 'DELETE FROM kits_explodidos',
+        'kits.inserir_explosao': '''
+            INSERT INTO kits_explodidos (kit_id, componente_id, quantidade) VALUES (?, ?, ?)
+        ''',
+        'kits.disponivel': '''
+            SELECT MIN((p.estoque_atual - p.estoque_reservado) / ke.quantidade)
+            FROM kits_explodidos ke
+            JOIN produtos p ON p.id = ke.componente_id
+            WHERE ke.kit_id = ?
+        ''',
+        'kits.disponivel_local': '''
+            SELECT MIN(COALESCE(el.quantidade - el.reservado, 0) / ke.quantidade)
+            FROM kits_explodidos ke
+            LEFT JOIN estoque_local el ON el.produto_id = ke.componente_id AND el.local_id = ?
+            WHERE ke.kit_id = ?
+        ''',
+        'kits.disponibilidade': '''
+            SELECT ke.kit_id, MIN((p.estoque_atual - p.estoque_reservado) / ke.quantidade) as disponivel
+            FROM kits_explodidos ke
+            JOIN produtos p ON p.id = ke.componente_id
+            GROUP BY ke.kit_id
+        ''',
+        'replicacao.no': 'SELECT node_id FROM replicacao_no WHERE id = 1',
+        'replicacao.criar_no': 'INSERT OR IGNORE INTO replicacao_no (id, node_id) VALUES (1, ?)',
+        'replicacao.trocar_no': 'UPDATE replicacao_no SET node_id = ? WHERE id = 1',
+        'replicacao.registrar': '''
+            INSERT INTO replicacao_log (node_id, sequencia, tipo, dados, created_epoch)
+            SELECT ?, COALESCE(MAX(sequencia), 0) + 1, ?, ?, ? FROM replicacao_log WHERE node_id = ?
+        ''',
+        'replicacao.incluir': '''
+            INSERT INTO replicacao_log (node_id, sequencia, tipo, dados, created_epoch)
+            VALUES (?, ?, ?, ?, ?)
+        ''',
+        'replicacao.sequencia': 'SELECT MAX(sequencia) FROM replicacao_log WHERE node_id = ?',
+        'replicacao.vetor': 'SELECT node_id, sequencia FROM replicacao_vetor',
+        'replicacao.avancar': '''
+            INSERT INTO replicacao_vetor (node_id, sequencia) VALUES (?, ?)
+            ON CONFLICT (node_id) DO UPDATE SET sequencia = excluded.sequencia
+        ''',
+        'replicacao.alteracoes': '''
+            SELECT sequencia, tipo, dados, created_epoch FROM replicacao_log
+            WHERE node_id = ? AND sequencia > ?
+            ORDER BY sequencia
+        ''',
+        'replicacao.par': 'SELECT vetor FROM replicacao_pares WHERE peer_id = ?',
+        'replicacao.pares': 'SELECT peer_id, atualizado_em FROM replicacao_pares ORDER BY atualizado_em DESC',
+        'replicacao.salvar_par': '''
+            INSERT INTO replicacao_pares (peer_id, vetor, atualizado_em) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (peer_id) DO UPDATE SET vetor = excluded.vetor, atualizado_em = excluded.atualizado_em
+        ''',
+        'replicacao.uid': 'SELECT uid FROM produtos WHERE id = ?',
+        'replicacao.definir_uid': 'UPDATE produtos SET uid = ? WHERE id = ? AND uid IS NULL',
+        'replicacao.produto_por_uid': 'SELECT id, rep_versao FROM produtos WHERE uid = ?',
+        'replicacao.produto': '''
+            SELECT nome, descricao, categoria_id, fornecedor_id, preco_compra, preco_venda,
+                   estoque_minimo, estoque_maximo, unidade_medida, sku, ean, ativo
+            FROM produtos WHERE id = ?
+        ''',
+        'replicacao.versao_produto': 'UPDATE produtos SET rep_versao = ? WHERE id = ?',
+        'replicacao.aplicar_produto': '''
+            UPDATE produtos SET
+                nome = ?, descricao = ?, categoria_id = ?, fornecedor_id = ?,
+                preco_compra = ?, preco_venda = ?, estoque_minimo = ?,
+                estoque_maximo = ?, unidade_medida = ?, sku = ?, ean = ?, ativo = ?,
+                rep_versao = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''',
+        'replicacao.novo_produto': 'UPDATE produtos SET uid = ?, ativo = ?, rep_versao = ? WHERE id = ?',
+        'replicacao.sku_em_uso': 'SELECT id FROM produtos WHERE sku = ? AND id <> COALESCE(?, 0)',
+        'replicacao.ean_em_uso': 'SELECT id FROM produtos WHERE ean = ? AND id <> COALESCE(?, 0)',
+        'transferencias.inserir': '''
+            INSERT INTO transferencias (produto_id, origem_id, destino_id, quantidade, observacao)
+            VALUES (?, ?, ?, ?, ?)
+        ''',
+        'manutencao.produtos_inativos': '''
+            SELECT p.id FROM produtos p
+            WHERE p.ativo = 0 AND p.updated_at < datetime('now', ?)
+              AND p.estoque_atual = 0 AND p.estoque_reservado = 0
+              AND NOT EXISTS (SELECT 1 FROM movimentacoes m WHERE m.produto_id = p.id)
+              AND NOT EXISTS (SELECT 1 FROM reservas r WHERE r.produto_id = p.id)
+              AND NOT EXISTS (SELECT 1 FROM pedidos_compra_itens i WHERE i.produto_id = p.id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM contagens_itens ci JOIN contagens c ON c.id = ci.contagem_id
+                  WHERE ci.produto_id = p.id AND c.status = 'ABERTA'
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM kits_componentes k WHERE k.kit_id = p.id OR k.componente_id = p.id
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM kits_explodidos ke WHERE ke.kit_id = p.id OR ke.componente_id = p.id
+              )
+              AND NOT EXISTS (SELECT 1 FROM transferencias t WHERE t.produto_id = p.id)
+              AND NOT EXISTS (SELECT 1 FROM lotes l WHERE l.produto_id = p.id AND l.saldo <> 0)
+            ORDER BY p.id LIMIT ?
+        ''',
+        'manutencao.arquivar_produto': '''
+            INSERT INTO produtos_arquivados (
+                id, uid, nome, descricao, categoria_id, fornecedor_id, preco_compra,
+                preco_venda, unidade_medida, sku, ean, desativado_em
+            )
+            SELECT id, uid, nome, descricao, categoria_id, fornecedor_id, preco_compra,
+                   preco_venda, unidade_medida, sku, ean, updated_at
+            FROM produtos WHERE id = ?
+        ''',
+        'manutencao.remover_estoque_local': 'DELETE FROM estoque_local WHERE produto_id = ?',
+        'manutencao.remover_lotes_movimentacoes': '''
+            DELETE FROM movimentacoes_lotes WHERE lote_id IN (SELECT id FROM lotes WHERE produto_id = ?)
+        ''',
+        'manutencao.remover_lotes': 'DELETE FROM lotes WHERE produto_id = ?',
+        'manutencao.remover_custos': 'DELETE FROM custos_produto WHERE produto_id = ?',
+        'manutencao.remover_camadas': 'DELETE FROM camadas_custo WHERE produto_id = ?',
+        'manutencao.remover_demanda': 'DELETE FROM demanda_mensal WHERE produto_id = ?',
+        'manutencao.remover_contagens': 'DELETE FROM contagens_itens WHERE produto_id = ?',
+        'manutencao.remover_produto': 'DELETE FROM produtos WHERE id = ? AND ativo = 0',
+        'manutencao.arquivados': 'SELECT COUNT(*) FROM produtos_arquivados',
+        'classificacao.marca': 'SELECT ultima_movimentacao FROM classificacao_estado WHERE id = 1',
+        'classificacao.gravar_marca': '''
+            INSERT INTO classificacao_estado (id, ultima_movimentacao, atualizado_em)
+            VALUES (1, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET
+                ultima_movimentacao = excluded.ultima_movimentacao,
+                atualizado_em = excluded.atualizado_em
+        ''',
+        'classificacao.ultima_movimentacao': 'SELECT COALESCE(MAX(id), 0) FROM movimentacoes',
+        'classificacao.ultima_historico': 'SELECT COALESCE(MAX(id), 0) FROM movimentacoes_todas',
+        'classificacao.acumular_demanda': '''
+            INSERT INTO demanda_mensal (produto_id, periodo, quantidade, valor)
+            SELECT produto_id, substr(CAST(data_movimentacao AS TEXT), 1, 7), SUM(quantidade), SUM(valor_total)
+            FROM movimentacoes
+            WHERE id > ? AND id <= ? AND tipo = 'SAIDA' AND transferencia_id IS NULL
+            GROUP BY produto_id, substr(CAST(data_movimentacao AS TEXT), 1, 7)
+            ON CONFLICT (produto_id, periodo) DO UPDATE SET
+                quantidade = demanda_mensal.quantidade + excluded.quantidade,
+                valor = demanda_mensal.valor + excluded.valor
+        ''',
+        'classificacao.reconstruir_demanda': '''
+            INSERT INTO demanda_mensal (produto_id, periodo, quantidade, valor)
+            SELECT produto_id, substr(CAST(data_movimentacao AS TEXT), 1, 7), SUM(quantidade), SUM(valor_total)
+            FROM movimentacoes_todas
+            WHERE id <= ? AND tipo = 'SAIDA' AND data_epoch >= ? AND transferencia_id IS NULL
+            GROUP BY produto_id, substr(CAST(data_movimentacao AS TEXT), 1, 7)
+        ''',
+        'classificacao.limpar_demanda': 'DELETE FROM demanda_mensal',
+        'classificacao.descartar_demanda': 'DELETE FROM demanda_mensal WHERE periodo < ?',
+        'classificacao.calcular': '''
+            WITH consumo AS (
+                SELECT
+                    p.id, p.classe_abc, p.classe_xyz,
+                    COALESCE(SUM(d.valor), 0.0) as valor,
+                    COALESCE(SUM(d.quantidade), 0) as quantidade,
+                    COALESCE(SUM(d.quantidade * d.quantidade), 0) as quadrados
+                FROM produtos p
+                LEFT JOIN demanda_mensal d ON d.produto_id = p.id AND d.periodo >= ?
+                WHERE p.ativo = 1
+                GROUP BY p.id, p.classe_abc, p.classe_xyz
+            )
+            SELECT
+                id, classe_abc, classe_xyz, valor, quantidade, quadrados,
+                SUM(valor) OVER (ORDER BY valor DESC, id ROWS UNBOUNDED PRECEDING) - valor as acumulado,
+                SUM(valor) OVER () as total
+            FROM consumo
+        ''',
+        'classificacao.gravar': 'UPDATE produtos SET classe_abc = ?, classe_xyz = ? WHERE id = ?',
+        'classificacao.limpar_inativos': '''
+            UPDATE produtos SET classe_abc = NULL, classe_xyz = NULL
+            WHERE ativo = 0 AND classe_abc IS NOT NULL
+        ''',
+        'classificacao.resumo': '''
+            SELECT classe_abc, classe_xyz, COUNT(*) as qtd_produtos
+            FROM produtos
+            WHERE ativo = 1 AND classe_abc IS NOT NULL
+            GROUP BY classe_abc, classe_xyz
+            ORDER BY classe_abc, classe_xyz
+        ''',
+        'api.produtos_pagina': _PRODUCT_SELECT + '''
+            WHERE p.ativo = 1 AND p.id > ? AND (? IS NULL OR p.categoria_id = ?)
+              AND (? IS NULL OR p.classe_abc = ?) AND (? IS NULL OR p.classe_xyz = ?)
+            ORDER BY p.id LIMIT ?
+        ''',
+        'api.movimentacoes_pagina': _MOVEMENT_SELECT + '''
+            WHERE m.id > ? AND (? IS NULL OR m.produto_id = ?)
+            ORDER BY m.id LIMIT ?
+        ''',
+        'api.estoque_categorias': '''
+            SELECT
+                c.id as categoria_id, c.nome as categoria_nome,
+                COUNT(p.id) as qtd_produtos,
+                COALESCE(SUM(p.estoque_atual), 0) as quantidade,
+                COALESCE(SUM(p.estoque_atual * p.preco_venda), 0.0) as valor
+            FROM produtos p
+            LEFT JOIN categorias c ON p.categoria_id = c.id
+            WHERE p.ativo = 1
+            GROUP BY c.id, c.nome
+            ORDER BY c.nome
+        ''',
+        'categorias.listar': 'SELECT * FROM categorias ORDER BY nome',
+        'fornecedores.listar': 'SELECT * FROM fornecedores ORDER BY nome',
+    }
+    
+    @classmethod
+    def register(cls, name: str, sql: str):
+        """Registra (ou substitui) um comando nomeado"""
+        cls._statements[name] = sql
+    
+    @classmethod
+    def get(cls, name: str) -> str:
+        """Retorna o SQL de um comando nomeado"""
+        try:
+            return cls._statements[name]
+        except KeyError:
+            raise KeyError(f"Comando SQL não registrado: {name}")
+    
+    @classmethod
+    def names(cls) -> List[str]:
+        return sorted(cls._statements)
+
+class StorageBackend:
+    """Interface de armazenamento usada pelo DatabaseManager
+    
+    Os comandos são escritos no dialeto do SQLite (placeholders "?");
+    cada backend traduz o necessário para o seu banco. Recursos que
+    dependem do arquivo local (ATTACH dos arquivos anuais, backup online,
+    workers de exportação e pool da API) só existem quando supports_files.
+    """
+    
+    name = 'base'
+    supports_files = False
+    
+    def connect(self):
+        raise NotImplementedError
+    
+    def close(self):
+        raise NotImplementedError
+    
+    @property
+    def in_transaction(self) -> bool:
+        raise NotImplementedError
+    
+    def begin(self):
+        raise NotImplementedError
+    
+    def commit(self):
+        raise NotImplementedError
+    
+    def rollback(self):
+        raise NotImplementedError
+    
+    def execute(self, sql: str, params: tuple = ()):
+        """Executa um comando na conexão de escrita e retorna o cursor"""
+        raise NotImplementedError
+    
+    def executemany(self, sql: str, seq_params):
+        raise NotImplementedError
+    
+    def command_result(self, sql: str, cursor) -> int:
+        """ID gerado (INSERT) ou linhas afetadas"""
+        raise NotImplementedError
+    
+    def fetch_all(self, sql: str, params: tuple = (), record_type=None) -> List[Any]:
+        raise NotImplementedError
+    
+    def iterate(self, sql: str, params: tuple = (), batch_size: int = 1000):
+        """Percorre o resultado em blocos, sem carregar tudo em memória"""
+        raise NotImplementedError
+    
+    def table_columns(self, table: str) -> set:
+        raise NotImplementedError
+    
+    def explain(self, sql: str, params: tuple = ()) -> List[str]:
+        raise NotImplementedError
+    
+    def after_schema(self):
+        """Ajustes do backend após criar/migrar as tabelas"""
+    
+    def storage_stats(self) -> Dict[str, int]:
+        """Tamanho da página, total de páginas e páginas livres do banco"""
+        raise NotImplementedError
+    
+    def compact(self, max_pages: int = None):
+        """Devolve páginas livres ao sistema (fora de transação)"""
+        raise NotImplementedError
+    
+    def analyze(self):
+        """Atualiza as estatísticas usadas pelo planejador de consultas"""
+        self.execute('ANALYZE')
+    
+    def schema_version(self) -> int:
+        """Versão do schema gravada no banco (0 se nunca criado)"""
+        raise NotImplementedError
+    
+    def set_schema_version(self, version: int):
+        raise NotImplementedError
+
+class SQLiteBackend(StorageBackend):
+    """Backend padrão: arquivo SQLite local, uma conexão compartilhada"""
+    
+    name = 'sqlite'
+    
+    def __init__(self, path: str):
+        # path: arquivo, ':memory:' ou URI 'file:...' (ex.: 'file:loja?mode=memory&cache=shared')
+        self.path = path
+        self.uri = path.startswith('file:')
+        self.in_memory = path == ':memory:' or (
+            self.uri and ('mode=memory' in path or path.startswith('file::memory:'))
+        )
+        self.supports_files = not self.in_memory
+        self.file_path = None if self.in_memory else (path[5:].split('?')[0] if self.uri else path)
+        self.connection = None
+    
+    def connect(self):
+        if self.file_path:
+            os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=256,
+            uri=self.uri
+        )
+        self.connection.row_factory = sqlite3.Row
+        # Só tem efeito em bancos novos; os existentes mudam no primeiro compact()
+        self.connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if self.file_path:
+            # WAL: leituras (read_committed, pool da API) não bloqueiam o escritor nem são bloqueadas
+            self.connection.execute('PRAGMA journal_mode=WAL')
+    
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+    
+    @property
+    def in_transaction(self) -> bool:
+        return self.connection.in_transaction
+    
+    def begin(self):
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN')
+    
+    def commit(self):
+        self.connection.commit()
+    
+    def rollback(self):
+        self.connection.rollback()
+    
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        return cursor
+    
+    def executemany(self, sql: str, seq_params):
+        self.connection.executemany(sql, seq_params)
+    
+    def command_result(self, sql: str, cursor: sqlite3.Cursor) -> int:
+        # lastrowid guarda o último INSERT da conexão mesmo após um UPDATE/DELETE,
+        # então só é usado quando o próprio comando é um INSERT
+        if sql.lstrip()[:6].upper() in ('INSERT', 'REPLAC') and cursor.lastrowid:
+            return cursor.lastrowid
+        return cursor.rowcount
+    
+    def fetch_all(self, sql: str, params: tuple = (), record_type=None) -> List[Any]:
+        cursor = self.connection.cursor()
+        if record_type is not None:
+            cursor.row_factory = None
+            cursor.execute(sql, params)
+            return list(map(record_type._make, cursor.fetchall()))
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    
+    def iterate(self, sql: str, params: tuple = (), batch_size: int = 1000):
+        cursor = self.connection.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    
+    def table_columns(self, table: str) -> set:
+        return {row['name'] for row in self.connection.execute(f'PRAGMA table_info({table})')}
+    
+    def explain(self, sql: str, params: tuple = ()) -> List[str]:
+        cursor = self.connection.cursor()
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row['detail'] for row in cursor.fetchall()]
+    
+    def storage_stats(self) -> Dict[str, int]:
+        return {
+            name: self.connection.execute(f'PRAGMA {name}').fetchone()[0]
+            for name in ('page_size', 'page_count', 'freelist_count')
+        }
+    
+    def compact(self, max_pages: int = None):
+        if self.connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Banco criado sem auto_vacuum incremental: um VACUUM completo (uma única vez) converte
+            self.connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self.connection.execute('VACUUM')
+            return
+        # Cada execução do pragma libera uma única página (um passo da instrução):
+        # repete uma vez por página, em uma transação só (executescript faria commit
+        # de qualquer transação aberta na conexão)
+        pages = self.connection.execute('PRAGMA freelist_count').fetchone()[0]
+        if max_pages:
+            pages = min(pages, max_pages)
+        if not pages:
+            return
+        self.begin()
+        try:
+            for _ in range(pages):
+                self.connection.execute('PRAGMA incremental_vacuum(1)')
+        except Exception:
+            self.rollback()
+            raise
+        self.commit()
+    
+    def analyze(self):
+        # Amostragem limitada: o ANALYZE não lê tabelas grandes inteiras
+        self.connection.execute('PRAGMA analysis_limit = 1000')
+        self.connection.execute('ANALYZE')
+    
+    def schema_version(self) -> int:
+        return self.connection.execute('PRAGMA user_version').fetchone()[0]
+    
+    def set_schema_version(self, version: int):
+        self.connection.execute(f'PRAGMA user_version = {int(version)}')
+
+class PostgresBackend(StorageBackend):
+    """Backend PostgreSQL (opcional, requer psycopg2)
+    
+    Escritas usam uma conexão dedicada, protegida pelo lock de escrita do
+    DatabaseManager; leituras fora da transação em andamento usam um pool
+    de conexões, e iterate() usa cursores do lado do servidor. Vários
+    processos podem escrever no mesmo banco ao mesmo tempo.
+    """
+    
+    name = 'postgresql'
+    file_path = None
+    
+    _REWRITES = [
+        (re.compile(r'INTEGER PRIMARY KEY AUTOINCREMENT', re.I), 'BIGSERIAL PRIMARY KEY'),
+        (re.compile(r'\bBOOLEAN DEFAULT (\d)', re.I), r'SMALLINT DEFAULT \1'),
+        (re.compile(r'\bREAL\b'), 'DOUBLE PRECISION'),
+        (re.compile(r"datetime\('now', \?\)", re.I), '(LOCALTIMESTAMP + CAST(? AS INTERVAL))'),
+        (re.compile(r"datetime\('now'\)", re.I), 'LOCALTIMESTAMP'),
+        (re.compile(r"CAST\(strftime\('%s', (\w+)\) AS INTEGER\)", re.I), r'CAST(EXTRACT(EPOCH FROM \1) AS BIGINT)'),
+    ]
+    _INSERT_OR_IGNORE = re.compile(r'INSERT OR IGNORE INTO', re.I)
+    _INSERT_TABLE = re.compile(r'^\s*INSERT\s+INTO\s+(\w+)', re.I)
+    
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = 10):
+        if psycopg2 is None:
+            raise RuntimeError("Backend PostgreSQL requer o pacote psycopg2 (pip install psycopg2-binary)")
+        self.dsn = dsn
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.connection = None
+        self.pool = None
+        self._serial_tables = set()
+        self._translated = {}
+        self._tx_owner = None
+        self._cursor_ids = itertools.count()
+    
+    def connect(self):
+        # Timestamps em UTC e devolvidos como texto, e NUMERIC (SUM/AVG) como float, como no SQLite
+        options = '-c timezone=UTC'
+        psycopg2.extensions.register_type(psycopg2.extensions.new_type(
+            (1114,), 'TIMESTAMP_TEXT', lambda value, cursor: value[:19] if value else value
+        ))
+        psycopg2.extensions.register_type(psycopg2.extensions.new_type(
+            psycopg2.extensions.DECIMAL.values, 'NUMERIC_FLOAT',
+            lambda value, cursor: float(value) if value is not None else None
+        ))
+        self.connection = psycopg2.connect(self.dsn, options=options)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            self.min_connections, self.max_connections, self.dsn, options=options
+        )
+        self._load_serial_tables()
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+    
+    @property
+    def in_transaction(self) -> bool:
+        return self._tx_owner is not None
+    
+    def begin(self):
+        # psycopg2 abre a transação no primeiro comando
+        self._tx_owner = threading.get_ident()
+    
+    def commit(self):
+        self.connection.commit()
+        self._tx_owner = None
+    
+    def rollback(self):
+        self.connection.rollback()
+        self._tx_owner = None
+    
+    def translate(self, sql: str) -> str:
+        """Converte um comando do dialeto SQLite para o PostgreSQL"""
+        translated = self._translated.get(sql)
+        if translated is not None:
+            return translated
+        
+        translated = sql.strip()
+        for pattern, replacement in self._REWRITES:
+            translated = pattern.sub(replacement, translated)
+        if self._INSERT_OR_IGNORE.search(translated):
+            translated = self._INSERT_OR_IGNORE.sub('INSERT INTO', translated) + ' ON CONFLICT DO NOTHING'
+        
+        match = self._INSERT_TABLE.match(translated)
+        if match and match.group(1).lower() in self._serial_tables:
+            translated += ' RETURNING id'
+        
+        translated = translated.replace('%', '%%').replace('?', '%s')
+        self._translated[sql] = translated
+        return translated
+    
+    def _load_serial_tables(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('''
+                SELECT table_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND column_name = 'id'
+                  AND column_default LIKE 'nextval%'
+            ''')
+            self._serial_tables = {row[0] for row in cursor.fetchall()}
+        self.connection.commit()
+        self._translated.clear()
+    
+    def _owns_transaction(self) -> bool:
+        return self._tx_owner == threading.get_ident()
+    
+    @contextmanager
+    def _read_connection(self):
+        # Dentro da transação, a leitura precisa enxergar as próprias escritas
+        if self._owns_transaction():
+            yield self.connection
+            return
+        
+        connection = self.pool.getconn()
+        try:
+            yield connection
+        finally:
+            connection.rollback()  # encerra a transação de leitura
+            self.pool.putconn(connection)
+    
+    def execute(self, sql: str, params: tuple = ()):
+        cursor = self.connection.cursor()
+        cursor.execute(self.translate(sql), params)
+        return cursor
+    
+    def executemany(self, sql: str, seq_params):
+        with self.connection.cursor() as cursor:
+            psycopg2.extras.execute_batch(cursor, self.translate(sql), list(seq_params))
+    
+    def command_result(self, sql: str, cursor) -> int:
+        if cursor.description is not None:
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        return cursor.rowcount
+    
+    def fetch_all(self, sql: str, params: tuple = (), record_type=None) -> List[Any]:
+        with self._read_connection() as connection:
+            if record_type is not None:
+                with connection.cursor() as cursor:
+                    cursor.execute(self.translate(sql), params)
+                    return list(map(record_type._make, cursor.fetchall()))
+            with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(self.translate(sql), params)
+                return cursor.fetchall()
+    
+    def iterate(self, sql: str, params: tuple = (), batch_size: int = 1000):
+        with self._read_connection() as connection:
+            # Cursor nomeado: o servidor envia batch_size linhas por vez
+            with connection.cursor(name=f'iter_{next(self._cursor_ids)}') as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(self.translate(sql), params)
+                yield from cursor
+    
+    def table_columns(self, table: str) -> set:
+        rows = self.fetch_all(
+            'SELECT column_name FROM information_schema.columns '
+            'WHERE table_schema = current_schema() AND table_name = ?',
+            (table,)
+        )
+        return {row[0] for row in rows}
+    
+    def explain(self, sql: str, params: tuple = ()) -> List[str]:
+        with self._read_connection() as connection, connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + self.translate(sql), params)
+            return [row[0] for row in cursor.fetchall()]
+    
+    def schema_version(self) -> int:
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS schema_versao (versao INTEGER NOT NULL)')
+            cursor.execute('SELECT MAX(versao) FROM schema_versao')
+            version = cursor.fetchone()[0]
+        self.connection.commit()
+        return version or 0
+    
+    def set_schema_version(self, version: int):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM schema_versao')
+            cursor.execute('INSERT INTO schema_versao (versao) VALUES (%s)', (version,))
+        self.connection.commit()
+    
+    def after_schema(self):
+        with self.connection.cursor() as cursor:
+            # Sem arquivos anuais anexados, a visão unificada é a própria tabela
+            cursor.execute(f'''
+                CREATE OR REPLACE VIEW {MovementArchiver.UNIFIED_VIEW} AS
+                SELECT id, produto_id, tipo, quantidade, valor_unitario,
+                       valor_total, observacao, data_movimentacao, data_epoch, usuario
+                FROM movimentacoes
+            ''')
+        self.connection.commit()
+        self._load_serial_tables()
+        
+        # Linhas inseridas com id explícito (ex.: local padrão) não avançam a sequência
+        with self.connection.cursor() as cursor:
+            for table in sorted(self._serial_tables):
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+                )
+        self.connection.commit()
+
+    def storage_stats(self) -> Dict[str, int]:
+        with self._read_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT current_setting('block_size')::int, pg_database_size(current_database())"
+                )
+                page_size, size = cursor.fetchone()
+        # O espaço livre das tabelas fica com o próprio PostgreSQL (VACUUM o reaproveita)
+        return {'page_size': page_size, 'page_count': size // page_size, 'freelist_count': 0}
+    
+    def compact(self, max_pages: int = None):
+        # VACUUM não roda dentro de transação
+        self.connection.autocommit = True
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+        finally:
+            self.connection.autocommit = False
+
+def create_backend(url: str) -> StorageBackend:
+    """Escolhe o backend pela URL: postgresql://... ou caminho de arquivo SQLite"""
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(url)
+    return SQLiteBackend(url)
+
+class DatabaseManager:
+    """Gerencia todo o nosso banco de Dados
+    
+    Cada instância tem sua própria conexão, configurada pela URL: caminho
+    do arquivo SQLite, ':memory:', URI 'file:...' (ex.: memória compartilhada
+    entre instâncias) ou postgresql://. A aplicação usa a instância padrão
+    do processo, DatabaseManager.default().
+    """
+    
+    DB_PATH = os.path.join('data', 'estoque.db')
+    DEFAULT_LOCATION_ID = 1
+    SCHEMA_VERSION = 9  # incrementar a cada mudança em create_tables
+    
+    # Bases anteriores à coluna transferencia_id marcavam as transferências só na observação
+    TRANSFER_BACKFILL = '''
+        UPDATE {table} SET transferencia_id = (
+            SELECT t.id FROM transferencias t
+            WHERE {table}.observacao = 'Transferência #' || t.id
+               OR {table}.observacao LIKE 'Transferência #' || t.id || ' - %'
+        )
+        WHERE observacao LIKE 'Transferência #%'
+    '''
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self, url: str = None):
+        # ESTOQUE_DB_URL=postgresql://... usa um servidor PostgreSQL no lugar do arquivo local
+        self.url = url or os.environ.get('ESTOQUE_DB_URL') or self.DB_PATH
+        self.backend = None
+        self.metrics = QueryMetrics()
+        self.cache = QueryCache()
+        self._write_lock = TimedRLock()
+        self._transaction_depth = 0
+        self.unified_view_ready = False  # view movimentacoes_todas criada na conexão (MovementArchiver)
+        self._rollback_listeners = []
+        self.init_database()
+    
+    @classmethod
+    def default(cls) -> 'DatabaseManager':
+        """Instância compartilhada pelo processo (interface, fila de tarefas e API)"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+    
+    @property
+    def data_dir(self) -> str:
+        """Diretório do arquivo do banco (arquivos anuais, backups e exportações)"""
+        if self.backend.file_path:
+            return os.path.dirname(self.backend.file_path) or '.'
+        return 'data'
     
     def init_database(self):
         """Inicializa o banco de dados e cria as tabelas"""
         try:
-            # Cria o diretório data se não existir
-            os.makedirs('data', exist_ok=True)
+            backend = create_backend(self.url)
+            backend.connect()
+            self.backend = backend
             
-            self._connection = sqlite3.connect('data/estoque.db', check_same_thread=False)
-            self._connection.row_factory = sqlite3.Row
-            
-            # Criar tabelas
-            self.create_tables()
+            # Criar tabelas apenas se o schema gravado estiver desatualizado
+            if backend.schema_version() < self.SCHEMA_VERSION:
+                self.create_tables()
+                backend.set_schema_version(self.SCHEMA_VERSION)
             print("✅ Banco de dados inicializado com sucesso")
             
         except Exception as e:
@@ -48,10 +1575,8 @@ class DatabaseManager:
     
     def create_tables(self):
         """Cria as tabelas necessárias para que o sistema funcione corretamente"""
-        cursor = self._connection.cursor()
-        
         # Tabela de Categorias
-        cursor.execute('''
+        self.backend.execute('''
             CREATE TABLE IF NOT EXISTS categorias (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nome TEXT NOT NULL UNIQUE,
@@ -61,7 +1586,7 @@ class DatabaseManager:
         ''')
         
         # Tabela de Fornecedores
-        cursor.execute('''
+        self.backend.execute('''
             CREATE TABLE IF NOT EXISTS fornecedores (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nome TEXT NOT NULL,
@@ -74,7 +1599,7 @@ class DatabaseManager:
         ''')
         
         # Tabela de Produtos
-        cursor.execute('''
+        self.backend.execute('''
             CREATE TABLE IF NOT EXISTS produtos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nome TEXT NOT NULL,
@@ -96,7 +1621,7 @@ class DatabaseManager:
         ''')
         
         # Tabela de Movimentações
-        cursor.execute('''
+        self.backend.execute('''
             CREATE TABLE IF NOT EXISTS movimentacoes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 produto_id INTEGER NOT NULL,
@@ -111,281 +1636,3919 @@ class DatabaseManager:
             )
         ''')
         
-        # Inserir dados iniciais
-        self.insert_initial_data()
+        # Índices das movimentações (por produto e por período)
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_produto
+            ON movimentacoes (produto_id)
+        ''')
         
-        self._connection.commit()
-        print("✅ Tabelas criadas com sucesso")
-    
-    def insert_initial_data(self):
-        """Insere dados iniciais para as validações"""
-        cursor = self._connection.cursor()
+        # Data em segundos desde a época (UTC): filtros por período comparam
+        # inteiros em um índice compacto. data_movimentacao (texto) continua
+        # sendo gravada para os arquivos anuais e exportações
+        if self.add_column_if_missing('movimentacoes', 'data_epoch', 'INTEGER'):
+            self.backend.execute('''
+                UPDATE movimentacoes
+                SET data_epoch = CAST(strftime('%s', data_movimentacao) AS INTEGER)
+                WHERE data_epoch IS NULL
+            ''')
+        self.backend.execute('DROP INDEX IF EXISTS idx_movimentacoes_data')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_epoch
+            ON movimentacoes (data_epoch)
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_produto_epoch
+            ON movimentacoes (produto_id, data_epoch)
+        ''')
         
-        # Categorias iniciais
-        categorias_iniciais = [
-            ('Eletrônicos', 'Produtos eletrônicos e tecnológicos'),
-            ('Alimentícios', 'Produtos alimentícios e bebidas'),
-            ('Limpeza', 'Produtos de limpeza e higiene'),
-            ('Escritório', 'Materiais de escritório'),
-            ('Ferramentas', 'Ferramentas e equipamentos')
-        ]
+        # Códigos de leitura (SKU interno e código de barras EAN), únicos quando preenchidos
+        self.add_column_if_missing('produtos', 'sku', 'TEXT')
+        self.add_column_if_missing('produtos', 'ean', 'TEXT')
+        self.backend.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_sku
+            ON produtos (sku) WHERE sku IS NOT NULL
+        ''')
+        self.backend.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_ean
+            ON produtos (ean) WHERE ean IS NOT NULL
+        ''')
         
-        for nome, desc in categorias_iniciais:
-            cursor.execute('''
-                INSERT OR IGNORE INTO categorias (nome, descricao) 
-                VALUES (?, ?)
-            ''', (nome, desc))
+        # Locais de estoque (depósitos/filiais)
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS locais (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome TEXT NOT NULL UNIQUE,
+                descricao TEXT,
+                ativo BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         
-        # Fornecedores iniciais
-        fornecedores_iniciais = [
-            ('Fornecedor Geral', '00.000.000/0001-00', '(11) 9999-9999', 'contato@fornecedor.com', 'Rua A, 123'),
-            ('Tech Solutions', '11.111.111/0001-11', '(11) 8888-8888', 'vendas@tech.com', 'Av. Tecnologia, 456')
-        ]
+        # Saldo de cada produto por local
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS estoque_local (
+                produto_id INTEGER NOT NULL,
+                local_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (produto_id, local_id),
+                FOREIGN KEY (produto_id) REFERENCES produtos (id),
+                FOREIGN KEY (local_id) REFERENCES locais (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_estoque_local_local
+            ON estoque_local (local_id, produto_id, quantidade)
+        ''')
         
-        for nome, cnpj, tel, email, end in fornecedores_iniciais:
-            cursor.execute('''
-                INSERT OR IGNORE INTO fornecedores (nome, cnpj, telefone, email, endereco) 
-                VALUES (?, ?, ?, ?, ?)
-            ''', (nome, cnpj, tel, email, end))
-    
-    def get_connection(self):
-        """Retorna a conexão com o banco"""
-        return self._connection
-    
-    def execute_query(self, query: str, params: tuple = ()) -> List[sqlite3.Row]:
-        """Executa uma query SELECT e retorna os resultados"""
-        cursor = self._connection.cursor()
-        cursor.execute(query, params)
-        return cursor.fetchall()
-    
-    def execute_command(self, command: str, params: tuple = ()) -> int:
-        """Executa um comando INSERT/UPDATE/DELETE e retorna o ID ou linhas afetadas"""
-        cursor = self._connection.cursor()
-        cursor.execute(command, params)
-        self._connection.commit()
-        return cursor.lastrowid if cursor.lastrowid else cursor.rowcount
-
-class ProductController:
-    """Funções de controle dos produtos (criação/edição/remoção)"""
-    
-    def __init__(self):
-        self.db = DatabaseManager()
-    
-    def create_product(self, product_data: Dict[str, Any]) -> bool:
-        """Cadastra um novo produto"""
-        try:
-            command = '''
-                INSERT INTO produtos (
-                    nome, descricao, categoria_id, fornecedor_id, 
-                    preco_compra, preco_venda, estoque_atual, 
-                    estoque_minimo, estoque_maximo, unidade_medida
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            '''
-            
-            params = (
-            product_data['nome'],
-            product_data.get('descricao', ''),
-            product_data.get('categoria_id'),
-            product_data.get('fornecedor_id'),
-            product_data.get('preco_compra', 0.0),
-            product_data.get('preco_venda', 0.0),
-            0,  #Novos produtos sempre iniciam com qtdade 0 no estoque
-            product_data.get('estoque_minimo', 0),
-            product_data.get('estoque_maximo', 100),
-            product_data.get('unidade_medida', 'UN')
-        )
-            
-            product_id = self.db.execute_command(command, params)
-            # Registrar movimentação de entrada inicial se houver estoque
-
-            if product_data.get('estoque_atual', 0) > 0:
-                self.register_movement(
-                    product_id, 
-                    'ENTRADA', 
-                    product_data.get('estoque_atual', 0),
-                    product_data.get('preco_compra', 0.0),
-                    'Estoque inicial do produto'
-                )
-            
-            return True
-            
-        except Exception as e:
-            print(f"❌ Erro ao criar produto: {e}")
-            return False
-    
-    def get_products(self, filter_active: bool = True) -> List[sqlite3.Row]:
-        """Lista todos os produtos"""
-        try:
-            query = '''
-                SELECT 
-                    p.*,
-                    c.nome as categoria_nome,
-                    f.nome as fornecedor_nome,
-                    CASE 
-                        WHEN p.estoque_atual <= p.estoque_minimo THEN 'BAIXO'
-                        WHEN p.estoque_atual >= p.estoque_maximo THEN 'ALTO'
-                        ELSE 'NORMAL'
-                    END as status_estoque
-                FROM produtos p
-                LEFT JOIN categorias c ON p.categoria_id = c.id
-                LEFT JOIN fornecedores f ON p.fornecedor_id = f.id
-            '''
-            
-            if filter_active:
-                query += ' WHERE p.ativo = 1'
-            
-            query += ' ORDER BY p.nome'
-            
-            return self.db.execute_query(query)
-            
+        # Transferências entre locais
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS transferencias (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                produto_id INTEGER NOT NULL,
+                origem_id INTEGER NOT NULL,
+                destino_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                observacao TEXT,
+                data_transferencia TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (produto_id) REFERENCES produtos (id),
+                FOREIGN KEY (origem_id) REFERENCES locais (id),
+                FOREIGN KEY (destino_id) REFERENCES locais (id)
+            )
+        ''')
+        
+        # Local da movimentação: bases antigas não possuem a coluna, então
+        # o histórico e os saldos existentes passam para o local padrão
+        if self.add_column_if_missing('movimentacoes', 'local_id', 'INTEGER REFERENCES locais (id)'):
+            self.backend.execute('UPDATE movimentacoes SET local_id = ?', (self.DEFAULT_LOCATION_ID,))
+            self.backend.execute('''
+                INSERT OR IGNORE INTO estoque_local (produto_id, local_id, quantidade)
+                SELECT id, ?, estoque_atual FROM produtos WHERE estoque_atual <> 0
+            ''', (self.DEFAULT_LOCATION_ID,))
+        
+        # Transferência que gerou a movimentação (NULL nas demais). Vinda de outra
+        # loja, guarda o número da transferência na origem, sem chave estrangeira
+        if self.add_column_if_missing('movimentacoes', 'transferencia_id', 'INTEGER'):
+            self.backend.execute(self.TRANSFER_BACKFILL.format(table='movimentacoes'))
+        
+        # Lotes com validade (saldo por produto, local e lote)
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS lotes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                produto_id INTEGER NOT NULL,
+                local_id INTEGER NOT NULL,
+                numero_lote TEXT NOT NULL,
+                data_validade DATE,
+                quantidade_inicial INTEGER NOT NULL DEFAULT 0,
+                saldo INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (produto_id, local_id, numero_lote),
+                FOREIGN KEY (produto_id) REFERENCES produtos (id),
+                FOREIGN KEY (local_id) REFERENCES locais (id)
+            )
+        ''')
+        # Índices parciais: só lotes com saldo entram nas consultas FEFO/vencimento
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lotes_fefo
+            ON lotes (produto_id, local_id, data_validade) WHERE saldo > 0
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lotes_validade
+            ON lotes (data_validade) WHERE saldo > 0
+        ''')
+        
+        # Quantidade de cada lote consumida/recebida por movimentação
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS movimentacoes_lotes (
+                movimentacao_id INTEGER NOT NULL,
+                lote_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                PRIMARY KEY (movimentacao_id, lote_id),
+                FOREIGN KEY (lote_id) REFERENCES lotes (id)
+            )
+        ''')
+        
+        # Custo mantido por produto (custo médio ponderado e valor FIFO)
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS custos_produto (
+                produto_id INTEGER PRIMARY KEY,
+                quantidade INTEGER NOT NULL DEFAULT 0,
+                custo_medio REAL NOT NULL DEFAULT 0.0,
+                valor_fifo REAL NOT NULL DEFAULT 0.0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (produto_id) REFERENCES produtos (id)
+            )
+        ''')
+        
+        # Camadas de custo FIFO (uma por entrada, consumidas na ordem de chegada)
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS camadas_custo (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                produto_id INTEGER NOT NULL,
+                movimentacao_id INTEGER,
+                quantidade_inicial INTEGER NOT NULL,
+                saldo INTEGER NOT NULL,
+                custo_unitario REAL NOT NULL DEFAULT 0.0,
+                FOREIGN KEY (produto_id) REFERENCES produtos (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_camadas_custo_abertas
+            ON camadas_custo (produto_id, id) WHERE saldo > 0
+        ''')
+        
+        # Pedidos de compra (um por fornecedor) e seus itens
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS pedidos_compra (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fornecedor_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'ABERTO'
+                    CHECK (status IN ('ABERTO', 'RECEBIDO', 'CANCELADO')),
+                observacao TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                received_at TIMESTAMP,
+                FOREIGN KEY (fornecedor_id) REFERENCES fornecedores (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_compra_status
+            ON pedidos_compra (status, fornecedor_id)
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS pedidos_compra_itens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pedido_id INTEGER NOT NULL,
+                produto_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                custo_unitario REAL DEFAULT 0.0,
+                FOREIGN KEY (pedido_id) REFERENCES pedidos_compra (id),
+                FOREIGN KEY (produto_id) REFERENCES produtos (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_compra_itens_pedido
+            ON pedidos_compra_itens (pedido_id)
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pedidos_compra_itens_produto
+            ON pedidos_compra_itens (produto_id)
+        ''')
+        
+        # Fila persistente de tarefas em segundo plano
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                parametros TEXT DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'PENDENTE'
+                    CHECK (status IN ('PENDENTE', 'EXECUTANDO', 'CONCLUIDO', 'FALHOU', 'CANCELADO')),
+                progresso REAL DEFAULT 0.0,
+                mensagem TEXT,
+                resultado TEXT,
+                tentativas INTEGER DEFAULT 0,
+                max_tentativas INTEGER DEFAULT 3,
+                intervalo_segundos INTEGER,
+                cancelar BOOLEAN DEFAULT 0,
+                agendado_para TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_fila
+            ON jobs (status, agendado_para)
+        ''')
+        
+        # Resumo por produto e período das movimentações já arquivadas
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS movimentacoes_resumo (
+                produto_id INTEGER NOT NULL,
+                periodo TEXT NOT NULL,
+                qtd_movimentacoes INTEGER DEFAULT 0,
+                entradas INTEGER DEFAULT 0,
+                saidas INTEGER DEFAULT 0,
+                valor_entradas REAL DEFAULT 0.0,
+                valor_saidas REAL DEFAULT 0.0,
+                PRIMARY KEY (produto_id, periodo),
+                FOREIGN KEY (produto_id) REFERENCES produtos (id)
+            )
+        ''')
+        
+        # Contagens físicas (inventário cíclico): saldo congelado e quantidade contada por produto
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS contagens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                local_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'ABERTA'
+                    CHECK (status IN ('ABERTA', 'FECHADA', 'CANCELADA')),
+                observacao TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                FOREIGN KEY (local_id) REFERENCES locais (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS contagens_itens (
+                contagem_id INTEGER NOT NULL,
+                produto_id INTEGER NOT NULL,
+                estoque_congelado INTEGER NOT NULL,
+                quantidade_contada INTEGER,
+                PRIMARY KEY (contagem_id, produto_id),
+                FOREIGN KEY (contagem_id) REFERENCES contagens (id),
+                FOREIGN KEY (produto_id) REFERENCES produtos (id)
+            )
+        ''')
+        
+        # Reservas de pedidos pendentes: o total reservado é mantido por local e por
+        # produto a cada operação, então disponível = saldo - reservado sem agregações
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS reservas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                produto_id INTEGER NOT NULL,
+                local_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL CHECK (quantidade > 0),
+                status TEXT NOT NULL DEFAULT 'ATIVA'
+                    CHECK (status IN ('ATIVA', 'CONFIRMADA', 'LIBERADA', 'EXPIRADA')),
+                referencia TEXT,
+                expira_epoch INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                FOREIGN KEY (produto_id) REFERENCES produtos (id),
+                FOREIGN KEY (local_id) REFERENCES locais (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_reservas_ativas
+            ON reservas (expira_epoch) WHERE status = 'ATIVA'
+        ''')
+        self.add_column_if_missing('estoque_local', 'reservado', 'INTEGER NOT NULL DEFAULT 0')
+        self.add_column_if_missing('produtos', 'estoque_reservado', 'INTEGER NOT NULL DEFAULT 0')
+        
+        # Kits (lista de materiais): estrutura direta de cada kit e a explosão já
+        # achatada em componentes finais, recalculada quando a estrutura muda
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS kits_componentes (
+                kit_id INTEGER NOT NULL,
+                componente_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL CHECK (quantidade > 0),
+                PRIMARY KEY (kit_id, componente_id),
+                FOREIGN KEY (kit_id) REFERENCES produtos (id),
+                FOREIGN KEY (componente_id) REFERENCES produtos (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS kits_explodidos (
+                kit_id INTEGER NOT NULL,
+                componente_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                PRIMARY KEY (kit_id, componente_id),
+                FOREIGN KEY (kit_id) REFERENCES produtos (id),
+                FOREIGN KEY (componente_id) REFERENCES produtos (id)
+            )
+        ''')
+        
+        # Replicação entre lojas: identidade do nó, log de alterações (somente
+        # inclusão, numerado por nó) e o que cada nó parceiro já recebeu
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS replicacao_no (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                node_id TEXT NOT NULL
+            )
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS replicacao_log (
+                node_id TEXT NOT NULL,
+                sequencia INTEGER NOT NULL,
+                tipo TEXT NOT NULL CHECK (tipo IN ('MOVIMENTACAO', 'PRODUTO')),
+                dados TEXT NOT NULL,
+                created_epoch INTEGER NOT NULL,
+                PRIMARY KEY (node_id, sequencia)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS replicacao_vetor (
+                node_id TEXT PRIMARY KEY,
+                sequencia INTEGER NOT NULL
+            )
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS replicacao_pares (
+                peer_id TEXT PRIMARY KEY,
+                vetor TEXT NOT NULL,
+                atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Identificador global do produto (os IDs locais divergem entre lojas) e
+        # versão da última edição aplicada (última escrita vence)
+        if self.add_column_if_missing('produtos', 'uid', 'TEXT'):
+            self.backend.execute("UPDATE produtos SET uid = 'p' || id WHERE uid IS NULL")
+        self.add_column_if_missing('produtos', 'rep_versao', 'TEXT')
+        self.backend.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_uid
+            ON produtos (uid) WHERE uid IS NOT NULL
+        ''')
+        
+        # Classificação ABC (participação no valor consumido) e XYZ (variação da
+        # demanda mensal): demanda de saídas por produto e mês, atualizada a partir
+        # da última movimentação processada
+        self.add_column_if_missing('produtos', 'classe_abc', 'TEXT')
+        self.add_column_if_missing('produtos', 'classe_xyz', 'TEXT')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS demanda_mensal (
+                produto_id INTEGER NOT NULL,
+                periodo TEXT NOT NULL,
+                quantidade INTEGER NOT NULL DEFAULT 0,
+                valor REAL NOT NULL DEFAULT 0.0,
+                PRIMARY KEY (produto_id, periodo),
+                FOREIGN KEY (produto_id) REFERENCES produtos (id)
+            )
+        ''')
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS classificacao_estado (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                ultima_movimentacao INTEGER NOT NULL,
+                atualizado_em TIMESTAMP
+            )
+        ''')
+        
+        # Índices parciais: as listagens só leem produtos ativos, então os inativos
+        # (exclusão lógica) ficam fora dos índices de nome e de classificação
+        self.backend.execute('DROP INDEX IF EXISTS idx_produtos_classe')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_produtos_ativos
+            ON produtos (nome) WHERE ativo = 1
+        ''')
+        self.backend.execute('''
+            CREATE INDEX IF NOT EXISTS idx_produtos_classe_ativos
+            ON produtos (classe_abc, classe_xyz) WHERE ativo = 1
+        ''')
+        
+        # Produtos inativos há muito tempo, retirados de produtos pela manutenção;
+        # mantêm o nome das movimentações já arquivadas
+        self.backend.execute('''
+            CREATE TABLE IF NOT EXISTS produtos_arquivados (
+                id INTEGER PRIMARY KEY,
+                uid TEXT,
+                nome TEXT NOT NULL,
+                descricao TEXT,
+                categoria_id INTEGER,
+                fornecedor_id INTEGER,
+                preco_compra REAL,
+                preco_venda REAL,
+                unidade_medida TEXT,
+                sku TEXT,
+                ean TEXT,
+                desativado_em TIMESTAMP,
+                arquivado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Inserir dados iniciais
+        self.insert_initial_data()
+        
+        self.backend.commit()
+        self.backend.after_schema()
+        print("✅ Tabelas criadas com sucesso")
+    
+    def insert_initial_data(self):
+        """Insere dados iniciais para as validações"""
+        # Categorias iniciais
+        categorias_iniciais = [
+            ('Eletrônicos', 'Produtos eletrônicos e tecnológicos'),
+            ('Alimentícios', 'Produtos alimentícios e bebidas'),
+            ('Limpeza', 'Produtos de limpeza e higiene'),
+            ('Escritório', 'Materiais de escritório'),
+            ('Ferramentas', 'Ferramentas e equipamentos')
+        ]
+        
+        for nome, desc in categorias_iniciais:
+            self.backend.execute('''
+                INSERT OR IGNORE INTO categorias (nome, descricao) 
+                VALUES (?, ?)
+            ''', (nome, desc))
+        
+        # Fornecedores iniciais
+        fornecedores_iniciais = [
+            ('Fornecedor Geral', '00.000.000/0001-00', '(11) 9999-9999', 'contato@fornecedor.com', 'Rua A, 123'),
+            ('Tech Solutions', '11.111.111/0001-11', '(11) 8888-8888', 'vendas@tech.com', 'Av. Tecnologia, 456')
+        ]
+        
+        for nome, cnpj, tel, email, end in fornecedores_iniciais:
+            self.backend.execute('''
+                INSERT OR IGNORE INTO fornecedores (nome, cnpj, telefone, email, endereco) 
+                VALUES (?, ?, ?, ?, ?)
+            ''', (nome, cnpj, tel, email, end))
+        
+        # Local padrão de estoque
+        self.backend.execute('''
+            INSERT OR IGNORE INTO locais (id, nome, descricao)
+            VALUES (?, 'Principal', 'Local padrão de estoque')
+        ''', (self.DEFAULT_LOCATION_ID,))
+    
+    def get_connection(self):
+        """Retorna a conexão de escrita do backend (sqlite3.Connection no SQLite)"""
+        return self.backend.connection
+    
+    def close(self):
+        """Fecha a conexão (instâncias de testes, benchmarks ou inquilinos)"""
+        with self._write_lock:
+            self.backend.close()
+    
+    def add_column_if_missing(self, table: str, column: str, definition: str) -> bool:
+        """Adiciona uma coluna a uma tabela existente (migração simples)
+        
+        Retorna True se a coluna foi criada agora.
+        """
+        if column in self.backend.table_columns(table):
+            return False
+        self.backend.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    
+    @contextmanager
+    def transaction(self):
+        """Agrupa vários comandos em uma única transação
+        
+        Dentro do bloco, execute_command não faz commit; o commit (ou
+        rollback, em caso de erro) acontece ao final do bloco mais externo.
+        """
+        with self._write_lock:
+            outermost = self._transaction_depth == 0
+            if outermost:
+                self.backend.begin()
+            self._transaction_depth += 1
+            try:
+                yield self
+            except Exception:
+                self._transaction_depth -= 1
+                if outermost:
+                    self.backend.rollback()
+                    self.cache.end_transaction()
+                    self._notify_rollback()
+                raise
+            else:
+                self._transaction_depth -= 1
+                if outermost:
+                    self._commit()
+                    self.cache.end_transaction()
+    
+    @contextmanager
+    def savepoint(self, name: str):
+        """Bloco dentro da transação que, em caso de erro, desfaz só o próprio trabalho"""
+        with self.transaction():
+            self.backend.execute(f'SAVEPOINT {name}')
+            try:
+                yield self
+            except Exception:
+                self.backend.execute(f'ROLLBACK TO SAVEPOINT {name}')
+                self.backend.execute(f'RELEASE SAVEPOINT {name}')
+                self._notify_rollback()
+                raise
+            else:
+                self.backend.execute(f'RELEASE SAVEPOINT {name}')
+    
+    def on_rollback(self, callback):
+        """Chama callback() após cada rollback (quem guarda dados lidos da conexão principal)
+        
+        Métodos são guardados por referência fraca, sem manter o dono vivo.
+        """
+        ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+        self._rollback_listeners.append(ref)
+    
+    def _notify_rollback(self):
+        alive = []
+        for ref in self._rollback_listeners:
+            callback = ref()
+            if callback is not None:
+                alive.append(ref)
+                callback()
+        self._rollback_listeners = alive
+    
+    @contextmanager
+    def read_committed(self):
+        """Leitura consistente só do que já foi confirmado, sem o lock de escrita
+        
+        A conexão principal enxerga transações ainda abertas de outras threads;
+        em arquivo SQLite a leitura usa uma conexão somente leitura própria.
+        Bancos em memória e PostgreSQL leem pela conexão principal sob o lock.
+        Produz fetch(nome, params) -> tuplas de uma consulta registrada.
+        """
+        if not self.backend.supports_files:
+            with self._write_lock:
+                yield lambda name, params=(): self.iterate_named(name, params)
+            return
+        
+        connection = sqlite3.connect(
+            Path(self.backend.file_path).resolve().as_uri() + '?mode=ro', uri=True, timeout=10
+        )
+        try:
+            connection.execute('BEGIN')  # mesma fotografia para todas as consultas do bloco
+            yield lambda name, params=(): connection.execute(StatementRegistry.get(name), params)
+        finally:
+            connection.close()
+    
+    def _commit(self):
+        if not self.metrics.enabled:
+            self.backend.commit()
+            return
+        
+        commit_start = time.perf_counter()
+        self.backend.commit()
+        self.metrics.record_commit((time.perf_counter() - commit_start) * 1000)
+    
+    def execute_query(self, query: str, params: tuple = (), record_type=None) -> List[Any]:
+        """Executa uma query SELECT e retorna os resultados
+        
+        Com record_type, as linhas vêm como tuplas e são mapeadas
+        posicionalmente para o tipo informado (ex.: ProductRecord).
+        """
+        if not self.metrics.enabled:
+            return self._fetch_all(query, params, record_type)
+        
+        start = time.perf_counter()
+        rows = self._fetch_all(query, params, record_type)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        plan = self.explain_query(query, params) if self.metrics.is_slow(elapsed_ms) else None
+        self.metrics.record(query, params, elapsed_ms, len(rows), plan)
+        return rows
+    
+    def _fetch_all(self, query: str, params: tuple, record_type) -> List[Any]:
+        return self.backend.fetch_all(query, params, record_type)
+    
+    def iterate_query(self, query: str, params: tuple = (), batch_size: int = 1000):
+        """Percorre o resultado (tuplas) em blocos, sem carregar tudo em memória"""
+        return self.backend.iterate(query, params, batch_size)
+    
+    def iterate_named(self, name: str, params: tuple = (), batch_size: int = 1000):
+        return self.iterate_query(StatementRegistry.get(name), params, batch_size)
+    
+    def query_named(self, name: str, params: tuple = (), record_type=None) -> List[Any]:
+        """Executa uma query registrada no StatementRegistry"""
+        return self.execute_query(StatementRegistry.get(name), params, record_type)
+    
+    def query_cached(self, name: str, params: tuple = (), record_type=None,
+                     ttl: float = None, tags: tuple = None) -> List[Any]:
+        """Consulta registrada com o resultado guardado no QueryCache
+        
+        A entrada depende das tabelas lidas pelo SQL ou, se informadas, só
+        das tags (quem grava deve chamar cache.invalidate com a mesma tag).
+        """
+        key = (name, params, record_type)
+        rows = self.cache.get(key)
+        if rows is not None:
+            return list(rows)
+        
+        sql = StatementRegistry.get(name)
+        deps = tuple(tags) if tags is not None else QueryCache.tables_read(sql)
+        generations = self.cache.generations(deps)
+        rows = self.execute_query(sql, params, record_type)
+        self.cache.put(key, tuple(rows), deps, generations, ttl)
+        return rows
+    
+    def command_named(self, name: str, params: tuple = ()) -> int:
+        """Executa um comando registrado no StatementRegistry"""
+        return self.execute_command(StatementRegistry.get(name), params)
+    
+    def execute_command(self, command: str, params: tuple = ()) -> int:
+        """Executa um comando INSERT/UPDATE/DELETE e retorna o ID ou linhas afetadas"""
+        with self._write_lock:
+            if not self.metrics.enabled:
+                cursor = self.backend.execute(command, params)
+                result = self.backend.command_result(command, cursor)
+                self.cache.invalidate_sql(command, bool(self._transaction_depth))
+                if not self._transaction_depth:
+                    self.backend.commit()
+                return result
+            
+            start = time.perf_counter()
+            cursor = self.backend.execute(command, params)
+            result = self.backend.command_result(command, cursor)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.cache.invalidate_sql(command, bool(self._transaction_depth))
+            
+            if not self._transaction_depth:
+                self._commit()
+        
+        plan = self.explain_query(command, params) if self.metrics.is_slow(elapsed_ms) else None
+        self.metrics.record(command, params, elapsed_ms, cursor.rowcount, plan)
+        return result
+    
+    def executemany(self, command: str, seq_params):
+        """Executa o mesmo comando para várias linhas de parâmetros"""
+        with self._write_lock:
+            self.backend.executemany(command, seq_params)
+            self.cache.invalidate_sql(command, bool(self._transaction_depth))
+            if not self._transaction_depth:
+                self._commit()
+    
+    def invalidate_cache(self, *deps: str):
+        """Invalida tabelas ou tags do QueryCache (ex.: 'produto:42') após uma escrita"""
+        self.cache.invalidate(*deps, in_transaction=bool(self._transaction_depth))
+    
+    def storage_stats(self) -> Dict[str, int]:
+        """Páginas do banco (page_size, page_count, freelist_count)"""
+        with self._write_lock:
+            return self.backend.storage_stats()
+    
+    @contextmanager
+    def exclusive(self, operation: str):
+        """Bloco que não pode rodar dentro de transação (ATTACH, compactação, restauração)
+        
+        Segura o lock de escrita até o fim do bloco. Se a thread atual tiver
+        uma transação aberta, recusa em vez de confirmá-la pela metade.
+        """
+        with self._write_lock:
+            if self._transaction_depth:
+                raise RuntimeError(f"{operation} não pode rodar dentro de uma transação")
+            if self.backend.in_transaction:
+                self._commit()
+            yield self
+    
+    def compact(self, max_pages: int = None):
+        """Libera as páginas livres do arquivo (todas, se max_pages não for informado)"""
+        with self.exclusive('Compactação'):
+            self.backend.compact(max_pages)
+    
+    def analyze(self):
+        """Atualiza as estatísticas do planejador de consultas"""
+        with self._write_lock:
+            self.backend.analyze()
+            if not self._transaction_depth:
+                self._commit()
+    
+    def explain_query(self, query: str, params: tuple = ()) -> List[str]:
+        """Retorna o plano de execução (EXPLAIN QUERY PLAN) de um comando"""
+        try:
+            return self.backend.explain(query, params)
+        except Exception as e:
+            return [f'Plano indisponível: {e}']
+    
+    def enable_profiling(self, slow_threshold_ms: float = None):
+        """Ativa a instrumentação das queries"""
+        if slow_threshold_ms is not None:
+            self.metrics.slow_threshold_ms = slow_threshold_ms
+        self.metrics.enabled = True
+    
+    def disable_profiling(self):
+        """Desativa a instrumentação das queries"""
+        self.metrics.enabled = False
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Retorna as métricas coletadas pela instrumentação"""
+        return self.metrics.snapshot()
+    
+    def lock_stats(self) -> Dict[str, Any]:
+        """Aquisições e espera pelo lock de escrita"""
+        return self._write_lock.stats()
+    
+    def lock_wait_ms(self) -> float:
+        """Espera acumulada pela thread atual no lock de escrita"""
+        return self._write_lock.thread_wait_ms()
+    
+    def reset_lock_stats(self):
+        """Zera os contadores do lock de escrita (início de uma medição)"""
+        self._write_lock.reset()
+
+class PerDatabase:
+    """Base de objetos com uma única instância por banco (DatabaseManager) no processo
+    
+    Controladores diferentes sobre o mesmo banco (sessões da interface, API,
+    teste de carga) recebem o mesmo objeto e, com ele, os mesmos dados em
+    memória. O __init__ da subclasse retorna cedo se self._initialized.
+    """
+    
+    _instances_lock = threading.RLock()
+    
+    def __new__(cls, db: 'DatabaseManager' = None):
+        db = db or DatabaseManager.default()
+        with cls._instances_lock:
+            instances = cls.__dict__.get('_instances')
+            if instances is None:
+                instances = cls._instances = {}
+            if db not in instances:
+                instance = super().__new__(cls)
+                instance._initialized = False
+                instances[db] = instance
+            return instances[db]
+
+class InventorySnapshot(PerDatabase):
+    """Fotografia compacta do estoque em colunas (arrays tipados paralelos)
+    
+    Guarda apenas os campos numéricos usados por dashboard e relatórios
+    (cerca de 48 bytes por produto) e é atualizada de forma incremental
+    lendo somente as movimentações posteriores à última já aplicada. Uma
+    por banco, compartilhada pelos controladores.
+    """
+    
+    # categoria_id NULL é representado por 0 (os IDs começam em 1)
+    NO_CATEGORY = 0
+    
+    def __init__(self, db: 'DatabaseManager'):
+        if self._initialized:
+            return
+        self._initialized = True
+        self.db = db
+        self._lock = threading.Lock()
+        self._stale = True
+        self._clear()
+        db.on_rollback(self.invalidate)
+    
+    def _clear(self):
+        self.ids = array('q')
+        self.categoria_ids = array('q')
+        self.estoque_atual = array('q')
+        self.estoque_minimo = array('q')
+        self.estoque_maximo = array('q')
+        self.preco_venda = array('d')
+        # Kits não têm estoque próprio: ficam fora das contagens de status
+        self.kits = array('b')
+        self._positions = {}
+        self.last_movement_id = 0
+    
+    def invalidate(self):
+        """Marca a fotografia para reconstrução completa na próxima leitura"""
+        self._stale = True
+    
+    def refresh(self) -> 'InventorySnapshot':
+        """Reconstrói (se invalidada) ou aplica as novas movimentações"""
+        with self._lock:
+            if self._stale:
+                self._rebuild()
+            else:
+                self._apply_new_movements()
+        return self
+    
+    def _rebuild(self):
+        # Só dados confirmados; um invalidate() durante a leitura força nova reconstrução
+        self._stale = False
+        try:
+            with self.db.read_committed() as fetch:
+                last_movement_id = next(iter(fetch('snapshot.ultima_movimentacao')))[0]
+                
+                self._clear()
+                for product_id, categoria_id, atual, minimo, maximo, preco, kit in fetch('snapshot.produtos'):
+                    self._positions[product_id] = len(self.ids)
+                    self.ids.append(product_id)
+                    self.categoria_ids.append(categoria_id or self.NO_CATEGORY)
+                    self.estoque_atual.append(atual or 0)
+                    self.estoque_minimo.append(minimo or 0)
+                    self.estoque_maximo.append(maximo or 0)
+                    self.preco_venda.append(preco or 0.0)
+                    self.kits.append(kit)
+                
+                self.last_movement_id = last_movement_id
+        except Exception:
+            self._stale = True
+            raise
+    
+    def _apply_new_movements(self):
+        # Movimentações de transações ainda abertas ficam para a próxima leitura
+        with self.db.read_committed() as fetch:
+            movements = fetch('snapshot.movimentacoes_desde', (self.last_movement_id,))
+            for movement_id, product_id, tipo, quantidade in movements:
+                position = self._positions.get(product_id)
+                if position is not None:
+                    delta = quantidade if tipo == 'ENTRADA' else -quantidade
+                    self.estoque_atual[position] += delta
+                self.last_movement_id = movement_id
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def memory_bytes(self) -> int:
+        """Memória ocupada pelas colunas (sem o índice de posições)"""
+        columns = (self.ids, self.categoria_ids, self.estoque_atual,
+                   self.estoque_minimo, self.estoque_maximo, self.preco_venda, self.kits)
+        return sum(column.itemsize * len(column) for column in columns)
+    
+    def total_value(self) -> float:
+        """Valor total do estoque (estoque_atual * preco_venda)"""
+        return sum(map(float.__mul__, map(float, self.estoque_atual), self.preco_venda))
+    
+    def low_stock_count(self) -> int:
+        return sum(atual <= minimo and not kit
+                   for atual, minimo, kit in zip(self.estoque_atual, self.estoque_minimo, self.kits))
+    
+    def status_counts(self) -> Dict[str, int]:
+        """Contagem de produtos por status de estoque (BAIXO/NORMAL/ALTO)"""
+        baixo = alto = 0
+        for atual, minimo, maximo, kit in zip(self.estoque_atual, self.estoque_minimo,
+                                              self.estoque_maximo, self.kits):
+            if kit:
+                continue
+            if atual <= minimo:
+                baixo += 1
+            elif atual >= maximo:
+                alto += 1
+        normal = len(self.ids) - sum(self.kits) - baixo - alto
+        return {'BAIXO': baixo, 'NORMAL': normal, 'ALTO': alto}
+    
+    def totals_by_category(self) -> Dict[int, Dict[str, float]]:
+        """Quantidade de produtos e valor total agrupados por categoria"""
+        totals = {}
+        for categoria_id, atual, preco in zip(self.categoria_ids, self.estoque_atual, self.preco_venda):
+            entry = totals.get(categoria_id)
+            if entry is None:
+                entry = totals[categoria_id] = {'count': 0, 'value': 0.0}
+            entry['count'] += 1
+            entry['value'] += atual * preco
+        return totals
+
+def to_epoch(value) -> int:
+    """Converte 'AAAA-MM-DD', 'AAAA-MM-DD HH:MM:SS' ou datetime (UTC) em segundos desde a época"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        fmt = '%Y-%m-%d %H:%M:%S' if len(value) > 10 else '%Y-%m-%d'
+        value = datetime.strptime(value, fmt)
+    return calendar.timegm(value.timetuple())
+
+def now_epoch() -> tuple:
+    """Momento atual como (texto UTC, época), os dois formatos gravados nas movimentações"""
+    epoch = int(time.time())
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch)), epoch
+
+def utc_year() -> int:
+    """Ano corrente em UTC, o mesmo calendário das épocas gravadas"""
+    return time.gmtime(time.time()).tm_year
+
+class MovementArchiver:
+    """Arquiva movimentações de períodos fechados em arquivos SQLite anuais
+    
+    Cada ano fechado vai para data/arquivo/movimentacoes_<ano>.db (anexado
+    via ATTACH), deixando na base principal apenas um resumo por produto e
+    período em movimentacoes_resumo. A view temporária movimentacoes_todas
+    une a tabela ativa e todos os arquivos anexados.
+    
+    Obs.: o SQLite limita a quantidade de bancos anexados (10 por padrão).
+    """
+    
+    ARCHIVE_DIR = os.path.join('data', 'arquivo')
+    ARCHIVE_PREFIX = 'movimentacoes_'
+    UNIFIED_VIEW = 'movimentacoes_todas'
+    
+    def __init__(self, db: 'DatabaseManager', archive_dir: str = None):
+        self.db = db
+        self.archive_dir = archive_dir or self.ARCHIVE_DIR
+    
+    @staticmethod
+    def schema_name(year: int) -> str:
+        return f'arq_{year}'
+    
+    def archive_path(self, year: int) -> str:
+        return os.path.join(self.archive_dir, f'{self.ARCHIVE_PREFIX}{year}.db')
+    
+    def archived_years(self) -> List[int]:
+        """Lista os anos que possuem arquivo em disco"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        
+        years = []
+        for filename in os.listdir(self.archive_dir):
+            name, ext = os.path.splitext(filename)
+            if ext == '.db' and name.startswith(self.ARCHIVE_PREFIX):
+                suffix = name[len(self.ARCHIVE_PREFIX):]
+                if suffix.isdigit():
+                    years.append(int(suffix))
+        return sorted(years)
+    
+    def _attached_schemas(self) -> set:
+        return {row['name'] for row in self.db.execute_query('PRAGMA database_list')}
+    
+    def attach(self, year: int):
+        """Anexa o arquivo de um ano (criando-o se necessário)"""
+        # ATTACH/DETACH não podem rodar dentro de uma transação
+        with self.db.exclusive('Anexar arquivo de movimentações'):
+            schema = self.schema_name(year)
+            if schema in self._attached_schemas():
+                return
+            
+            os.makedirs(self.archive_dir, exist_ok=True)
+            connection = self.db.get_connection()
+            connection.execute(f'ATTACH DATABASE ? AS {schema}', (self.archive_path(year),))
+            connection.execute(f'''
+                CREATE TABLE IF NOT EXISTS {schema}.movimentacoes (
+                    id INTEGER PRIMARY KEY,
+                    produto_id INTEGER NOT NULL,
+                    tipo TEXT NOT NULL,
+                    quantidade INTEGER NOT NULL,
+                    valor_unitario REAL DEFAULT 0.0,
+                    valor_total REAL DEFAULT 0.0,
+                    observacao TEXT,
+                    data_movimentacao TIMESTAMP,
+                    usuario TEXT,
+                    transferencia_id INTEGER
+                )
+            ''')
+            columns = {row[1] for row in connection.execute(f'PRAGMA {schema}.table_info(movimentacoes)')}
+            if 'transferencia_id' not in columns:
+                connection.execute(f'ALTER TABLE {schema}.movimentacoes ADD COLUMN transferencia_id INTEGER')
+                connection.execute(DatabaseManager.TRANSFER_BACKFILL.format(table=f'{schema}.movimentacoes'))
+            connection.execute(f'''
+                CREATE INDEX IF NOT EXISTS {schema}.idx_movimentacoes_produto
+                ON movimentacoes (produto_id)
+            ''')
+            connection.commit()
+    
+    def ensure_unified_view(self):
+        """Anexa os arquivos e cria a view unificada uma única vez por conexão
+        
+        Os controladores (sessões da interface, API, teste de carga) dividem
+        o mesmo DatabaseManager; só o primeiro faz o trabalho.
+        """
+        if self.db.unified_view_ready:
+            return
+        if self.db.backend.supports_files:
+            self.attach_archives()
+        elif self.db.backend.name == 'sqlite':
+            self.rebuild_unified_view()  # banco em memória: sem arquivos anuais
+    
+    def attach_archives(self):
+        """Anexa todos os arquivos existentes e recria a view unificada"""
+        try:
+            with self.db.exclusive('Anexar arquivos de movimentações'):
+                for year in self.archived_years():
+                    self.attach(year)
+                self.rebuild_unified_view()
+            
+        except Exception as e:
+            print(f"❌ Erro ao anexar arquivos de movimentações: {e}")
+    
+    def rebuild_unified_view(self):
+        """Recria a view temporária que une tabela ativa e arquivos"""
+        columns = '''
+            id, produto_id, tipo, quantidade, valor_unitario,
+            valor_total, observacao, data_movimentacao, {epoch}, usuario, transferencia_id
+        '''
+        # Os arquivos anuais guardam só a data em texto; a época é calculada na view
+        selects = [f"SELECT {columns.format(epoch='data_epoch')} FROM main.movimentacoes"]
+        archive_columns = columns.format(
+            epoch="CAST(strftime('%s', data_movimentacao) AS INTEGER) AS data_epoch"
+        )
+        
+        with self.db.exclusive('Recriar a view de movimentações'):
+            attached = self._attached_schemas()
+            for year in self.archived_years():
+                schema = self.schema_name(year)
+                if schema in attached:
+                    selects.append(f'SELECT {archive_columns} FROM {schema}.movimentacoes')
+            
+            connection = self.db.get_connection()
+            connection.execute(f'DROP VIEW IF EXISTS temp.{self.UNIFIED_VIEW}')
+            connection.execute(
+                f'CREATE TEMP VIEW {self.UNIFIED_VIEW} AS ' + ' UNION ALL '.join(selects)
+            )
+            connection.commit()
+            self.db.unified_view_ready = True
+    
+    def archive_year(self, year: int) -> int:
+        """Move as movimentações de um ano fechado para o arquivo anual
+        
+        Retorna a quantidade de movimentações arquivadas.
+        """
+        if year >= utc_year():
+            raise ValueError(f"O período {year} ainda não está fechado")
+        
+        start, end = to_epoch(f'{year}-01-01'), to_epoch(f'{year + 1}-01-01')
+        with self.db.exclusive('Arquivamento de movimentações'):
+            pending = self.db.execute_query(
+                'SELECT COUNT(*) FROM movimentacoes WHERE data_epoch >= ? AND data_epoch < ?',
+                (start, end)
+            )[0][0]
+            if not pending:
+                return 0
+            
+            self.attach(year)
+            schema = self.schema_name(year)
+            with self.db.transaction():
+                self.db.execute_command(f'''
+                    INSERT OR IGNORE INTO {schema}.movimentacoes (
+                        id, produto_id, tipo, quantidade, valor_unitario,
+                        valor_total, observacao, data_movimentacao, usuario, transferencia_id
+                    )
+                    SELECT id, produto_id, tipo, quantidade, valor_unitario,
+                           valor_total, observacao, data_movimentacao, usuario, transferencia_id
+                    FROM main.movimentacoes
+                    WHERE data_epoch >= ? AND data_epoch < ?
+                ''', (start, end))
+                self.db.execute_command('''
+                    INSERT INTO movimentacoes_resumo (
+                        produto_id, periodo, qtd_movimentacoes, entradas, saidas,
+                        valor_entradas, valor_saidas
+                    )
+                    SELECT
+                        produto_id, ?, COUNT(*),
+                        SUM(CASE WHEN tipo = 'ENTRADA' THEN quantidade ELSE 0 END),
+                        SUM(CASE WHEN tipo = 'SAIDA' THEN quantidade ELSE 0 END),
+                        SUM(CASE WHEN tipo = 'ENTRADA' THEN valor_total ELSE 0 END),
+                        SUM(CASE WHEN tipo = 'SAIDA' THEN valor_total ELSE 0 END)
+                    FROM main.movimentacoes
+                    WHERE data_epoch >= ? AND data_epoch < ?
+                    GROUP BY produto_id
+                    ON CONFLICT (produto_id, periodo) DO UPDATE SET
+                        qtd_movimentacoes = qtd_movimentacoes + excluded.qtd_movimentacoes,
+                        entradas = entradas + excluded.entradas,
+                        saidas = saidas + excluded.saidas,
+                        valor_entradas = valor_entradas + excluded.valor_entradas,
+                        valor_saidas = valor_saidas + excluded.valor_saidas
+                ''', (str(year), start, end))
+                self.db.execute_command(
+                    'DELETE FROM main.movimentacoes WHERE data_epoch >= ? AND data_epoch < ?',
+                    (start, end)
+                )
+            
+            self.db.cache.clear()
+            self.rebuild_unified_view()
+        print(f"✅ {pending} movimentações de {year} arquivadas em {self.archive_path(year)}")
+        return pending
+    
+    def archive_closed_periods(self) -> Dict[int, int]:
+        """Arquiva todos os anos anteriores ao atual ainda na tabela ativa"""
+        rows = self.db.execute_query('''
+            SELECT DISTINCT CAST(strftime('%Y', data_epoch, 'unixepoch') AS INTEGER) as ano
+            FROM movimentacoes
+            WHERE data_epoch < ?
+        ''', (to_epoch(f'{utc_year()}-01-01'),))
+        
+        return {row['ano']: self.archive_year(row['ano']) for row in rows}
+
+class BackupManager:
+    """Backups online do banco via API de backup do sqlite3
+    
+    A cópia é feita em passos de poucas páginas com pausas entre eles, para
+    não travar quem está escrevendo. Cada snapshot é verificado
+    (integrity_check), comprimido com gzip e os mais antigos são descartados.
+    Os arquivos anuais de movimentações (MovementArchiver) não entram no
+    snapshot, pois não mudam depois de fechados: devem ser copiados à parte
+    (data/arquivo). Um backup de versão anterior do sistema é migrado antes
+    de substituir o banco em uso.
+    """
+    
+    BACKUP_DIR = os.path.join('data', 'backups')
+    BACKUP_PREFIX = 'estoque_'
+    BACKUP_SUFFIX = '.db.gz'
+    TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+    
+    def __init__(self, db: 'DatabaseManager', backup_dir: str = None, keep: int = 48,
+                 pages_per_step: int = 256, step_sleep: float = 0.005):
+        self.db = db
+        self.backup_dir = backup_dir or self.BACKUP_DIR
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._stop_event = threading.Event()
+    
+    def _backup_name(self, moment: datetime) -> str:
+        return f'{self.BACKUP_PREFIX}{moment.strftime(self.TIMESTAMP_FORMAT)}{self.BACKUP_SUFFIX}'
+    
+    @staticmethod
+    def check_integrity(path: str) -> bool:
+        """Executa PRAGMA integrity_check em um arquivo de banco"""
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+        finally:
+            connection.close()
+    
+    def create_backup(self) -> str:
+        """Cria um snapshot comprimido do banco e retorna o caminho"""
+        with self._lock:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            moment = datetime.now()
+            path = os.path.join(self.backup_dir, self._backup_name(moment))
+            partial = path[:-len('.gz')] + '.partial'
+            
+            try:
+                target = sqlite3.connect(partial)
+                try:
+                    self.db.get_connection().backup(
+                        target,
+                        pages=self.pages_per_step,
+                        sleep=self.step_sleep
+                    )
+                finally:
+                    target.close()
+                
+                if not self.check_integrity(partial):
+                    raise sqlite3.DatabaseError("Backup falhou na verificação de integridade")
+                
+                with open(partial, 'rb') as source, gzip.open(path, 'wb', compresslevel=6) as compressed:
+                    shutil.copyfileobj(source, compressed, length=1024 * 1024)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            
+            self.rotate()
+            print(f"✅ Backup criado: {path}")
+            return path
+    
+    def list_backups(self) -> List[Dict[str, Any]]:
+        """Lista os backups existentes, do mais recente para o mais antigo"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        
+        backups = []
+        for filename in os.listdir(self.backup_dir):
+            if not (filename.startswith(self.BACKUP_PREFIX) and filename.endswith(self.BACKUP_SUFFIX)):
+                continue
+            stamp = filename[len(self.BACKUP_PREFIX):-len(self.BACKUP_SUFFIX)]
+            try:
+                moment = datetime.strptime(stamp, self.TIMESTAMP_FORMAT)
+            except ValueError:
+                continue
+            path = os.path.join(self.backup_dir, filename)
+            backups.append({'path': path, 'timestamp': moment, 'size': os.path.getsize(path)})
+        
+        backups.sort(key=lambda b: b['timestamp'], reverse=True)
+        return backups
+    
+    def rotate(self):
+        """Remove os backups além do limite de retenção"""
+        for backup in self.list_backups()[self.keep:]:
+            os.remove(backup['path'])
+    
+    def _decompress(self, path: str) -> str:
+        restored = os.path.join(self.backup_dir, os.path.basename(path)[:-len('.gz')] + '.restore')
+        with gzip.open(path, 'rb') as compressed, open(restored, 'wb') as target:
+            shutil.copyfileobj(compressed, target, length=1024 * 1024)
+        return restored
+    
+    def verify_backup(self, path: str) -> bool:
+        """Descomprime um backup e verifica sua integridade"""
+        restored = self._decompress(path)
+        try:
+            return self.check_integrity(restored)
+        finally:
+            os.remove(restored)
+    
+    def restore_backup(self, path: str):
+        """Restaura um backup sobre o banco em uso (conexão atual)"""
+        with self._lock:
+            restored = self._decompress(path)
+            try:
+                if not self.check_integrity(restored):
+                    raise sqlite3.DatabaseError(f"Backup corrompido: {path}")
+                self.migrate(restored)
+                
+                # Ninguém grava durante a cópia; transação aberta impede a restauração
+                with self.db.exclusive('Restauração de backup'):
+                    source = sqlite3.connect(restored)
+                    try:
+                        source.backup(self.db.get_connection())
+                    finally:
+                        source.close()
+                    self.db.cache.clear()
+            finally:
+                os.remove(restored)
+        print(f"✅ Backup restaurado: {path}")
+    
+    @staticmethod
+    def migrate(path: str):
+        """Leva um banco restaurado ao schema atual (backups de versões anteriores)"""
+        connection = sqlite3.connect(path)
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            connection.close()
+        if version > DatabaseManager.SCHEMA_VERSION:
+            raise sqlite3.DatabaseError(f"Backup de uma versão mais nova do sistema (schema {version})")
+        if version < DatabaseManager.SCHEMA_VERSION:
+            DatabaseManager(path).close()  # init_database aplica as migrações de create_tables
+    
+    def restore_point_in_time(self, moment: datetime) -> str:
+        """Restaura o backup mais recente feito até o momento informado"""
+        candidates = [b for b in self.list_backups() if b['timestamp'] <= moment]
+        if not candidates:
+            raise FileNotFoundError(f"Nenhum backup anterior a {moment:%d/%m/%Y %H:%M}")
+        
+        path = candidates[0]['path']
+        self.restore_backup(path)
+        return path
+    
+    def start_scheduler(self, interval_seconds: int = 3600):
+        """Inicia uma thread que faz backups periódicos"""
+        if self._scheduler and self._scheduler.is_alive():
+            return
+        
+        def run():
+            while not self._stop_event.wait(interval_seconds):
+                try:
+                    self.create_backup()
+                except Exception as e:
+                    print(f"❌ Erro no backup agendado: {e}")
+        
+        self._stop_event.clear()
+        self._scheduler = threading.Thread(target=run, name='backup-scheduler', daemon=True)
+        self._scheduler.start()
+    
+    def stop_scheduler(self):
+        self._stop_event.set()
+
+class ValuationEngine:
+    """Custo do estoque mantido incrementalmente (custo médio ponderado e FIFO)
+    
+    Cada ENTRADA atualiza o custo médio e abre uma camada FIFO com o
+    valor_unitario da movimentação; cada SAIDA consome as camadas mais
+    antigas. Os relatórios leem custos_produto, sem reprocessar o histórico.
+    """
+    
+    def __init__(self, db: 'DatabaseManager'):
+        self.db = db
+    
+    def apply_entry(self, product_id: int, movement_id: Optional[int], quantidade: int, custo_unitario: float):
+        """Aplica uma entrada (chamar dentro da transação da movimentação)"""
+        self.db.command_named(
+            'custos.entrada',
+            (product_id, quantidade, custo_unitario, quantidade * custo_unitario)
+        )
+        self.db.command_named(
+            'custos.camada_inserir',
+            (product_id, movement_id, quantidade, quantidade, custo_unitario)
+        )
+    
+    def apply_exit(self, product_id: int, quantidade: int) -> Dict[str, float]:
+        """Aplica uma saída e retorna o custo baixado (FIFO e médio)"""
+        custo_fifo = 0.0
+        restante = quantidade
+        for layer in self.db.query_named('custos.camadas_abertas', (product_id,)):
+            if restante <= 0:
+                break
+            consumo = min(restante, layer['saldo'])
+            self.db.command_named('custos.camada_baixar', (consumo, layer['id']))
+            custo_fifo += consumo * layer['custo_unitario']
+            restante -= consumo
+        
+        rows = self.db.query_named('custos.por_produto', (product_id,))
+        custo_medio = rows[0]['custo_medio'] if rows else 0.0
+        self.db.command_named('custos.saida', (quantidade, custo_fifo, product_id))
+        return {'fifo': custo_fifo, 'medio': quantidade * custo_medio}
+    
+    def ensure_initialized(self):
+        """Reconstrói o custo a partir do histórico na primeira execução"""
+        try:
+            if self.db.query_named('custos.existe')[0][0]:
+                return
+            if self.db.execute_query('SELECT EXISTS (SELECT 1 FROM movimentacoes_todas)')[0][0]:
+                self.rebuild()
+                
+        except Exception as e:
+            print(f"❌ Erro ao inicializar custos: {e}")
+    
+    def rebuild(self):
+        """Recalcula todo o custo reprocessando o histórico (inclusive arquivado)
+        
+        Usado apenas para migrar bases antigas; o dia a dia é incremental.
+        Transferências entre locais não alteram o custo e são ignoradas.
+        """
+        movements = self.db.execute_query('''
+            SELECT m.id, m.produto_id, m.tipo, m.quantidade, m.valor_unitario
+            FROM movimentacoes_todas m
+            WHERE m.transferencia_id IS NULL
+            ORDER BY m.id
+        ''')
+        
+        with self.db.transaction():
+            self.db.execute_command('DELETE FROM camadas_custo')
+            self.db.execute_command('DELETE FROM custos_produto')
+            for movement_id, product_id, tipo, quantidade, valor_unitario in movements:
+                if tipo == 'ENTRADA':
+                    self.apply_entry(product_id, movement_id, quantidade, valor_unitario or 0.0)
+                else:
+                    self.apply_exit(product_id, quantidade)
+        print(f"✅ Custos recalculados a partir de {len(movements)} movimentações")
+    
+    def get_valuation(self) -> List[sqlite3.Row]:
+        """Valorização por produto: custo médio, FIFO e preço de venda"""
+        return self.db.query_named('custos.valorizacao')
+    
+    def get_totals(self) -> sqlite3.Row:
+        """Totais de valorização do estoque"""
+        return self.db.query_cached('custos.totais')[0]
+
+class DemandClassifier:
+    """Classificação ABC/XYZ dos produtos ativos
+    
+    ABC: participação acumulada no valor das saídas da janela (A até 80%,
+    B até 95%). XYZ: coeficiente de variação da quantidade de saída mês a
+    mês, meses sem saída contando como zero. A demanda fica agregada por
+    produto e mês em demanda_mensal; cada atualização soma apenas as
+    movimentações novas e grava somente as classes que mudaram.
+    """
+    
+    WINDOW_MONTHS = 12
+    ABC_LIMITS = (('A', 0.80), ('B', 0.95))
+    XYZ_LIMITS = (('X', 0.5), ('Y', 1.0))
+    
+    def __init__(self, db: 'DatabaseManager', window_months: int = None):
+        self.db = db
+        self.window_months = window_months or self.WINDOW_MONTHS
+    
+    def window_start(self, today: datetime = None) -> str:
+        """Primeiro mês da janela ('AAAA-MM'), incluindo o mês atual"""
+        today = today or datetime.now()
+        month = today.year * 12 + today.month - self.window_months
+        return f'{month // 12:04d}-{month % 12 + 1:02d}'
+    
+    @classmethod
+    def abc_class(cls, acumulado: float, valor: float, total: float) -> str:
+        if valor <= 0 or total <= 0:
+            return 'C'
+        for classe, limite in cls.ABC_LIMITS:
+            if acumulado / total < limite:
+                return classe
+        return 'C'
+    
+    @classmethod
+    def xyz_class(cls, quantidade: int, quadrados: int, meses: int) -> str:
+        media = quantidade / meses
+        if media <= 0:
+            return 'Z'
+        variacao = math.sqrt(max(quadrados / meses - media * media, 0.0)) / media
+        for classe, limite in cls.XYZ_LIMITS:
+            if variacao <= limite:
+                return classe
+        return 'Z'
+    
+    def refresh(self, full: bool = False) -> Dict[str, int]:
+        """Atualiza a demanda e as classes; full=True reprocessa o histórico da janela"""
+        inicio = self.window_start()
+        with self.db.transaction():
+            rows = self.db.query_named('classificacao.marca')
+            marca = rows[0][0] if rows else None
+            if full or marca is None:
+                # Primeira execução: agrega o histórico (inclusive arquivado) da janela
+                ultima = self.db.query_named('classificacao.ultima_historico')[0][0]
+                self.db.command_named('classificacao.limpar_demanda')
+                self.db.command_named('classificacao.reconstruir_demanda', (ultima, to_epoch(f'{inicio}-01')))
+            else:
+                ultima = max(self.db.query_named('classificacao.ultima_movimentacao')[0][0], marca)
+                if ultima > marca:
+                    self.db.command_named('classificacao.acumular_demanda', (marca, ultima))
+            self.db.command_named('classificacao.descartar_demanda', (inicio,))
+            self.db.command_named('classificacao.gravar_marca', (ultima,))
+            
+            changes = []
+            total = 0
+            for row in self.db.query_named('classificacao.calcular', (inicio,)):
+                total += 1
+                abc = self.abc_class(row['acumulado'], row['valor'], row['total'])
+                xyz = self.xyz_class(row['quantidade'], row['quadrados'], self.window_months)
+                if (abc, xyz) != (row['classe_abc'], row['classe_xyz']):
+                    changes.append((abc, xyz, row['id']))
+            if changes:
+                self.db.executemany(StatementRegistry.get('classificacao.gravar'), changes)
+            self.db.command_named('classificacao.limpar_inativos')
+        return {'produtos': total, 'alterados': len(changes)}
+    
+    def get_summary(self) -> Dict[str, int]:
+        """Quantidade de produtos ativos por classe combinada ('AX', 'BZ', ...)"""
+        return {
+            row['classe_abc'] + row['classe_xyz']: row['qtd_produtos']
+            for row in self.db.query_cached('classificacao.resumo')
+        }
+
+def _open_shard_source(db_path: str, archive_path: Optional[str]) -> sqlite3.Connection:
+    """Abre conexões somente leitura para um worker de exportação"""
+    connection = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    if archive_path:
+        connection.execute(
+            'ATTACH DATABASE ? AS arq',
+            (Path(archive_path).resolve().as_uri() + '?mode=ro',)
+        )
+    return connection
+
+def _export_movements_shard(db_path: str, archive_path: Optional[str], start_id: int,
+                            end_id: int, output_path: str) -> int:
+    """Worker: grava as movimentações de uma faixa de IDs em um arquivo parcial"""
+    connection = _open_shard_source(db_path, archive_path)
+    table = 'arq.movimentacoes' if archive_path else 'main.movimentacoes'
+    try:
+        cursor = connection.execute(f'''
+            SELECT m.id, COALESCE(p.nome, pa.nome), m.tipo, m.quantidade, m.valor_unitario,
+                   m.valor_total, m.observacao, m.data_movimentacao, m.usuario
+            FROM {table} m
+            LEFT JOIN main.produtos p ON p.id = m.produto_id
+            LEFT JOIN main.produtos_arquivados pa ON pa.id = m.produto_id
+            WHERE m.id >= ? AND m.id < ?
+            ORDER BY m.id
+        ''', (start_id, end_id))
+        
+        count = 0
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for row in cursor:
+                item = dict(zip(ShardedJobRunner.EXPORT_FIELDS, row))
+                f.write((',\n' if count else '') + '  ' + json.dumps(item, ensure_ascii=False))
+                count += 1
+        return count
+    finally:
+        connection.close()
+
+def _report_shard(db_path: str, archive_path: Optional[str], start_id: int, end_id: int) -> List[tuple]:
+    """Worker: agrega as movimentações de uma faixa de IDs por mês e produto"""
+    connection = _open_shard_source(db_path, archive_path)
+    table = 'arq.movimentacoes' if archive_path else 'main.movimentacoes'
+    try:
+        return connection.execute(f'''
+            SELECT
+                substr(m.data_movimentacao, 1, 7) as periodo,
+                m.produto_id,
+                COUNT(*),
+                SUM(CASE WHEN m.tipo = 'ENTRADA' THEN m.quantidade ELSE 0 END),
+                SUM(CASE WHEN m.tipo = 'SAIDA' THEN m.quantidade ELSE 0 END),
+                SUM(CASE WHEN m.tipo = 'ENTRADA' THEN m.valor_total ELSE 0 END),
+                SUM(CASE WHEN m.tipo = 'SAIDA' THEN m.valor_total ELSE 0 END)
+            FROM {table} m
+            WHERE m.id >= ? AND m.id < ?
+            GROUP BY periodo, m.produto_id
+        ''', (start_id, end_id)).fetchall()
+    finally:
+        connection.close()
+
+class ShardedJobRunner:
+    """Exportações e relatórios de histórico divididos entre processos
+    
+    O histórico (tabela ativa e arquivos anuais) é dividido em faixas de IDs;
+    cada processo abre sua própria conexão somente leitura e o resultado é
+    consolidado em um único arquivo. Não funciona com bancos em memória.
+    """
+    
+    EXPORT_FIELDS = (
+        'id', 'produto', 'tipo', 'quantidade', 'valor_unitario',
+        'valor_total', 'observacao', 'data_movimentacao', 'usuario'
+    )
+    
+    def __init__(self, db_path: str, archive_paths: List[str] = None,
+                 workers: int = None, shard_size: int = 50000, output_dir: str = 'data'):
+        if not db_path:
+            raise ValueError("Exportação em vários processos requer um banco em arquivo")
+        self.db_path = db_path
+        self.archive_paths = archive_paths or []
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.output_dir = output_dir
+    
+    def shards(self) -> List[tuple]:
+        """Faixas (arquivo, id_inicial, id_final) do histórico, da mais antiga à mais recente"""
+        shards = []
+        for archive_path in [*self.archive_paths, None]:
+            connection = _open_shard_source(self.db_path, archive_path)
+            table = 'arq.movimentacoes' if archive_path else 'main.movimentacoes'
+            try:
+                min_id, max_id = connection.execute(f'SELECT MIN(id), MAX(id) FROM {table}').fetchone()
+            finally:
+                connection.close()
+            
+            if min_id is None:
+                continue
+            for start_id in range(min_id, max_id + 1, self.shard_size):
+                shards.append((archive_path, start_id, start_id + self.shard_size))
+        return shards
+    
+    def _output_path(self, prefix: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return os.path.join(self.output_dir, f'{prefix}_{timestamp}.json')
+    
+    def _run_shards(self, worker, shard_args: List[tuple], progress=None) -> List[Any]:
+        """Executa o worker para cada faixa e devolve os resultados na ordem das faixas"""
+        results = [None] * len(shard_args)
+        # spawn: um fork copiaria locks presos pelas outras threads (API, fila de tarefas, interface)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(worker, *args): index for index, args in enumerate(shard_args)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if progress:
+                    progress(done * 100.0 / len(shard_args))
+        return results
+    
+    def export_movements(self, filename: str = None, progress=None) -> str:
+        """Exporta todo o histórico de movimentações para um arquivo JSON
+        
+        progress: callback opcional chamado com o percentual concluído.
+        """
+        filename = filename or self._output_path('movimentacoes_export')
+        shards = self.shards()
+        parts = [f'{filename}.part{index}' for index in range(len(shards))]
+        
+        try:
+            counts = self._run_shards(
+                _export_movements_shard,
+                [(self.db_path, *shard, part) for shard, part in zip(shards, parts)],
+                progress
+            )
+            
+            # Consolida os arquivos parciais na ordem das faixas
+            with open(filename, 'w', encoding='utf-8') as output:
+                output.write('[\n')
+                written = 0
+                for part, count in zip(parts, counts):
+                    if not count:
+                        continue
+                    if written:
+                        output.write(',\n')
+                    with open(part, 'r', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, output)
+                    written += count
+                output.write('\n]\n')
+        finally:
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
+        
+        print(f"✅ {sum(counts)} movimentações exportadas em {len(shards)} partes para {filename}")
+        return filename
+    
+    def generate_period_report(self, filename: str = None, progress=None) -> str:
+        """Gera o relatório mensal por produto de todo o histórico (JSON)"""
+        filename = filename or self._output_path('relatorio_periodos')
+        shards = self.shards()
+        results = self._run_shards(_report_shard, [(self.db_path, *shard) for shard in shards], progress)
+        
+        # Um mesmo mês pode estar dividido entre faixas: soma os parciais
+        totals = {}
+        for rows in results:
+            for periodo, produto_id, *values in rows:
+                entry = totals.setdefault((periodo, produto_id), [0, 0, 0, 0.0, 0.0])
+                for index, value in enumerate(values):
+                    entry[index] += value or 0
+        
+        connection = _open_shard_source(self.db_path, None)
+        try:
+            names = dict(connection.execute('SELECT id, nome FROM produtos'))
+        finally:
+            connection.close()
+        report = [
+            {
+                'periodo': periodo,
+                'produto_id': produto_id,
+                'produto': names.get(produto_id),
+                'movimentacoes': values[0],
+                'entradas': values[1],
+                'saidas': values[2],
+                'valor_entradas': values[3],
+                'valor_saidas': values[4]
+            }
+            for (periodo, produto_id), values in sorted(totals.items(), key=lambda item: (item[0][0], item[0][1]))
+        ]
+        
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        
+        print(f"✅ Relatório de {len(report)} linhas gerado em {filename}")
+        return filename
+
+class JobCancelled(Exception):
+    """Interrompe uma tarefa cujo cancelamento foi pedido"""
+
+class JobContext:
+    """Passado às tarefas para informar progresso e verificar cancelamento"""
+    
+    def __init__(self, queue: 'JobQueue', job_id: int):
+        self.queue = queue
+        self.job_id = job_id
+    
+    def progress(self, percent: float, message: str = None):
+        """Atualiza o percentual concluído (e interrompe se cancelada)"""
+        self.queue.update_progress(self.job_id, percent, message)
+        self.check_cancelled()
+    
+    def check_cancelled(self):
+        if self.queue.is_cancel_requested(self.job_id):
+            raise JobCancelled()
+
+class JobQueue(PerDatabase):
+    """Fila persistente de tarefas (tabela jobs) executada por threads
+    
+    Suporta cancelamento, novas tentativas com espera crescente, progresso
+    enviado aos assinantes (interface) e tarefas recorrentes. Existe uma
+    única fila por banco (DatabaseManager) no processo.
+    """
+    
+    RETRY_BASE_SECONDS = 5
+    
+    def __init__(self, db: 'DatabaseManager' = None):
+        if self._initialized:
+            return
+        self._initialized = True
+        self.db = db or DatabaseManager.default()
+        self.handlers = {}
+        self.owner = None  # controlador cujos handlers atendem a fila (o primeiro registrado)
+        self._listeners = []
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self.poll_interval = 1.0
+    
+    def claim(self, owner) -> bool:
+        """Torna owner o dono dos handlers; False se a fila já tiver um"""
+        with self._instances_lock:
+            if self.owner is not None:
+                return False
+            self.owner = owner
+            return True
+    
+    def register(self, tipo: str, handler):
+        """Registra a função que executa um tipo de tarefa
+        
+        handler(context: JobContext, **parametros) -> resultado (texto)
+        """
+        self.handlers[tipo] = handler
+    
+    def subscribe(self, callback):
+        """Assina as atualizações de tarefas (callback recebe o registro da tarefa)"""
+        self._listeners.append(callback)
+    
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    def _notify(self, job_id: int):
+        if not self._listeners:
+            return
+        job = self.get_job(job_id)
+        for callback in list(self._listeners):
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"❌ Erro ao notificar tarefa {job_id}: {e}")
+                self.unsubscribe(callback)
+    
+    def enqueue(self, tipo: str, parametros: Dict[str, Any] = None, delay_seconds: int = 0,
+                max_tentativas: int = 3, intervalo_segundos: int = None) -> int:
+        """Coloca uma tarefa na fila e retorna seu ID"""
+        if tipo not in self.handlers:
+            raise ValueError(f"Tipo de tarefa desconhecido: {tipo}")
+        
+        job_id = self.db.command_named('jobs.inserir', (
+            tipo,
+            json.dumps(parametros or {}, sort_keys=True),
+            max_tentativas,
+            intervalo_segundos,
+            f'+{int(delay_seconds)} seconds'
+        ))
+        self._wakeup.set()
+        self._notify(job_id)
+        return job_id
+    
+    def schedule_recurring(self, tipo: str, intervalo_segundos: int, parametros: Dict[str, Any] = None,
+                           first_run: datetime = None) -> int:
+        """Agenda uma tarefa recorrente (não duplica se já houver uma agendada)"""
+        params_json = json.dumps(parametros or {}, sort_keys=True)
+        existing = self.db.query_named('jobs.recorrente_pendente', (tipo, params_json))
+        if existing:
+            return existing[0]['id']
+        
+        delay = max((first_run - datetime.now()).total_seconds(), 0) if first_run else intervalo_segundos
+        return self.enqueue(tipo, parametros, delay, intervalo_segundos=intervalo_segundos)
+    
+    def cancel(self, job_id: int) -> bool:
+        """Cancela uma tarefa pendente ou pede a interrupção de uma em execução"""
+        cancelled = self.db.command_named('jobs.cancelar', (job_id,)) > 0
+        if cancelled:
+            self._notify(job_id)
+        return cancelled
+    
+    def is_cancel_requested(self, job_id: int) -> bool:
+        rows = self.db.query_named('jobs.cancelamento_pedido', (job_id,))
+        return bool(rows and rows[0]['cancelar'])
+    
+    def update_progress(self, job_id: int, percent: float, message: str = None):
+        self.db.command_named('jobs.progresso', (min(max(percent, 0.0), 100.0), message, job_id))
+        self._notify(job_id)
+    
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        rows = self.db.query_named('jobs.por_id', (job_id,))
+        return dict(rows[0]) if rows else None
+    
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Lista as tarefas mais recentes"""
+        return [dict(row) for row in self.db.query_named('jobs.listar', (limit,))]
+    
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        with self.db.transaction():
+            rows = self.db.query_named('jobs.proximo')
+            if not rows:
+                return None
+            job_id = rows[0]['id']
+            if not self.db.command_named('jobs.iniciar', (job_id,)):
+                return None
+        return self.get_job(job_id)
+    
+    def run_pending(self) -> bool:
+        """Executa a próxima tarefa vencida; retorna False se a fila estiver vazia"""
+        job = self._claim_next()
+        if job is None:
+            return False
+        
+        self._notify(job['id'])
+        context = JobContext(self, job['id'])
+        try:
+            handler = self.handlers[job['tipo']]
+            result = handler(context, **json.loads(job['parametros'] or '{}'))
+            self.db.command_named('jobs.finalizar', ('CONCLUIDO', 100.0, 'Concluído', str(result), job['id']))
+            
+        except JobCancelled:
+            self.db.command_named('jobs.finalizar', ('CANCELADO', None, 'Cancelado', None, job['id']))
+            
+        except Exception as e:
+            if job['tentativas'] < job['max_tentativas']:
+                espera = self.RETRY_BASE_SECONDS * 2 ** (job['tentativas'] - 1)
+                self.db.command_named('jobs.reagendar', (
+                    f"Tentativa {job['tentativas']} falhou: {e}", f'+{espera} seconds', job['id']
+                ))
+            else:
+                self.db.command_named('jobs.finalizar', ('FALHOU', None, str(e), None, job['id']))
+            print(f"❌ Erro na tarefa {job['id']} ({job['tipo']}): {e}")
+        
+        # Tarefas recorrentes agendam a próxima execução ao terminar
+        finished = self.get_job(job['id'])
+        if finished['intervalo_segundos'] and finished['status'] in ('CONCLUIDO', 'FALHOU'):
+            self.enqueue(
+                finished['tipo'],
+                json.loads(finished['parametros'] or '{}'),
+                finished['intervalo_segundos'],
+                finished['max_tentativas'],
+                finished['intervalo_segundos']
+            )
+        
+        self._notify(job['id'])
+        return True
+    
+    def start(self, workers: int = 2):
+        """Inicia as threads de execução (tarefas interrompidas voltam para a fila)"""
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        
+        self.db.command_named('jobs.recuperar')
+        self._stop_event.clear()
+        
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    if self.run_pending():
+                        continue
+                except Exception as e:
+                    print(f"❌ Erro na fila de tarefas: {e}")
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        
+        self._threads = [
+            threading.Thread(target=run, name=f'job-worker-{index}', daemon=True)
+            for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+class MaintenanceManager:
+    """Manutenção do armazenamento: produtos inativos, espaço livre e estatísticas
+    
+    Produtos desativados há mais de INACTIVE_DAYS, sem saldo e sem
+    movimentações na tabela ativa (nem reservas, pedidos, contagens abertas,
+    transferências ou kits) saem de produtos para produtos_arquivados,
+    levando junto as linhas de saldo, custo e lotes zerados. Em seguida as páginas livres voltam
+    ao sistema (incremental_vacuum) e o ANALYZE atualiza as estatísticas.
+    """
+    
+    INACTIVE_DAYS = 365
+    BATCH_SIZE = 500
+    PURGE_COMMANDS = (
+        'manutencao.arquivar_produto',
+        'manutencao.remover_estoque_local',
+        'manutencao.remover_lotes_movimentacoes',
+        'manutencao.remover_lotes',
+        'manutencao.remover_custos',
+        'manutencao.remover_camadas',
+        'manutencao.remover_demanda',
+        'manutencao.remover_contagens',
+        'manutencao.remover_produto',
+    )
+    
+    def __init__(self, controller: 'ProductController'):
+        self.controller = controller
+        self.db = controller.db
+    
+    def purge_inactive(self, days: int = None, batch_size: int = None) -> int:
+        """Arquiva os produtos inativos elegíveis e retorna quantos saíram de produtos"""
+        days = self.INACTIVE_DAYS if days is None else days
+        batch_size = batch_size or self.BATCH_SIZE
+        total = 0
+        while True:
+            with self.db.transaction():
+                ids = [
+                    (row[0],) for row in
+                    self.db.query_named('manutencao.produtos_inativos', (f'-{int(days)} days', batch_size))
+                ]
+                for command in self.PURGE_COMMANDS:
+                    self.db.executemany(StatementRegistry.get(command), ids)
+            total += len(ids)
+            if len(ids) < batch_size:
+                return total
+    
+    def run(self, days: int = None, max_pages: int = None) -> Dict[str, Any]:
+        """Executa a manutenção completa e mede o arquivo antes e depois"""
+        start = time.perf_counter()
+        antes = self.db.storage_stats()
+        arquivados = self.purge_inactive(days)
+        self.db.compact(max_pages)
+        self.db.analyze()
+        depois = self.db.storage_stats()
+        
+        result = {
+            'produtos_arquivados': arquivados,
+            'paginas_antes': antes['page_count'],
+            'paginas_depois': depois['page_count'],
+            'livres_antes': antes['freelist_count'],
+            'livres_depois': depois['freelist_count'],
+            'bytes_liberados': (antes['page_count'] - depois['page_count']) * depois['page_size'],
+            'duracao_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+        print(
+            f"✅ Manutenção: {arquivados} produtos arquivados, "
+            f"{result['paginas_antes']} → {result['paginas_depois']} páginas"
+        )
+        return result
+
+class PurchasingManager:
+    """Pedidos de compra gerados a partir das sugestões de reposição
+    
+    Produtos abaixo do mínimo são agrupados por fornecedor, com quantidade
+    para completar o estoque máximo (descontando o que já está em pedidos
+    abertos). O recebimento lança todas as linhas como ENTRADA em uma única
+    transação.
+    """
+    
+    def __init__(self, controller: 'ProductController'):
+        self.controller = controller
+        self.db = controller.db
+    
+    def get_suggestions(self) -> List[sqlite3.Row]:
+        """Sugestões de reposição (inclusive de produtos sem fornecedor)"""
+        return self.db.query_named('compras.sugestoes')
+    
+    def generate_orders(self, observacao: str = 'Gerado pela reposição automática') -> List[int]:
+        """Cria um pedido por fornecedor com todas as sugestões, em uma transação
+        
+        Produtos sem fornecedor não entram em pedidos.
+        """
+        order_ids = []
+        with self.db.transaction():
+            # Sugestões lidas dentro da transação: duas gerações simultâneas não
+            # pedem os mesmos produtos (a segunda já vê os pedidos em aberto)
+            by_supplier = {}
+            for suggestion in self.get_suggestions():
+                if suggestion['fornecedor_id'] is not None:
+                    by_supplier.setdefault(suggestion['fornecedor_id'], []).append(suggestion)
+            
+            for fornecedor_id, items in by_supplier.items():
+                order_id = self.db.command_named('compras.pedido_inserir', (fornecedor_id, observacao))
+                self.db.executemany(
+                    StatementRegistry.get('compras.item_inserir'),
+                    [(order_id, item['produto_id'], item['quantidade'], item['custo_unitario'])
+                     for item in items]
+                )
+                order_ids.append(order_id)
+        return order_ids
+    
+    def get_open_orders(self) -> List[sqlite3.Row]:
+        return self.db.query_named('compras.pedidos_abertos')
+    
+    def get_order_items(self, order_id: int) -> List[sqlite3.Row]:
+        return self.db.query_named('compras.itens', (order_id,))
+    
+    def receive_order(self, order_id: int, local_id: int = None) -> int:
+        """Recebe um pedido aberto: todas as linhas viram ENTRADA em uma transação
+        
+        Retorna a quantidade de linhas lançadas.
+        """
+        with self.db.transaction():
+            if not self.db.command_named('compras.pedido_status', ('RECEBIDO', 'RECEBIDO', order_id)):
+                raise ValueError(f"Pedido {order_id} não está aberto")
+            
+            items = self.get_order_items(order_id)
+            for item in items:
+                self.controller._post_movement(
+                    item['produto_id'], 'ENTRADA', item['quantidade'], item['custo_unitario'],
+                    f"Pedido de compra #{order_id}", local_id
+                )
+        return len(items)
+    
+    def cancel_order(self, order_id: int) -> bool:
+        return self.db.command_named('compras.pedido_status', ('CANCELADO', 'CANCELADO', order_id)) > 0
+
+class CycleCountManager:
+    """Contagens físicas de estoque (inventário cíclico) por local
+    
+    Ao abrir a sessão, o saldo de cada produto ativo no local é congelado
+    com um único INSERT ... SELECT. As quantidades contadas chegam em lote
+    (importação ou leituras), as divergências saem de uma única query e os
+    ajustes aprovados são lançados em uma transação. O ajuste é a diferença
+    entre contado e congelado, aplicada sobre o saldo atual, de modo que
+    movimentações feitas durante a contagem são preservadas.
+    """
+    
+    def __init__(self, controller: 'ProductController'):
+        self.controller = controller
+        self.db = controller.db
+    
+    def start(self, local_id: int = None, observacao: str = '') -> int:
+        """Abre uma sessão de contagem e congela os saldos do local"""
+        local_id = local_id or DatabaseManager.DEFAULT_LOCATION_ID
+        with self.db.transaction():
+            count_id = self.db.command_named('contagens.inserir', (local_id, observacao))
+            self.db.command_named('contagens.congelar', (count_id, local_id))
+        return count_id
+    
+    def get_open_sessions(self) -> List[sqlite3.Row]:
+        return self.db.query_named('contagens.abertas')
+    
+    def _require_open(self, count_id: int) -> sqlite3.Row:
+        rows = self.db.query_named('contagens.por_id', (count_id,))
+        if not rows or rows[0]['status'] != 'ABERTA':
+            raise ValueError(f"Contagem {count_id} não está aberta")
+        return rows[0]
+    
+    def record_counts(self, count_id: int, counts: Dict[int, int], accumulate: bool = False) -> Dict[str, Any]:
+        """Grava quantidades contadas {produto_id: quantidade}
+        
+        accumulate=True soma à contagem já registrada (leituras em várias passadas).
+        Produtos fora da sessão são devolvidos em 'ignorados'.
+        """
+        self._require_open(count_id)
+        in_session = {row[0] for row in self.db.query_named('contagens.produtos', (count_id,))}
+        valid = [(quantidade, count_id, product_id)
+                 for product_id, quantidade in counts.items() if product_id in in_session]
+        ignored = [product_id for product_id in counts if product_id not in in_session]
+        
+        command = 'contagens.somar' if accumulate else 'contagens.definir'
+        with self.db.transaction():
+            self.db.executemany(StatementRegistry.get(command), valid)
+        return {'atualizados': len(valid), 'ignorados': ignored}
+    
+    def record_codes(self, count_id: int, codes: List[str]) -> Dict[str, Any]:
+        """Soma leituras de códigos (SKU/EAN): cada leitura conta uma unidade"""
+        counts, unknown = {}, []
+        for code in codes:
+            product_id = self.controller.codes.lookup(code)
+            if product_id is None:
+                unknown.append(code)
+            else:
+                counts[product_id] = counts.get(product_id, 0) + 1
+        result = self.record_counts(count_id, counts, accumulate=True)
+        result['codigos_desconhecidos'] = unknown
+        return result
+    
+    def get_variances(self, count_id: int) -> List[sqlite3.Row]:
+        """Produtos contados cuja quantidade difere do saldo congelado"""
+        return self.db.query_named('contagens.divergencias', (count_id,))
+    
+    def post_adjustments(self, count_id: int, product_ids: List[int] = None,
+                         zero_uncounted: bool = False) -> int:
+        """Fecha a sessão lançando os ajustes aprovados em uma única transação
+        
+        product_ids limita os ajustes aos produtos aprovados (None: todos).
+        zero_uncounted trata produtos não contados como contados com zero.
+        Retorna a quantidade de movimentações de ajuste lançadas.
+        """
+        local_id = self._require_open(count_id)['local_id']
+        approved = set(product_ids) if product_ids is not None else None
+        posted = 0
+        
+        with self.db.transaction():
+            if not self.db.command_named('contagens.status', ('FECHADA', count_id)):
+                raise ValueError(f"Contagem {count_id} não está aberta")
+            if zero_uncounted:
+                self.db.command_named('contagens.zerar_nao_contados', (count_id,))
+            
+            for variance in self.get_variances(count_id):
+                if approved is not None and variance['produto_id'] not in approved:
+                    continue
+                
+                # Nunca baixa mais que o saldo atual do local
+                delta = max(variance['diferenca'], -variance['estoque_local'])
+                if delta == 0:
+                    continue
+                
+                self.controller._post_movement(
+                    variance['produto_id'], 'ENTRADA' if delta > 0 else 'SAIDA', abs(delta),
+                    variance['preco_compra'] or 0.0, f"Ajuste de contagem #{count_id}", local_id,
+                    check_available=False
+                )
+                posted += 1
+        return posted
+    
+    def cancel(self, count_id: int) -> bool:
+        return self.db.command_named('contagens.status', ('CANCELADA', count_id)) > 0
+
+class ReservationManager:
+    """Reservas de estoque para pedidos pendentes, com prazo de validade
+    
+    O total reservado fica em estoque_local.reservado (por local) e em
+    produtos.estoque_reservado (total), atualizados a cada operação. Reservar
+    é um UPDATE condicional (saldo - reservado >= quantidade), então sessões
+    concorrentes nunca prometem as mesmas unidades e consultar o disponível
+    é uma leitura pela chave primária.
+    """
+    
+    DEFAULT_TTL = 30 * 60  # segundos
+    
+    def __init__(self, controller: 'ProductController'):
+        self.controller = controller
+        self.db = controller.db
+    
+    def reserve(self, product_id: int, quantidade: int, local_id: int = None,
+                ttl_seconds: int = None, referencia: str = '') -> int:
+        """Reserva unidades disponíveis no local e retorna o ID da reserva"""
+        if quantidade <= 0:
+            raise ValueError("Quantidade deve ser maior que zero")
+        if self.controller.kits.is_kit(product_id):
+            raise ValueError(f"Produto {product_id} é um kit: reserve os componentes")
+        local_id = local_id or DatabaseManager.DEFAULT_LOCATION_ID
+        expira_epoch = now_epoch()[1] + (ttl_seconds or self.DEFAULT_TTL)
+        
+        with self.db.transaction():
+            if not self.db.command_named('reservas.reter_local', (quantidade, product_id, local_id, quantidade)):
+                raise ValueError(f"Saldo disponível insuficiente do produto {product_id} no local {local_id}")
+            self.db.command_named('reservas.ajustar_produto', (quantidade, product_id))
+            return self.db.command_named(
+                'reservas.inserir', (product_id, local_id, quantidade, referencia, expira_epoch)
+            )
+    
+    def _finish(self, reservation_id: int, status: str) -> sqlite3.Row:
+        """Encerra uma reserva ativa e devolve as unidades ao disponível (dentro de uma transação)"""
+        if not self.db.command_named('reservas.finalizar', (status, reservation_id)):
+            raise ValueError(f"Reserva {reservation_id} não está ativa")
+        reservation = self.db.query_named('reservas.por_id', (reservation_id,))[0]
+        self._unhold([(reservation['produto_id'], reservation['local_id'], reservation['quantidade'])])
+        return reservation
+    
+    def _unhold(self, holds: List[tuple]):
+        self.db.executemany(
+            StatementRegistry.get('reservas.soltar_local'),
+            [(quantidade, product_id, local_id) for product_id, local_id, quantidade in holds]
+        )
+        self.db.executemany(
+            StatementRegistry.get('reservas.ajustar_produto'),
+            [(-quantidade, product_id) for product_id, _, quantidade in holds]
+        )
+    
+    def release(self, reservation_id: int) -> bool:
+        """Cancela a reserva (pedido desistido)"""
+        with self.db.transaction():
+            self._finish(reservation_id, 'LIBERADA')
+        return True
+    
+    def commit(self, reservation_id: int, valor_unitario: float = None) -> bool:
+        """Confirma a reserva lançando a SAIDA das unidades retidas (pedido separado)"""
+        with self.db.transaction():
+            reservation = self._finish(reservation_id, 'CONFIRMADA')
+            product_id = reservation['produto_id']
+            if valor_unitario is None:
+                rows = self.db.execute_query('SELECT preco_venda FROM produtos WHERE id = ?', (product_id,))
+                valor_unitario = (rows[0][0] if rows else 0.0) or 0.0
+            observacao = f"Reserva #{reservation_id} {reservation['referencia'] or ''}".strip()
+            self.controller._post_movement(
+                product_id, 'SAIDA', reservation['quantidade'], valor_unitario,
+                observacao, reservation['local_id']
+            )
+        return True
+    
+    def available(self, product_id: int, local_id: int = None) -> int:
+        """Disponível para novas reservas/saídas: saldo - reservado (no local ou no total)"""
+        if local_id is None:
+            rows = self.db.query_named('reservas.disponivel', (product_id,))
+        else:
+            rows = self.db.query_named('reservas.disponivel_local', (product_id, local_id))
+        return rows[0][0] if rows else 0
+    
+    def get_active(self, product_id: int = None) -> List[sqlite3.Row]:
+        return self.db.query_named('reservas.ativas', (product_id, product_id))
+    
+    def expire_stale(self, batch_size: int = 500) -> int:
+        """Expira reservas vencidas em lotes, uma transação curta por lote
+        
+        Retorna a quantidade de reservas expiradas.
+        """
+        expired = 0
+        while True:
+            with self.db.transaction():
+                batch = self.db.query_named('reservas.vencidas', (now_epoch()[1], batch_size))
+                holds = {}
+                for row in batch:
+                    # Só conta o que este UPDATE finalizou (outra sessão pode ter confirmado antes)
+                    if not self.db.command_named('reservas.finalizar', ('EXPIRADA', row['id'])):
+                        continue
+                    expired += 1
+                    key = (row['produto_id'], row['local_id'])
+                    holds[key] = holds.get(key, 0) + row['quantidade']
+                self._unhold([(product_id, local_id, quantidade)
+                              for (product_id, local_id), quantidade in holds.items()])
+            if len(batch) < batch_size:
+                return expired
+
+class KitIndex(PerDatabase):
+    """Explosão dos kits em componentes finais, em memória (uma por banco)"""
+    
+    def __init__(self, db: 'DatabaseManager'):
+        if self._initialized:
+            return
+        self._initialized = True
+        self.db = db
+        self.lock = threading.Lock()
+        self._flat = None
+    
+    def reload(self):
+        flat = {}
+        for kit_id, componente_id, quantidade in self.db.query_named('kits.explodidos'):
+            flat.setdefault(kit_id, {})[componente_id] = quantidade
+        self._flat = flat
+    
+    def replace(self, flat: Dict[int, Dict[int, int]]):
+        self._flat = flat
+    
+    def get(self) -> Dict[int, Dict[int, int]]:
+        if self._flat is None:
+            with self.lock:
+                if self._flat is None:
+                    self.reload()
+        return self._flat
+
+class KitManager:
+    """Kits montados a partir de outros produtos (lista de materiais)
+    
+    A estrutura pode ter vários níveis (kit dentro de kit). Sempre que ela
+    muda, a explosão em componentes finais é recalculada em memória e gravada
+    em kits_explodidos, então a saída de um kit e a disponibilidade vêm de
+    uma leitura direta, sem consultas recursivas. O kit não tem saldo
+    próprio: movimentá-lo movimenta os componentes.
+    """
+    
+    def __init__(self, controller: 'ProductController'):
+        self.controller = controller
+        self.db = controller.db
+        self.index = KitIndex(self.db)
+    
+    def reload(self):
+        with self.index.lock:
+            self.index.reload()
+    
+    def is_kit(self, product_id: int) -> bool:
+        return product_id in self.index.get()
+    
+    def components(self, kit_id: int) -> Dict[int, int]:
+        """Componentes finais por unidade do kit {produto_id: quantidade}"""
+        return self.index.get().get(kit_id, {})
+    
+    def get_structure(self, kit_id: int) -> Dict[int, int]:
+        """Componentes diretos do kit (um nível), como cadastrados"""
+        return {
+            row['componente_id']: row['quantidade']
+            for row in self.db.query_named('kits.estrutura') if row['kit_id'] == kit_id
+        }
+    
+    @staticmethod
+    def _flatten(structure: Dict[int, Dict[int, int]]) -> Dict[int, Dict[int, int]]:
+        flat = {}
+        
+        def expand(kit_id: int, path: frozenset) -> Dict[int, int]:
+            if kit_id in flat:
+                return flat[kit_id]
+            if kit_id in path:
+                raise ValueError(f"Estrutura circular envolvendo o produto {kit_id}")
+            result = {}
+            for componente_id, quantidade in structure[kit_id].items():
+                if componente_id in structure:
+                    for leaf_id, leaf_qty in expand(componente_id, path | {kit_id}).items():
+                        result[leaf_id] = result.get(leaf_id, 0) + quantidade * leaf_qty
+                else:
+                    result[componente_id] = result.get(componente_id, 0) + quantidade
+            flat[kit_id] = result
+            return result
+        
+        for kit_id in structure:
+            expand(kit_id, frozenset())
+        return flat
+    
+    def set_components(self, kit_id: int, components: Dict[int, int]):
+        """Define os componentes diretos do kit ({} transforma o kit em produto comum)"""
+        if kit_id in components:
+            raise ValueError("Um kit não pode conter a si mesmo")
+        if any(quantidade <= 0 for quantidade in components.values()):
+            raise ValueError("Quantidade dos componentes deve ser maior que zero")
+        
+        with self.index.lock:
+            with self.db.transaction():
+                structure = {}
+                for row in self.db.query_named('kits.estrutura'):
+                    structure.setdefault(row['kit_id'], {})[row['componente_id']] = row['quantidade']
+                structure.pop(kit_id, None)
+                if components:
+                    structure[kit_id] = dict(components)
+                flat = self._flatten(structure)
+                
+                self.db.command_named('kits.limpar', (kit_id,))
+                self.db.executemany(
+                    StatementRegistry.get('kits.inserir'),
+                    [(kit_id, componente_id, quantidade) for componente_id, quantidade in components.items()]
+                )
+                self.db.command_named('kits.limpar_explosao')
+                self.db.executemany(
+                    StatementRegistry.get('kits.inserir_explosao'),
+                    [(kit, componente_id, quantidade)
+                     for kit, leaves in flat.items() for componente_id, quantidade in leaves.items()]
+                )
+            self.index.replace(flat)
+        # A fotografia marca quais produtos são kits
+        InventorySnapshot(self.db).invalidate()
+    
+    def available(self, kit_id: int, local_id: int = None) -> int:
+        """Kits que podem ser montados com o disponível dos componentes"""
+        if local_id is None:
+            rows = self.db.query_named('kits.disponivel', (kit_id,))
+        else:
+            rows = self.db.query_named('kits.disponivel_local', (local_id, kit_id))
+        return max(rows[0][0] or 0, 0) if rows else 0
+    
+    def get_availability(self) -> Dict[int, int]:
+        """Disponibilidade de todos os kits em uma única consulta"""
+        return {row['kit_id']: max(row['disponivel'], 0) for row in self.db.query_named('kits.disponibilidade')}
+    
+    def post(self, kit_id: int, tipo: str, quantidade: int, valor_unitario: float,
+             observacao: str, local_id: int, costing: bool = True,
+             transferencia_id: int = None) -> List[tuple]:
+        """Lança a movimentação do kit nos componentes (chamar dentro de uma transação)
+        
+        Na SAIDA, o valor do kit é rateado pelo preço de venda dos componentes;
+        na ENTRADA (devolução), cada componente entra pelo seu preço de compra.
+        """
+        components = self.components(kit_id)
+        placeholders = ','.join('?' * len(components))
+        prices = {
+            row[0]: (row[1] or 0.0, row[2] or 0.0) for row in self.db.execute_query(
+                f'SELECT id, preco_compra, preco_venda FROM produtos WHERE id IN ({placeholders})',
+                tuple(components)
+            )
+        }
+        venda_total = sum(prices.get(cid, (0.0, 0.0))[1] * qtd for cid, qtd in components.items())
+        unidades = sum(components.values())
+        
+        observacao = f"Kit #{kit_id} x{quantidade}" + (f" - {observacao}" if observacao else '')
+        consumed = []
+        for componente_id, qtd in components.items():
+            preco_compra, preco_venda = prices.get(componente_id, (0.0, 0.0))
+            if tipo == 'ENTRADA':
+                unitario = preco_compra
+            elif venda_total:
+                unitario = valor_unitario * preco_venda / venda_total
+            else:
+                unitario = valor_unitario / unidades
+            consumed += self.controller._post_movement(
+                componente_id, tipo, qtd * quantidade, unitario, observacao, local_id,
+                costing=costing, transferencia_id=transferencia_id
+            )
+        return consumed
+
+class ReplicationIdentity(PerDatabase):
+    """Identidade do nó e uids dos produtos em memória (uma por banco)
+    
+    Compartilhada pelos controladores: trocar o nó (restauração) vale para
+    todos. Um rollback descarta o que foi lido ou gerado na transação.
+    """
+    
+    def __init__(self, db: 'DatabaseManager'):
+        if self._initialized:
+            return
+        self._initialized = True
+        self.db = db
+        self.node_id = None
+        self.uids = {}
+        db.on_rollback(self.reset)
+    
+    def reset(self):
+        self.node_id = None
+        self.uids = {}
+
+class ReplicationManager:
+    """Replicação entre lojas por arquivos de alterações (delta)
+    
+    Cada movimentação e cada edição de produto entra no replicacao_log com
+    (node_id, sequencia) do nó que a gerou. O pacote exportado leva só o que
+    o parceiro ainda não tem (pelo vetor de sequências que ele enviou por
+    último), em JSON compactado. Movimentações são deltas de saldo e
+    comutam, então aplicá-las em qualquer ordem converge para o mesmo saldo;
+    edições de produto seguem "última escrita vence" pela versão (época + nó).
+    
+    Os locais (local_id), categorias e fornecedores são os mesmos em todas as
+    lojas; produtos são identificados pelo uid.
+    """
+    
+    FORMAT = 1
+    PRODUCT_FIELDS = (
+        'nome', 'descricao', 'categoria_id', 'fornecedor_id', 'preco_compra', 'preco_venda',
+        'estoque_minimo', 'estoque_maximo', 'unidade_medida', 'sku', 'ean', 'ativo'
+    )
+    
+    def __init__(self, controller: 'ProductController', output_dir: str):
+        self.controller = controller
+        self.db = controller.db
+        self.output_dir = output_dir
+        self.identity = ReplicationIdentity(self.db)
+    
+    @property
+    def node_id(self) -> str:
+        node_id = self.identity.node_id
+        if node_id is None:
+            self.db.command_named('replicacao.criar_no', (uuid.uuid4().hex,))
+            node_id = self.identity.node_id = self.db.query_named('replicacao.no')[0][0]
+        return node_id
+    
+    def rotate_node(self) -> str:
+        """Gera uma nova identidade para o nó
+        
+        Usar em uma cópia do banco que vai operar como outra loja e após
+        restaurar um backup (as sequências antigas já podem ter sido enviadas).
+        """
+        self.identity.reset()  # o banco pode ter sido trocado por um backup
+        previous = self.node_id
+        with self.db.transaction():
+            # O log da identidade anterior passa a ser de um nó "remoto" já recebido
+            last = self.db.query_named('replicacao.sequencia', (previous,))[0][0]
+            if last:
+                self.db.command_named('replicacao.avancar', (previous, last))
+            self.db.command_named('replicacao.trocar_no', (uuid.uuid4().hex,))
+        self.identity.reset()
+        return self.node_id
+    
+    def product_uid(self, product_id: int) -> str:
+        uids = self.identity.uids
+        uid = uids.get(product_id)
+        if uid is None:
+            rows = self.db.query_named('replicacao.uid', (product_id,))
+            uid = rows[0][0] if rows else None
+            if uid is None:
+                uid = uuid.uuid4().hex
+                self.db.command_named('replicacao.definir_uid', (uid, product_id))
+            uids[product_id] = uid
+        return uid
+    
+    def _append(self, tipo: str, dados: Any):
+        node_id = self.node_id
+        self.db.command_named(
+            'replicacao.registrar',
+            (node_id, tipo, json.dumps(dados, separators=(',', ':')), int(time.time()), node_id)
+        )
+    
+    def record_movement(self, product_id: int, tipo: str, quantidade: int, valor_unitario: float,
+                        observacao: str, local_id: int, data_movimentacao: str, data_epoch: int,
+                        lotes: List[tuple], costing: bool, transferencia_id: int = None):
+        """Registra uma movimentação local no log (chamar dentro da transação)"""
+        self._append('MOVIMENTACAO', [
+            self.product_uid(product_id), tipo, quantidade, valor_unitario, observacao,
+            local_id, data_movimentacao, data_epoch, [list(lote) for lote in lotes or []], costing,
+            transferencia_id
+        ])
+    
+    def record_product(self, product_id: int, ativo: bool = None):
+        """Registra o estado atual do produto no log (cadastro, edição ou exclusão)"""
+        rows = self.db.query_named('replicacao.produto', (product_id,))
+        if not rows:
+            return
+        dados = dict(zip(self.PRODUCT_FIELDS, rows[0]))
+        if ativo is not None:
+            dados['ativo'] = int(ativo)
+        dados['uid'] = self.product_uid(product_id)
+        dados['versao'] = f"{int(time.time()):012d}.{self.node_id}"
+        self.db.command_named('replicacao.versao_produto', (dados['versao'], product_id))
+        self._append('PRODUTO', dados)
+    
+    def get_vector(self) -> Dict[str, int]:
+        """Maior sequência conhecida de cada nó (incluindo o próprio)"""
+        vector = {node_id: sequencia for node_id, sequencia in self.db.query_named('replicacao.vetor')}
+        own = self.db.query_named('replicacao.sequencia', (self.node_id,))[0][0]
+        if own:
+            vector[self.node_id] = own
+        return vector
+    
+    def get_peers(self) -> List[sqlite3.Row]:
+        """Lojas das quais já foi importado algum pacote"""
+        return self.db.query_named('replicacao.pares')
+    
+    def get_peer_vector(self, peer_id: str) -> Dict[str, int]:
+        rows = self.db.query_named('replicacao.par', (peer_id,))
+        return json.loads(rows[0][0]) if rows else {}
+    
+    def export_bundle(self, path: str = None, peer_id: str = None, since: Dict[str, int] = None) -> Dict[str, Any]:
+        """Grava o pacote de alterações que o parceiro ainda não tem
+        
+        since: vetor de sequências do destino; sem ele, usa o último vetor
+        recebido de peer_id (sem nenhum dos dois, exporta o log inteiro).
+        """
+        if since is None:
+            since = self.get_peer_vector(peer_id) if peer_id else {}
+        vector = self.get_vector()
+        
+        changes = []
+        for node_id, sequencia in sorted(vector.items()):
+            if sequencia <= since.get(node_id, 0):
+                continue
+            for seq, tipo, dados, created_epoch in self.db.query_named(
+                'replicacao.alteracoes', (node_id, since.get(node_id, 0))
+            ):
+                changes.append([node_id, seq, tipo, json.loads(dados), created_epoch])
+        
+        if path is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(
+                self.output_dir, f"delta_{self.node_id[:8]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json.gz"
+            )
+        bundle = {
+            'formato': self.FORMAT, 'origem': self.node_id, 'vetor': vector,
+            'gerado_em': int(time.time()), 'alteracoes': changes
+        }
+        with gzip.open(path, 'wt', encoding='utf-8', compresslevel=9) as f:
+            json.dump(bundle, f, separators=(',', ':'))
+        return {'arquivo': path, 'alteracoes': len(changes), 'bytes': os.path.getsize(path)}
+    
+    def import_bundle(self, path: str) -> Dict[str, Any]:
+        """Aplica um pacote recebido em uma única transação
+        
+        Alterações já conhecidas são ignoradas; as que dependem de algo que
+        ainda não chegou (sequência faltando ou produto desconhecido) ficam
+        pendentes e entram quando o pacote que as completa for importado.
+        Códigos (SKU/EAN) que já pertencem a outro produto local não são
+        aplicados e aparecem em 'conflitos'.
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            bundle = json.load(f)
+        if bundle.get('formato') != self.FORMAT:
+            raise ValueError(f"Formato de pacote não suportado: {bundle.get('formato')}")
+        
+        result = {'aplicadas': 0, 'ignoradas': 0, 'pendentes': 0, 'conflitos': []}
+        with self.db.transaction():
+            known = self.get_vector()
+            changes = [change for change in bundle['alteracoes'] if change[0] != self.node_id]
+            
+            # Edições de produto primeiro: só dependem da versão, e as movimentações
+            # precisam dos produtos criados em outras lojas
+            failed = set()
+            for node_id, seq, tipo, dados, _ in changes:
+                if tipo == 'PRODUTO' and seq > known.get(node_id, 0):
+                    if not self._apply_product(dados, result['conflitos']):
+                        failed.add((node_id, seq))
+            
+            applied, blocked = {}, set()
+            for node_id, seq, tipo, dados, created_epoch in sorted(changes, key=lambda c: (c[0], c[1])):
+                last = applied.get(node_id, known.get(node_id, 0))
+                if seq <= last:
+                    result['ignoradas'] += 1
+                    continue
+                if (node_id in blocked or seq != last + 1 or (node_id, seq) in failed
+                        or not self._apply_movement(tipo, dados)):
+                    blocked.add(node_id)
+                    result['pendentes'] += 1
+                    continue
+                self.db.command_named(
+                    'replicacao.incluir',
+                    (node_id, seq, tipo, json.dumps(dados, separators=(',', ':')), created_epoch)
+                )
+                applied[node_id] = seq
+                result['aplicadas'] += 1
+            
+            self.db.executemany(StatementRegistry.get('replicacao.avancar'), list(applied.items()))
+            self.db.command_named('replicacao.salvar_par', (bundle['origem'], json.dumps(bundle['vetor'])))
+        
+        if result['aplicadas']:
+            self.controller.snapshot.invalidate()
+            self.controller.codes.reload()
+        return result
+    
+    def _apply_product(self, dados: Dict[str, Any], conflicts: List[str]) -> bool:
+        """Aplica uma edição de produto; False se falhar (a alteração fica pendente)
+        
+        SKU/EAN já usado por outro produto local não é aplicado: o produto
+        mantém o código atual (ou fica sem código, se for novo).
+        """
+        rows = self.db.query_named('replicacao.produto_por_uid', (dados['uid'],))
+        if rows and (rows[0]['rep_versao'] or '') >= dados['versao']:
+            return True  # já temos uma edição mais recente
+        product_id = rows[0]['id'] if rows else None
+        
+        dados = dict(dados)
+        for field in ('sku', 'ean'):
+            code = dados[field]
+            if code and self.db.query_named(f'replicacao.{field}_em_uso', (code, product_id)):
+                current = self.db.query_named('replicacao.produto', (product_id,)) if rows else None
+                dados[field] = current[0][field] if current else None
+                conflicts.append(f"{field.upper()} {code} de '{dados['nome']}' já pertence a outro produto")
+        
+        values = tuple(dados[field] for field in self.PRODUCT_FIELDS)
+        try:
+            with self.db.savepoint('produto_replicado'):
+                if rows:
+                    self.db.command_named('replicacao.aplicar_produto', values + (dados['versao'], product_id))
+                    self.db.invalidate_cache(f"produto:{product_id}")
+                elif dados['ativo']:
+                    product_id = self.db.command_named('produtos.inserir', values[:6] + (0,) + values[6:11])
+                    self.db.command_named(
+                        'replicacao.novo_produto', (dados['uid'], dados['ativo'], dados['versao'], product_id)
+                    )
+        except Exception as e:
+            print(f"❌ Erro ao aplicar produto replicado '{dados['nome']}': {e}")
+            conflicts.append(f"'{dados['nome']}' não aplicado: {e}")
+            return False
+        return True
+    
+    def _apply_movement(self, tipo: str, dados: Any) -> bool:
+        if tipo == 'PRODUTO':
+            return True  # aplicado na primeira passada
+        # Pacotes anteriores à transferencia_id têm um campo a menos
+        (uid, tipo_mov, quantidade, valor_unitario, observacao, local_id,
+         data_mov, data_epoch, lotes, costing, *extra) = dados
+        rows = self.db.query_named('replicacao.produto_por_uid', (uid,))
+        if not rows:
+            return False
+        self.controller._post_movement(
+            rows[0]['id'], tipo_mov, quantidade, valor_unitario, observacao, local_id,
+            [tuple(lote) for lote in lotes], costing, replicated=(data_mov, data_epoch),
+            transferencia_id=extra[0] if extra else None
+        )
+        return True
+
+class CodeIndex(PerDatabase):
+    """Mapa em memória código (SKU/EAN) -> produto para leituras rápidas
+    
+    Carregado uma vez da tabela e mantido em sincronia pelo controller a
+    cada cadastro, alteração ou exclusão de produto. Um por banco, então
+    todos os controladores enxergam as mesmas alterações.
+    """
+    
+    def __init__(self, db: 'DatabaseManager'):
+        if self._initialized:
+            return
+        self._initialized = True
+        self.db = db
+        self._lock = threading.Lock()
+        self._codes = None
+        self._by_product = {}
+    
+    def _load(self):
+        codes, by_product = {}, {}
+        for product_id, sku, ean in self.db.query_named('produtos.codigos'):
+            product_codes = tuple(code for code in (sku, ean) if code)
+            for code in product_codes:
+                codes[code] = product_id
+            by_product[product_id] = product_codes
+        self._codes, self._by_product = codes, by_product
+    
+    def reload(self):
+        with self._lock:
+            self._load()
+    
+    def lookup(self, code: str) -> Optional[int]:
+        """Resolve um código lido para o ID do produto"""
+        if self._codes is None:
+            self.reload()
+        return self._codes.get(code.strip())
+    
+    def update(self, product_id: int, sku: Optional[str], ean: Optional[str]):
+        with self._lock:
+            if self._codes is None:
+                return
+            self._discard(product_id)
+            product_codes = tuple(code for code in (sku, ean) if code)
+            for code in product_codes:
+                self._codes[code] = product_id
+            self._by_product[product_id] = product_codes
+    
+    def remove(self, product_id: int):
+        with self._lock:
+            if self._codes is not None:
+                self._discard(product_id)
+    
+    def _discard(self, product_id: int):
+        for code in self._by_product.pop(product_id, ()):
+            if self._codes.get(code) == product_id:
+                del self._codes[code]
+
+class ScanBuffer:
+    """Agrupa leituras de código de barras em lotes de movimentações
+    
+    Leituras do mesmo produto, tipo e local são somadas e gravadas juntas,
+    em uma única transação, quando o lote enche ou a cada flush_interval
+    segundos, em vez de uma movimentação por leitura.
+    """
+    
+    def __init__(self, controller: 'ProductController', flush_interval: float = 0.5,
+                 max_batch: int = 500, on_flush=None, max_attempts: int = 3):
+        self.controller = controller
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.on_flush = on_flush
+        self.max_attempts = max_attempts
+        self._pending = {}   # (produto, tipo, local) -> [quantidade, leituras]
+        self._attempts = {}  # chave -> gravações que já falharam
+        self._scans = 0
+        self._lock = threading.Lock()
+        self._timer = None
+    
+    def scan(self, code: str, tipo: str = 'SAIDA', quantidade: int = 1, local_id: int = None) -> Optional[int]:
+        """Registra uma leitura; retorna o ID do produto ou None se o código for desconhecido"""
+        product_id = self.controller.codes.lookup(code)
+        if product_id is None:
+            return None
+        
+        key = (product_id, tipo, local_id or DatabaseManager.DEFAULT_LOCATION_ID)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = [0, 0]
+            entry[0] += quantidade
+            entry[1] += 1
+            self._scans += 1
+            full = self._scans >= self.max_batch
+            if not full:
+                self._arm_timer()
+        
+        if full:
+            self.flush()
+        return product_id
+    
+    def _arm_timer(self):
+        # Chamar com self._lock
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def pending_count(self) -> int:
+        return self._scans
+    
+    def flush(self) -> Dict[str, Any]:
+        """Grava as leituras pendentes; saídas sem saldo no local são rejeitadas
+        
+        Cada produto/tipo/local é gravado em um savepoint próprio: o que falhar
+        volta ao buffer sem desfazer o resto, e é descartado (em 'descartadas')
+        depois de max_attempts falhas seguidas.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            scans, self._scans = self._scans, 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        
+        result = {'leituras': scans, 'movimentacoes': 0, 'rejeitadas': [], 'descartadas': []}
+        if not pending:
+            return result
+        
+        failed, posted = {}, []
+        
+        controller = self.controller
+        try:
+            product_ids = sorted({key[0] for key in pending})
+            placeholders = ','.join('?' * len(product_ids))
+            prices = {
+                row[0]: (row[1], row[2]) for row in controller.db.execute_query(
+                    f'SELECT id, preco_compra, preco_venda FROM produtos WHERE id IN ({placeholders})',
+                    tuple(product_ids)
+                )
+            }
+            
+            with controller.db.transaction():
+                for key, (quantidade, _) in pending.items():
+                    product_id, tipo, local_id = key
+                    try:
+                        with controller.db.savepoint('leitura'):
+                            if tipo == 'SAIDA' and controller.get_available_stock(product_id, local_id) < quantidade:
+                                result['rejeitadas'].append((product_id, tipo, local_id, quantidade))
+                                continue
+                            preco_compra, preco_venda = prices.get(product_id, (0.0, 0.0))
+                            valor_unitario = preco_compra if tipo == 'ENTRADA' else preco_venda
+                            controller._post_movement(
+                                product_id, tipo, quantidade, valor_unitario or 0.0, 'Leitura de código', local_id
+                            )
+                    except Exception as e:
+                        print(f"❌ Erro ao gravar leitura do produto {product_id}: {e}")
+                        result['erro'] = str(e)
+                        failed[key] = pending[key]
+                        continue
+                    posted.append(key)
+            
+        except Exception as e:
+            print(f"❌ Erro ao gravar leituras: {e}")
+            result['erro'] = str(e)
+            result['rejeitadas'] = []
+            failed, posted = pending, []
+        
+        result['movimentacoes'] = len(posted)
+        with self._lock:
+            for key in pending.keys() - failed.keys():
+                self._attempts.pop(key, None)
+        if failed:
+            result['descartadas'] = self._requeue(failed)
+        
+        if self.on_flush:
+            self.on_flush(result)
+        return result
+    
+    def _requeue(self, pending: Dict[tuple, list]) -> List[tuple]:
+        """Devolve ao buffer o que não foi gravado e rearma o timer
+        
+        Retorna as entradas descartadas por já terem falhado max_attempts vezes.
+        """
+        dropped = []
+        with self._lock:
+            for key, (quantidade, leituras) in pending.items():
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(key, None)
+                    dropped.append(key + (quantidade,))
+                    continue
+                self._attempts[key] = attempts
+                entry = self._pending.get(key)
+                if entry is None:
+                    entry = self._pending[key] = [0, 0]
+                entry[0] += quantidade
+                entry[1] += leituras
+                self._scans += leituras
+            if len(dropped) < len(pending):
+                self._arm_timer()
+        for product_id, tipo, local_id, quantidade in dropped:
+            print(f"❌ Leituras descartadas após {self.max_attempts} falhas: "
+                  f"produto {product_id}, {tipo} de {quantidade} no local {local_id}")
+        return dropped
+
+class InsufficientStockError(ValueError):
+    """Saída maior que o saldo livre de reservas do produto no local"""
+
+class ProductController:
+    """Funções de controle dos produtos (criação/edição/remoção)"""
+    
+    def __init__(self, db: DatabaseManager = None):
+        self.db = db or DatabaseManager.default()
+        self.snapshot = InventorySnapshot(self.db)
+        self.codes = CodeIndex(self.db)
+        self.archiver = MovementArchiver(self.db, os.path.join(self.db.data_dir, 'arquivo'))
+        self.archiver.ensure_unified_view()
+        self.backups = BackupManager(self.db, os.path.join(self.db.data_dir, 'backups'))
+        self.valuation = ValuationEngine(self.db)
+        self.valuation.ensure_initialized()
+        self.classifier = DemandClassifier(self.db)
+        self.maintenance = MaintenanceManager(self)
+        self.purchasing = PurchasingManager(self)
+        self.counts = CycleCountManager(self)
+        self.reservations = ReservationManager(self)
+        self.kits = KitManager(self)
+        self.replication = ReplicationManager(self, os.path.join(self.db.data_dir, 'replicacao'))
+        self.jobs = JobQueue(self.db)
+        self.register_jobs()
+    
+    def create_product(self, product_data: Dict[str, Any]) -> bool:
+        """Cadastra um novo produto
+        
+        'componentes' ({produto_id: quantidade}) cadastra o produto como kit.
+        """
+        try:
+            params = (
+            product_data['nome'],
+            product_data.get('descricao', ''),
+            product_data.get('categoria_id'),
+            product_data.get('fornecedor_id'),
+            product_data.get('preco_compra', 0.0),
+            product_data.get('preco_venda', 0.0),
+            0,  #Novos produtos sempre iniciam com qtdade 0 no estoque
+            product_data.get('estoque_minimo', 0),
+            product_data.get('estoque_maximo', 100),
+            product_data.get('unidade_medida', 'UN'),
+            product_data.get('sku') or None,
+            product_data.get('ean') or None
+        )
+            
+            with self.db.transaction():
+                product_id = self.db.command_named('produtos.inserir', params)
+                if product_data.get('componentes'):
+                    self.kits.set_components(product_id, product_data['componentes'])
+                self.replication.record_product(product_id)
+            self.snapshot.invalidate()
+            self.codes.update(product_id, product_data.get('sku'), product_data.get('ean'))
+            # Registrar movimentação de entrada inicial se houver estoque
+
+            if product_data.get('estoque_atual', 0) > 0:
+                self.register_movement(
+                    product_id, 
+                    'ENTRADA', 
+                    product_data.get('estoque_atual', 0),
+                    product_data.get('preco_compra', 0.0),
+                    'Estoque inicial do produto'
+                )
+            
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao criar produto: {e}")
+            return False
+    
+    def get_products(self, filter_active: bool = True, classe_abc: str = None,
+                     classe_xyz: str = None) -> List[ProductRecord]:
+        """Lista todos os produtos (classe_abc/classe_xyz filtram os ativos pela classificação)"""
+        try:
+            if classe_abc or classe_xyz:
+                # Faixas sobre o índice (classe_abc, classe_xyz); classe vazia = todas
+                return self.db.query_named(
+                    'produtos.por_classe',
+                    (classe_abc or 'A', classe_abc or 'C', classe_xyz or 'X', classe_xyz or 'Z'),
+                    ProductRecord
+                )
+            name = 'produtos.listar_ativos' if filter_active else 'produtos.listar_todos'
+            return self.db.query_named(name, record_type=ProductRecord)
+            
+        except Exception as e:
+            print(f"❌ Erro ao listar produtos: {e}")
+            return []
+    
+    def get_product(self, product_id: int) -> Optional[ProductRecord]:
+        """Busca um produto pelo ID (inclusive inativos)"""
+        try:
+            rows = self.db.query_named('produtos.por_id', (product_id,), ProductRecord)
+            return rows[0] if rows else None
+            
+        except Exception as e:
+            print(f"❌ Erro ao buscar produto: {e}")
+            return None
+    
+    def find_product_by_code(self, code: str) -> Optional[ProductRecord]:
+        """Busca um produto ativo pelo SKU ou EAN"""
+        product_id = self.codes.lookup(code)
+        return self.get_product(product_id) if product_id else None
+    
+    def get_low_stock_products(self, limit: int = 10) -> List[ProductRecord]:
+        """Lista os produtos ativos com estoque baixo"""
+        try:
+            return self.db.query_cached('produtos.estoque_baixo', (limit,), ProductRecord)
+            
+        except Exception as e:
+            print(f"❌ Erro ao listar produtos com estoque baixo: {e}")
+            return []
+    
+    def get_inventory_snapshot(self) -> InventorySnapshot:
+        """Retorna a fotografia compacta do estoque já atualizada"""
+        return self.snapshot.refresh()
+    
+    def update_product(self, product_id: int, product_data: Dict[str, Any]) -> bool:
+        """Atualiza um produto existente"""
+        try:
+            params = (
+                product_data['nome'],
+                product_data.get('descricao', ''),
+                product_data.get('categoria_id'),
+                product_data.get('fornecedor_id'),
+                product_data.get('preco_compra', 0.0),
+                product_data.get('preco_venda', 0.0),
+                product_data.get('estoque_minimo', 0),
+                product_data.get('estoque_maximo', 100),
+                product_data.get('unidade_medida', 'UN'),
+                product_data.get('sku') or None,
+                product_data.get('ean') or None,
+                product_id
+            )
+            
+            with self.db.transaction():
+                rows_affected = self.db.command_named('produtos.atualizar', params)
+                if 'componentes' in product_data:
+                    self.kits.set_components(product_id, product_data['componentes'])
+                self.replication.record_product(product_id)
+            self.db.invalidate_cache(f'produto:{product_id}')
+            self.snapshot.invalidate()
+            self.codes.update(product_id, product_data.get('sku'), product_data.get('ean'))
+            return rows_affected > 0
+            
+        except Exception as e:
+            print(f"❌ Erro ao atualizar produto: {e}")
+            return False
+    
+    def delete_product(self, product_id: int) -> bool:
+        """Remove um produto (soft delete)"""
+        try:
+            # Primeiro: verificar se o produto tem estoque > 0
+            product = self.db.query_named('produtos.estoque', (product_id,))
+            
+            if not product:
+                return False
+                
+            if product[0]['estoque_atual'] > 0:
+                # Produto com estoque não pode ser excluído
+                return False
+            
+            # Segundo: verificar se há movimentações
+            movements = self.db.query_named('movimentacoes.contar_por_produto', (product_id, product_id))
+            
+            if movements[0]['count'] > 0: #faz a validação de movimento do produto para exclui-lo
+                # Soft delete - apenas marca como inativo se ja houver movimentação do produto
+                command = 'produtos.desativar'
+            else:
+                # Hard delete - remove completamente se o produto nunca teve uma movimentação
+                command = 'produtos.excluir'
+            
+            with self.db.transaction():
+                self.replication.record_product(product_id, ativo=False)
+                rows_affected = self.db.command_named(command, (product_id,))
+            self.db.invalidate_cache(f'produto:{product_id}')
+            self.snapshot.invalidate()
+            self.codes.remove(product_id)
+            return rows_affected > 0
+            
+        except Exception as e:
+            print(f"❌ Erro ao deletar produto: {e}")
+            return False
+    
+    def register_movement(self, product_id: int, tipo: str, quantidade: int, 
+                         valor_unitario: float = 0.0, observacao: str = '',
+                         local_id: int = None, lote: str = None, validade: str = None) -> bool:
+        """Registra uma movimentação de estoque
+        
+        Em ENTRADA, lote/validade (AAAA-MM-DD) criam ou reforçam o lote.
+        Em SAIDA, os lotes do local são consumidos por FEFO.
+        """
+        try:
+            lotes = [(lote, validade, quantidade)] if tipo == 'ENTRADA' and lote else None
+            with self.db.transaction():
+                self._post_movement(product_id, tipo, quantidade, valor_unitario, observacao, local_id, lotes)
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao registrar movimentação: {e}")
+            return False
+    
+    def _post_movement(self, product_id: int, tipo: str, quantidade: int,
+                       valor_unitario: float, observacao: str, local_id: int = None,
+                       lotes: List[tuple] = None, costing: bool = True,
+                       replicated: tuple = None, check_available: bool = True,
+                       transferencia_id: int = None) -> List[tuple]:
+        """Grava a movimentação e atualiza os saldos (chamar dentro de uma transação)
+        
+        lotes: (numero_lote, validade, quantidade) recebidos em uma ENTRADA.
+        costing: False para movimentos internos (transferências), que não mudam o custo.
+        replicated: (data, época) de uma movimentação vinda de outra loja, que
+        mantém a data original e não volta para o log de replicação.
+        check_available: False quando o saldo físico manda (ajuste de contagem);
+        senão uma SAIDA acima do disponível (saldo - reservado) levanta
+        InsufficientStockError e a transação é desfeita.
+        transferencia_id: transferência que originou o movimento (fora de demanda e custo).
+        Retorna os lotes consumidos em uma SAIDA, no mesmo formato.
+        """
+        local_id = local_id or DatabaseManager.DEFAULT_LOCATION_ID
+        if tipo == 'SAIDA' and check_available and replicated is None:
+            disponivel = self.get_available_stock(product_id, local_id)
+            if disponivel < quantidade:
+                raise InsufficientStockError(
+                    f"Estoque insuficiente do produto {product_id} no local {local_id} (disponível: {disponivel})"
+                )
+        if replicated is None and self.kits.is_kit(product_id):
+            return self.kits.post(
+                product_id, tipo, quantidade, valor_unitario, observacao, local_id, costing, transferencia_id
+            )
+        valor_total = quantidade * valor_unitario
+        
+        # Inserir movimentação
+        data_movimentacao, data_epoch = replicated or now_epoch()
+        params = (
+            product_id, tipo, quantidade, valor_unitario, valor_total, observacao, local_id,
+            data_movimentacao, data_epoch, transferencia_id
+        )
+        movement_id = self.db.command_named('movimentacoes.inserir', params)
+        self.db.invalidate_cache(f'produto:{product_id}')
+        if replicated is None:
+            self.replication.record_movement(
+                product_id, tipo, quantidade, valor_unitario, observacao, local_id,
+                data_movimentacao, data_epoch, lotes, costing, transferencia_id
+            )
+        
+        # Atualizar estoque do produto e do local
+        if tipo == 'ENTRADA':
+            update_command = 'produtos.entrada'
+            delta = quantidade
+        else:  # SAIDA
+            update_command = 'produtos.saida'
+            delta = -quantidade
+        
+        self.db.command_named(update_command, (quantidade, product_id))
+        self.db.command_named('estoque_local.movimentar', (product_id, local_id, delta))
+        
+        if costing:
+            if tipo == 'ENTRADA':
+                self.valuation.apply_entry(product_id, movement_id, quantidade, valor_unitario)
+            else:
+                self.valuation.apply_exit(product_id, quantidade)
+        
+        if tipo == 'ENTRADA':
+            for numero_lote, validade, qtd_lote in lotes or []:
+                self._credit_lot(movement_id, product_id, local_id, numero_lote, validade, qtd_lote)
+            return []
+        return self._consume_lots(movement_id, product_id, local_id, quantidade)
+    
+    def _credit_lot(self, movement_id: int, product_id: int, local_id: int,
+                    numero_lote: str, validade: Optional[str], quantidade: int):
+        self.db.command_named(
+            'lotes.creditar',
+            (product_id, local_id, numero_lote, validade, quantidade, quantidade)
+        )
+        lote_id = self.db.query_named('lotes.por_chave', (product_id, local_id, numero_lote))[0]['id']
+        self.db.command_named('movimentacoes_lotes.inserir', (movement_id, lote_id, quantidade))
+    
+    def _consume_lots(self, movement_id: int, product_id: int, local_id: int, quantidade: int) -> List[tuple]:
+        # Saldo sem lote (anterior ao controle de lotes) não gera consumo
+        consumed = []
+        for lot, qtd_lote in self.pick_lots(product_id, quantidade, local_id):
+            self.db.command_named('lotes.baixar', (qtd_lote, lot['id']))
+            self.db.command_named('movimentacoes_lotes.inserir', (movement_id, lot['id'], qtd_lote))
+            consumed.append((lot['numero_lote'], lot['data_validade'], qtd_lote))
+        return consumed
+    
+    def pick_lots(self, product_id: int, quantidade: int, local_id: int = None) -> List[tuple]:
+        """Lotes a separar para atender a quantidade (FEFO: vence primeiro, sai primeiro)
+        
+        Retorna pares (lote, quantidade); a soma pode ser menor que a
+        quantidade pedida se parte do saldo não tiver lote.
+        """
+        local_id = local_id or DatabaseManager.DEFAULT_LOCATION_ID
+        picks = []
+        restante = quantidade
+        for lot in self.db.query_named('lotes.fefo', (product_id, local_id)):
+            if restante <= 0:
+                break
+            qtd_lote = min(restante, lot['saldo'])
+            picks.append((lot, qtd_lote))
+            restante -= qtd_lote
+        return picks
+    
+    def get_expiring_lots(self, days: int = 30, limit: int = 100) -> List[sqlite3.Row]:
+        """Lotes com saldo que vencem nos próximos dias (inclui vencidos)"""
+        limite = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
+        return self.db.query_named('lotes.vencendo', (limite, limit))
+    
+    def get_product_lots(self, product_id: int) -> List[sqlite3.Row]:
+        """Lotes com saldo de um produto, em ordem FEFO"""
+        return self.db.query_named('lotes.por_produto', (product_id,))
+    
+    def get_valuation_totals(self) -> Dict[str, float]:
+        """Valor do estoque a custo médio, a custo FIFO e a preço de venda"""
+        try:
+            return dict(self.valuation.get_totals())
+            
+        except Exception as e:
+            print(f"❌ Erro ao calcular valorização: {e}")
+            return {'valor_custo_medio': 0.0, 'valor_fifo': 0.0, 'valor_venda': 0.0}
+    
+    def get_locations(self) -> List[sqlite3.Row]:
+        """Lista os locais de estoque ativos"""
+        return self.db.query_named('locais.listar')
+    
+    def create_location(self, nome: str, descricao: str = '') -> Optional[int]:
+        """Cadastra um novo local de estoque"""
+        try:
+            return self.db.command_named('locais.inserir', (nome, descricao))
+            
+        except Exception as e:
+            print(f"❌ Erro ao criar local: {e}")
+            return None
+    
+    def get_location_balance(self, product_id: int, local_id: int) -> int:
+        """Saldo de um produto em um local"""
+        rows = self.db.query_named('estoque_local.saldo', (product_id, local_id))
+        return rows[0]['quantidade'] if rows else 0
+    
+    def get_available_stock(self, product_id: int, local_id: int = None) -> int:
+        """Saldo livre de reservas de um produto (em um local ou no total)
+        
+        Para kits, quantos podem ser montados com os componentes.
+        """
+        if self.kits.is_kit(product_id):
+            return self.kits.available(product_id, local_id)
+        return self.reservations.available(product_id, local_id)
+    
+    def get_stock_by_location(self, product_id: int) -> List[sqlite3.Row]:
+        """Saldo de um produto em cada local"""
+        return self.db.query_named('estoque_local.por_produto', (product_id,))
+    
+    def get_location_stock(self, local_id: int) -> List[sqlite3.Row]:
+        """Produtos com saldo em um local"""
+        return self.db.query_named('estoque_local.por_local', (local_id,))
+    
+    def get_location_totals(self) -> Dict[str, Any]:
+        """Totais por local e total geral (soma de todos os locais)"""
+        return {
+            'locais': self.db.query_cached('estoque_local.totais'),
+            'geral': self.db.query_cached('estoque_local.total_geral')[0]
+        }
+    
+    def transfer_stock(self, product_id: int, origem_id: int, destino_id: int,
+                       quantidade: int, observacao: str = '') -> bool:
+        """Transfere estoque entre locais (saída na origem e entrada no destino)"""
+        if origem_id == destino_id or quantidade <= 0:
+            return False
+        
+        try:
+            with self.db.transaction():
+                if self.get_available_stock(product_id, origem_id) < quantidade:
+                    return False
+                
+                transfer_id = self.db.command_named(
+                    'transferencias.inserir',
+                    (product_id, origem_id, destino_id, quantidade, observacao)
+                )
+                nota = f"Transferência #{transfer_id}" + (f" - {observacao}" if observacao else '')
+                lotes = self._post_movement(
+                    product_id, 'SAIDA', quantidade, 0.0, nota, origem_id, costing=False,
+                    check_available=False, transferencia_id=transfer_id
+                )
+                self._post_movement(
+                    product_id, 'ENTRADA', quantidade, 0.0, nota, destino_id, lotes, costing=False,
+                    transferencia_id=transfer_id
+                )
+            return True
+            
         except Exception as e:
-            print(f"❌ Erro ao listar produtos: {e}")
+            print(f"❌ Erro ao transferir estoque: {e}")
+            return False
+    
+    def get_movement_history(self, start, end, product_id: int = None) -> List[MovementRecord]:
+        """Lista movimentações de um período, incluindo as já arquivadas
+        
+        start/end em 'AAAA-MM-DD', datetime ou época (intervalo semiaberto [start, end)).
+        """
+        try:
+            start, end = to_epoch(start), to_epoch(end)
+            if product_id:
+                return self.db.query_named('historico.por_produto', (product_id, start, end), MovementRecord)
+            return self.db.query_named('historico.periodo', (start, end), MovementRecord)
+            
+        except Exception as e:
+            print(f"❌ Erro ao consultar histórico: {e}")
             return []
     
-    def update_product(self, product_id: int, product_data: Dict[str, Any]) -> bool:
-        """Atualiza um produto existente"""
+    def get_movements_between(self, start, end, product_id: int = None, limit: int = 1000) -> List[MovementRecord]:
+        """Movimentações da tabela ativa em [start, end), mais recentes primeiro (usa o índice de época)"""
         try:
-            command = '''
-                UPDATE produtos SET
-                    nome = ?, descricao = ?, categoria_id = ?, fornecedor_id = ?,
-                    preco_compra = ?, preco_venda = ?, estoque_minimo = ?,
-                    estoque_maximo = ?, unidade_medida = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            '''
+            start, end = to_epoch(start), to_epoch(end)
+            if product_id:
+                return self.db.query_named(
+                    'movimentacoes.intervalo_produto', (product_id, start, end, limit), MovementRecord
+                )
+            return self.db.query_named('movimentacoes.intervalo', (start, end, limit), MovementRecord)
             
-            params = (
-                product_data['nome'],
-                product_data.get('descricao', ''),
-                product_data.get('categoria_id'),
-                product_data.get('fornecedor_id'),
-                product_data.get('preco_compra', 0.0),
-                product_data.get('preco_venda', 0.0),
-                product_data.get('estoque_minimo', 0),
-                product_data.get('estoque_maximo', 100),
-                product_data.get('unidade_medida', 'UN'),
-                product_id
-            )
+        except Exception as e:
+            print(f"❌ Erro ao consultar movimentações: {e}")
+            return []
+    
+    def get_movement_totals(self, start, end) -> Dict[str, Any]:
+        """Entradas e saídas (quantidade e valor) da tabela ativa em [start, end)"""
+        return dict(self.db.query_cached('movimentacoes.totais_intervalo', (to_epoch(start), to_epoch(end)))[0])
+    
+    def get_movement_summary(self, product_id: int) -> List[sqlite3.Row]:
+        """Resumo por período das movimentações arquivadas de um produto"""
+        return self.db.query_cached('historico.resumo_por_produto', (product_id,))
+    
+    def archive_movements(self) -> Dict[int, int]:
+        """Arquiva as movimentações dos anos fechados"""
+        try:
+            return self.archiver.archive_closed_periods()
             
-            rows_affected = self.db.execute_command(command, params)
-            return rows_affected > 0
+        except Exception as e:
+            print(f"❌ Erro ao arquivar movimentações: {e}")
+            return {}
+    
+    def create_backup(self) -> Optional[str]:
+        """Cria um backup online do banco"""
+        try:
+            return self.backups.create_backup()
             
         except Exception as e:
-            print(f"❌ Erro ao atualizar produto: {e}")
+            print(f"❌ Erro ao criar backup: {e}")
+            return None
+    
+    def restore_backup(self, path: str) -> bool:
+        """Restaura um backup e descarta os dados em memória"""
+        try:
+            self.backups.restore_backup(path)
+            # Os arquivos anuais não entram no backup: um backup anterior ao arquivamento
+            # traz de volta à tabela ativa movimentações que já estão nos arquivos
+            for year in self.archiver.archived_years():
+                self.archiver.archive_year(year)
+            self.db.cache.clear()
+            self.snapshot.invalidate()
+            self.codes.reload()
+            self.kits.reload()
+            self.replication.rotate_node()  # sequências do backup já podem ter sido enviadas
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao restaurar backup: {e}")
             return False
     
-    def delete_product(self, product_id: int) -> bool:
-        """Remove um produto (soft delete)"""
+    def generate_purchase_orders(self) -> List[int]:
+        """Gera os pedidos de compra da reposição automática"""
         try:
-            # Primeiro: verificar se o produto tem estoque > 0
-            product = self.db.execute_query(
-                'SELECT estoque_atual FROM produtos WHERE id = ?',
-                (product_id,)
-            )
+            return self.purchasing.generate_orders()
             
-            if not product:
-                return False
-                
-            if product[0]['estoque_atual'] > 0:
-                # Produto com estoque não pode ser excluído
-                return False
+        except Exception as e:
+            print(f"❌ Erro ao gerar pedidos de compra: {e}")
+            return []
+    
+    def receive_purchase_order(self, order_id: int, local_id: int = None) -> bool:
+        """Recebe um pedido de compra lançando as entradas"""
+        try:
+            self.purchasing.receive_order(order_id, local_id)
+            return True
             
-            # Segundo: verificar se há movimentações
-            movements = self.db.execute_query(
-                'SELECT COUNT(*) as count FROM movimentacoes WHERE produto_id = ?',
-                (product_id,)
-            )
+        except Exception as e:
+            print(f"❌ Erro ao receber pedido de compra: {e}")
+            return False
+    
+    def start_count(self, local_id: int = None, observacao: str = '') -> Optional[int]:
+        """Abre uma contagem física congelando os saldos do local"""
+        try:
+            return self.counts.start(local_id, observacao)
             
-            if movements[0]['count'] > 0: #faz a validação de movimento do produto para exclui-lo
-                # Soft delete - apenas marca como inativo se ja houver movimentação do produto
-                command = 'UPDATE produtos SET ativo = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?'
-            else:
-                # Hard delete - remove completamente se o produto nunca teve uma movimentação
-                command = 'DELETE FROM produtos WHERE id = ?'
+        except Exception as e:
+            print(f"❌ Erro ao iniciar contagem: {e}")
+            return None
+    
+    def post_count_adjustments(self, count_id: int, product_ids: List[int] = None,
+                               zero_uncounted: bool = False) -> Optional[int]:
+        """Aprova a contagem lançando os ajustes; retorna a quantidade de ajustes"""
+        try:
+            return self.counts.post_adjustments(count_id, product_ids, zero_uncounted)
             
-            rows_affected = self.db.execute_command(command, (product_id,))
-            return rows_affected > 0
+        except Exception as e:
+            print(f"❌ Erro ao lançar ajustes da contagem: {e}")
+            return None
+    
+    def reserve_stock(self, product_id: int, quantidade: int, local_id: int = None,
+                      ttl_seconds: int = None, referencia: str = '') -> Optional[int]:
+        """Reserva unidades para um pedido pendente; retorna o ID da reserva"""
+        try:
+            return self.reservations.reserve(product_id, quantidade, local_id, ttl_seconds, referencia)
             
         except Exception as e:
-            print(f"❌ Erro ao deletar produto: {e}")
+            print(f"❌ Erro ao reservar estoque: {e}")
+            return None
+    
+    def release_reservation(self, reservation_id: int) -> bool:
+        """Libera uma reserva ativa"""
+        try:
+            return self.reservations.release(reservation_id)
+            
+        except Exception as e:
+            print(f"❌ Erro ao liberar reserva: {e}")
             return False
     
-    def register_movement(self, product_id: int, tipo: str, quantidade: int, 
-                         valor_unitario: float = 0.0, observacao: str = '') -> bool:
-        """Registra uma movimentação de estoque"""
+    def commit_reservation(self, reservation_id: int) -> bool:
+        """Confirma uma reserva ativa lançando a saída"""
+        try:
+            return self.reservations.commit(reservation_id)
+            
+        except Exception as e:
+            print(f"❌ Erro ao confirmar reserva: {e}")
+            return False
+    
+    def export_replication_delta(self, peer_id: str = None, path: str = None) -> Optional[Dict[str, Any]]:
+        """Exporta o pacote de alterações para outra loja"""
+        try:
+            return self.replication.export_bundle(path, peer_id)
+            
+        except Exception as e:
+            print(f"❌ Erro ao exportar alterações: {e}")
+            return None
+    
+    def import_replication_delta(self, path: str) -> Optional[Dict[str, Any]]:
+        """Importa um pacote de alterações de outra loja"""
         try:
-            valor_total = quantidade * valor_unitario
+            return self.replication.import_bundle(path)
             
-            # Inserir movimentação
-            command = '''
-                INSERT INTO movimentacoes (
-                    produto_id, tipo, quantidade, valor_unitario, 
-                    valor_total, observacao
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            '''
+        except Exception as e:
+            print(f"❌ Erro ao importar alterações: {e}")
+            return None
+    
+    def classify_products(self, full: bool = False) -> Optional[Dict[str, int]]:
+        """Recalcula a classificação ABC/XYZ dos produtos ativos"""
+        try:
+            return self.classifier.refresh(full)
             
-            params = (product_id, tipo, quantidade, valor_unitario, valor_total, observacao)
-            self.db.execute_command(command, params)
+        except Exception as e:
+            print(f"❌ Erro ao classificar produtos: {e}")
+            return None
+    
+    def get_classification_summary(self) -> Dict[str, int]:
+        """Quantidade de produtos por classe ABC/XYZ"""
+        try:
+            return self.classifier.get_summary()
             
-            # Atualizar estoque do produto
-            if tipo == 'ENTRADA':
-                update_command = '''
-                    UPDATE produtos SET 
-                        estoque_atual = estoque_atual + ?,
-                        updated_at = CURRENT_TIMESTAMP 
-                    WHERE id = ?
-                '''
-            else:  # SAIDA
-                update_command = '''
-                    UPDATE produtos SET 
-                        estoque_atual = estoque_atual - ?,
-                        updated_at = CURRENT_TIMESTAMP 
-                    WHERE id = ?
-                '''
-            
-            self.db.execute_command(update_command, (quantidade, product_id))
-            return True
+        except Exception as e:
+            print(f"❌ Erro ao consultar classificação: {e}")
+            return {}
+    
+    def run_maintenance(self, days: int = None) -> Optional[Dict[str, Any]]:
+        """Arquiva produtos inativos antigos, compacta o banco e atualiza as estatísticas"""
+        try:
+            return self.maintenance.run(days)
             
         except Exception as e:
-            print(f"❌ Erro ao registrar movimentação: {e}")
-            return False
+            print(f"❌ Erro na manutenção do banco: {e}")
+            return None
+    
+    def register_jobs(self):
+        """Registra os tipos de tarefa executados em segundo plano
+        
+        A fila é única por banco: só o primeiro controlador registra, e os
+        demais (outras sessões, teste de carga) usam os mesmos handlers.
+        """
+        if not self.jobs.claim(self):
+            return
+        self.jobs.register(
+            'exportar_produtos',
+            lambda ctx: self.export_products()
+        )
+        # Exportação e relatório em vários processos dependem do arquivo do banco
+        if self.db.backend.supports_files:
+            self.jobs.register(
+                'exportar_movimentacoes',
+                lambda ctx: self.get_job_runner().export_movements(progress=ctx.progress)
+            )
+            self.jobs.register(
+                'relatorio_periodos',
+                lambda ctx: self.get_job_runner().generate_period_report(progress=ctx.progress)
+            )
+        self.jobs.register('backup', lambda ctx: self.backups.create_backup())
+        self.jobs.register('arquivar_movimentacoes', lambda ctx: self.archiver.archive_closed_periods())
+        self.jobs.register('reconciliacao', lambda ctx: self.reconcile_stock(ctx.progress))
+        self.jobs.register('expirar_reservas', lambda ctx: self.reservations.expire_stale())
+        self.jobs.register('classificar_produtos', lambda ctx: self.classifier.refresh())
+        self.jobs.register('manutencao', lambda ctx: self.maintenance.run())
+    
+    def export_products(self, filename: str = None) -> str:
+        """Exporta os produtos ativos para JSON e retorna o caminho do arquivo"""
+        products_data = []
+        for row in self.db.iterate_named('produtos.listar_ativos'):
+            product = ProductRecord._make(row)
+            products_data.append({
+                'id': product.id,
+                'nome': product.nome,
+                'descricao': product.descricao,
+                'categoria': product.categoria_nome,
+                'fornecedor': product.fornecedor_nome,
+                'preco_compra': product.preco_compra,
+                'preco_venda': product.preco_venda,
+                'estoque_atual': product.estoque_atual,
+                'estoque_minimo': product.estoque_minimo,
+                'estoque_maximo': product.estoque_maximo,
+                'unidade_medida': product.unidade_medida,
+                'status_estoque': product.status_estoque,
+                'classe_abc': product.classe_abc,
+                'classe_xyz': product.classe_xyz
+            })
+        
+        if filename is None:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = os.path.join(self.db.data_dir, f'produtos_export_{timestamp}.json')
+        
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(products_data, f, ensure_ascii=False, indent=2)
+        return filename
+    
+    def reconcile_stock(self, progress=None) -> str:
+        """Compara o estoque de cada produto com a soma dos saldos por local"""
+        divergences = self.db.execute_query('''
+            SELECT p.id, p.nome, p.estoque_atual, COALESCE(SUM(el.quantidade), 0) as soma_locais
+            FROM produtos p
+            LEFT JOIN estoque_local el ON el.produto_id = p.id
+            GROUP BY p.id
+            HAVING p.estoque_atual <> soma_locais
+        ''')
+        if progress:
+            progress(100.0, f"{len(divergences)} divergências")
+        
+        for row in divergences:
+            print(f"⚠️ Divergência no produto {row['id']} ({row['nome']}): "
+                  f"estoque {row['estoque_atual']} x locais {row['soma_locais']}")
+        return f"{len(divergences)} divergências encontradas"
+    
+    def get_job_runner(self) -> ShardedJobRunner:
+        """Executor de exportações/relatórios em vários processos"""
+        archive_paths = [self.archiver.archive_path(year) for year in self.archiver.archived_years()]
+        return ShardedJobRunner(self.db.backend.file_path, archive_paths, output_dir=self.db.data_dir)
     
     def get_categories(self) -> List[sqlite3.Row]:
         """Lista todas as categorias"""
-        return self.db.execute_query('SELECT * FROM categorias ORDER BY nome')
+        return self.db.query_cached('categorias.listar')
     
     def get_suppliers(self) -> List[sqlite3.Row]:
         """Lista todos os fornecedores"""
-        return self.db.execute_query('SELECT * FROM fornecedores ORDER BY nome')
+        return self.db.query_cached('fornecedores.listar')
     
-    def get_movements(self, product_id: int = None) -> List[sqlite3.Row]:
+    def get_movements(self, product_id: int = None) -> List[MovementRecord]:
         """Lista movimentações de estoque"""
         if product_id:
-            query = '''
-                SELECT m.*, p.nome as produto_nome
-                FROM movimentacoes m
-                JOIN produtos p ON m.produto_id = p.id
-                WHERE m.produto_id = ?
-                ORDER BY m.data_movimentacao DESC
-            '''
-            return self.db.execute_query(query, (product_id,))
+            return self.db.query_cached(
+                'movimentacoes.por_produto', (product_id,), MovementRecord, tags=(f'produto:{product_id}',)
+            )
+        else:
+            return self.db.query_cached('movimentacoes.recentes', record_type=MovementRecord)
+
+class ReadConnectionPool:
+    """Pool de conexões somente leitura para consultas concorrentes
+    
+    Cada requisição usa uma conexão própria, então leituras em paralelo não
+    disputam a conexão principal, que continua sendo a única que escreve.
+    """
+    
+    def __init__(self, db_path: str, size: int = 8):
+        self.db_path = db_path
+        self._pool = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._pool.put(None)  # conexões abertas sob demanda
+    
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            Path(self.db_path).resolve().as_uri() + '?mode=ro',
+            uri=True,
+            check_same_thread=False,
+            cached_statements=128,
+            timeout=10
+        )
+        connection.row_factory = sqlite3.Row
+        return connection
+    
+    @contextmanager
+    def connection(self):
+        connection = self._pool.get()
+        try:
+            if connection is None:
+                connection = self._open()
+            yield connection
+        except sqlite3.DatabaseError:
+            # Conexão com erro é descartada; a próxima requisição abre outra
+            if connection is not None:
+                connection.close()
+            connection = None
+            raise
+        finally:
+            self._pool.put(connection)
+    
+    def query_named(self, name: str, params: tuple = (), record_type=None) -> List[Any]:
+        """Executa uma query registrada no StatementRegistry em uma conexão do pool"""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            if record_type is not None:
+                cursor.row_factory = None
+                cursor.execute(StatementRegistry.get(name), params)
+                return list(map(record_type._make, cursor.fetchall()))
+            cursor.execute(StatementRegistry.get(name), params)
+            return cursor.fetchall()
+    
+    def close(self):
+        while True:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if connection is not None:
+                connection.close()
+
+class ApiError(Exception):
+    """Erro de requisição da API, com o status HTTP da resposta"""
+    
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """Handler HTTP/1.1 (keep-alive) que repassa as requisições ao ApiServer"""
+    
+    protocol_version = 'HTTP/1.1'
+    server_version = 'StockControlAPI/1.0'
+    disable_nagle_algorithm = True  # cabeçalho e corpo saem em escritas separadas
+    
+    def do_GET(self):
+        self._dispatch('GET')
+    
+    def do_POST(self):
+        self._dispatch('POST')
+    
+    def log_message(self, format, *args):
+        pass  # sem log por requisição
+    
+    def _read_json(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            raise ApiError(400, 'JSON inválido')
+    
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        
+        try:
+            payload = self._read_json() if method == 'POST' else None
+            status, result = self.server.api.handle(method, parts, query, payload)
+        except ApiError as e:
+            status, result = e.status, {'erro': str(e)}
+        except Exception as e:
+            print(f"❌ Erro na API ({method} {url.path}): {e}")
+            status, result = 500, {'erro': 'Erro interno'}
+        
+        body = json.dumps(result, ensure_ascii=False, default=str).encode('utf-8')
+        etag = None
+        if method == 'GET' and status == 200:
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+        
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+class ApiServer:
+    """API HTTP/JSON local para integrações (ERP, e-commerce)
+    
+    GET  /api/produtos?apos=&limite=&categoria_id=   listagem paginada por cursor (id)
+    GET  /api/produtos/<id>                          produto com saldo por local (e componentes, se kit)
+    GET  /api/codigos/<sku ou ean>                   busca por código
+    GET  /api/movimentacoes?apos=&limite=&produto_id=
+    POST /api/movimentacoes                          lote de movimentações (uma transação)
+    GET  /api/estoque                                totais geral, por local e por categoria
+    GET  /api/reservas?produto_id=                   reservas ativas
+    POST /api/reservas                               reserva para pedido pendente (expira)
+    POST /api/reservas/<id>/confirmar|liberar        baixa ou devolve as unidades reservadas
+    
+    Leituras usam o ReadConnectionPool; escritas passam pelo controller
+    (lock de escrita e transação do DatabaseManager). Respostas GET levam
+    ETag e respondem 304 a If-None-Match.
+    """
+    
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    MAX_BATCH = 5000
+    
+    def __init__(self, controller: 'ProductController', host: str = '127.0.0.1',
+                 port: int = 8765, pool_size: int = 8):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        # Fora do SQLite, o próprio backend já lê por um pool de conexões
+        if controller.db.backend.supports_files:
+            self.pool = ReadConnectionPool(controller.db.backend.file_path, pool_size)
+        else:
+            self.pool = controller.db
+        self._server = None
+        self._thread = None
+    
+    def start(self):
+        """Sobe o servidor em uma thread (uma thread por conexão)"""
+        if self._server:
+            return
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), ApiRequestHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='api-server', daemon=True)
+        self._thread.start()
+        print(f"✅ API disponível em http://{self.host}:{self.port}/api")
+    
+    def stop(self):
+        if not self._server:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        if isinstance(self.pool, ReadConnectionPool):
+            self.pool.close()
+    
+    def handle(self, method: str, parts: List[str], query: Dict[str, str], payload: Any) -> tuple:
+        """Roteia a requisição e retorna (status, corpo)"""
+        if not parts or parts[0] != 'api':
+            raise ApiError(404, 'Rota não encontrada')
+        route = parts[1:]
+        
+        if method == 'GET':
+            if route == ['produtos']:
+                return 200, self.list_products(query)
+            if len(route) == 2 and route[0] == 'produtos':
+                return 200, self.get_product(self._int(route[1], 'id'))
+            if len(route) == 2 and route[0] == 'codigos':
+                product_id = self.controller.codes.lookup(route[1])
+                if product_id is None:
+                    raise ApiError(404, f"Código não encontrado: {route[1]}")
+                return 200, self.get_product(product_id)
+            if route == ['movimentacoes']:
+                return 200, self.list_movements(query)
+            if route == ['estoque']:
+                return 200, self.get_stock_totals()
+            if route == ['reservas']:
+                produto_id = self._int(query['produto_id'], 'produto_id') if 'produto_id' in query else None
+                return 200, {'reservas': [dict(row) for row in self.controller.reservations.get_active(produto_id)]}
+        elif method == 'POST' and route == ['movimentacoes']:
+            return 201, self.post_movements(payload)
+        elif method == 'POST' and route == ['reservas']:
+            return 201, self.post_reservation(payload)
+        elif method == 'POST' and len(route) == 3 and route[0] == 'reservas' and route[2] in ('confirmar', 'liberar'):
+            return 200, self.finish_reservation(self._int(route[1], 'id'), route[2])
+        
+        raise ApiError(404, 'Rota não encontrada')
+    
+    @staticmethod
+    def _int(value: Any, name: str) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ApiError(400, f"Parâmetro inválido: {name}")
+    
+    def _page(self, query: Dict[str, str]) -> tuple:
+        after = self._int(query.get('apos', 0), 'apos')
+        limit = self._int(query.get('limite', self.DEFAULT_PAGE_SIZE), 'limite')
+        return after, max(1, min(limit, self.MAX_PAGE_SIZE))
+    
+    @staticmethod
+    def _paged(records: List[Any], limit: int) -> Dict[str, Any]:
+        return {
+            'itens': [record._asdict() for record in records],
+            'proximo': records[-1].id if len(records) == limit else None
+        }
+    
+    def list_products(self, query: Dict[str, str]) -> Dict[str, Any]:
+        after, limit = self._page(query)
+        categoria_id = self._int(query['categoria_id'], 'categoria_id') if 'categoria_id' in query else None
+        classe_abc = query.get('classe_abc', '').upper() or None
+        classe_xyz = query.get('classe_xyz', '').upper() or None
+        records = self.pool.query_named(
+            'api.produtos_pagina',
+            (after, categoria_id, categoria_id, classe_abc, classe_abc, classe_xyz, classe_xyz, limit),
+            ProductRecord
+        )
+        return self._paged(records, limit)
+    
+    def get_product(self, product_id: int) -> Dict[str, Any]:
+        records = self.pool.query_named('produtos.por_id', (product_id,), ProductRecord)
+        if not records:
+            raise ApiError(404, f"Produto {product_id} não encontrado")
+        product = records[0]._asdict()
+        product['locais'] = [dict(row) for row in self.pool.query_named('estoque_local.por_produto', (product_id,))]
+        kits = self.controller.kits
+        if kits.is_kit(product_id):
+            product['kit'] = {
+                'componentes': [{'produto_id': cid, 'quantidade': qtd} for cid, qtd in kits.components(product_id).items()],
+                'disponivel': kits.available(product_id)
+            }
+        return product
+    
+    def list_movements(self, query: Dict[str, str]) -> Dict[str, Any]:
+        after, limit = self._page(query)
+        produto_id = self._int(query['produto_id'], 'produto_id') if 'produto_id' in query else None
+        records = self.pool.query_named(
+            'api.movimentacoes_pagina', (after, produto_id, produto_id, limit), MovementRecord
+        )
+        return self._paged(records, limit)
+    
+    def get_stock_totals(self) -> Dict[str, Any]:
+        return {
+            'geral': dict(self.pool.query_named('estoque_local.total_geral')[0]),
+            'locais': [dict(row) for row in self.pool.query_named('estoque_local.totais')],
+            'categorias': [dict(row) for row in self.pool.query_named('api.estoque_categorias')]
+        }
+    
+    def _parse_movement(self, index: int, item: Any) -> tuple:
+        if not isinstance(item, dict):
+            raise ApiError(400, f"Item {index}: objeto esperado")
+        
+        if 'codigo' in item:
+            product_id = self.controller.codes.lookup(str(item['codigo']))
+            if product_id is None:
+                raise ApiError(404, f"Item {index}: código não encontrado: {item['codigo']}")
+        else:
+            product_id = self._int(item.get('produto_id'), f"itens[{index}].produto_id")
+        
+        tipo = item.get('tipo')
+        if tipo not in ('ENTRADA', 'SAIDA'):
+            raise ApiError(400, f"Item {index}: tipo deve ser ENTRADA ou SAIDA")
+        quantidade = self._int(item.get('quantidade'), f"itens[{index}].quantidade")
+        if quantidade <= 0:
+            raise ApiError(400, f"Item {index}: quantidade deve ser maior que zero")
+        
+        valor_unitario = item.get('valor_unitario')
+        if valor_unitario is not None:
+            try:
+                valor_unitario = float(valor_unitario)
+            except (TypeError, ValueError):
+                raise ApiError(400, f"Item {index}: valor_unitario inválido")
+        
+        local_id = self._int(item.get('local_id', DatabaseManager.DEFAULT_LOCATION_ID), f"itens[{index}].local_id")
+        return product_id, tipo, quantidade, valor_unitario, str(item.get('observacao') or 'API'), local_id
+    
+    def post_movements(self, payload: Any) -> Dict[str, Any]:
+        """Grava um lote de movimentações: tudo ou nada, em uma única transação
+        
+        Sem valor_unitario, usa o preço de compra (ENTRADA) ou de venda (SAIDA).
+        """
+        items = payload.get('movimentacoes') if isinstance(payload, dict) else payload
+        if not isinstance(items, list) or not items:
+            raise ApiError(400, 'Informe uma lista de movimentações')
+        if len(items) > self.MAX_BATCH:
+            raise ApiError(413, f"Máximo de {self.MAX_BATCH} movimentações por requisição")
+        
+        movements = [self._parse_movement(index, item) for index, item in enumerate(items)]
+        
+        product_ids = sorted({movement[0] for movement in movements})
+        placeholders = ','.join('?' * len(product_ids))
+        controller = self.controller
+        prices = {
+            row[0]: (row[1], row[2]) for row in controller.db.execute_query(
+                f'SELECT id, preco_compra, preco_venda FROM produtos WHERE ativo = 1 AND id IN ({placeholders})',
+                tuple(product_ids)
+            )
+        }
+        
+        with controller.db.transaction():
+            for index, (product_id, tipo, quantidade, valor_unitario, observacao, local_id) in enumerate(movements):
+                if product_id not in prices:
+                    raise ApiError(404, f"Item {index}: produto {product_id} não encontrado")
+                if tipo == 'SAIDA' and controller.get_available_stock(product_id, local_id) < quantidade:
+                    raise ApiError(409, f"Item {index}: saldo insuficiente do produto {product_id} no local {local_id}")
+                if valor_unitario is None:
+                    preco_compra, preco_venda = prices[product_id]
+                    valor_unitario = (preco_compra if tipo == 'ENTRADA' else preco_venda) or 0.0
+                controller._post_movement(product_id, tipo, quantidade, valor_unitario, observacao, local_id)
+        
+        return {'registradas': len(movements)}
+    
+    def post_reservation(self, payload: Any) -> Dict[str, Any]:
+        """Reserva unidades para um pedido: 409 se o disponível no local não atende"""
+        if not isinstance(payload, dict):
+            raise ApiError(400, 'Objeto JSON esperado')
+        if 'codigo' in payload:
+            product_id = self.controller.codes.lookup(str(payload['codigo']))
+            if product_id is None:
+                raise ApiError(404, f"Código não encontrado: {payload['codigo']}")
         else:
-            query = '''
-                SELECT m.*, p.nome as produto_nome
-                FROM movimentacoes m
-                JOIN produtos p ON m.produto_id = p.id
-                ORDER BY m.data_movimentacao DESC
-                LIMIT 100
-            '''
-            return self.db.execute_query(query)
+            product_id = self._int(payload.get('produto_id'), 'produto_id')
+        quantidade = self._int(payload.get('quantidade'), 'quantidade')
+        local_id = self._int(payload.get('local_id', DatabaseManager.DEFAULT_LOCATION_ID), 'local_id')
+        ttl = self._int(payload.get('validade_segundos', ReservationManager.DEFAULT_TTL), 'validade_segundos')
+        try:
+            reservation_id = self.controller.reservations.reserve(
+                product_id, quantidade, local_id, ttl, str(payload.get('referencia') or '')
+            )
+        except ValueError as e:
+            raise ApiError(409, str(e))
+        return {'id': reservation_id, 'disponivel': self.controller.get_available_stock(product_id, local_id)}
+    
+    def finish_reservation(self, reservation_id: int, action: str) -> Dict[str, Any]:
+        reservations = self.controller.reservations
+        try:
+            if action == 'confirmar':
+                reservations.commit(reservation_id)
+            else:
+                reservations.release(reservation_id)
+        except ValueError as e:
+            raise ApiError(409, str(e))
+        return {'id': reservation_id, 'status': 'CONFIRMADA' if action == 'confirmar' else 'LIBERADA'}
+
+class RenderScheduler:
+    """Agrupa os pedidos de atualização da tela em um único page.update()
+    
+    Cada page.update() serializa a diferença da árvore de controles e a envia
+    pelo websocket. Os métodos da tela só pedem a atualização; ela é enviada
+    uma vez por quadro (frame_seconds) ou, dentro de batch(), uma vez ao fim
+    do bloco mais externo.
+    """
+    
+    def __init__(self, page: ft.Page, frame_seconds: float = 1 / 60):
+        self.page = page
+        self.frame_seconds = frame_seconds
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = False
+        self._batch_depth = 0
+        self.requests = 0
+        self.flushes = 0
+    
+    def request(self):
+        """Marca a página como alterada e agenda o envio"""
+        with self._lock:
+            self.requests += 1
+            self._pending = True
+            if self._batch_depth or self._timer is not None:
+                return
+            self._timer = threading.Timer(self.frame_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def flush(self):
+        """Envia as alterações pendentes (nada a fazer se outro bloco ainda está aberto)"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._batch_depth or not self._pending:
+                return
+            self._pending = False
+            self.flushes += 1
+        self.page.update()
+    
+    @contextmanager
+    def batch(self):
+        """Alterações feitas dentro do bloco saem em um único envio ao final"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                done = self._batch_depth == 0
+            if done:
+                self.flush()
+
+def batched_render(handler):
+    """Decorador de eventos da tela: um único page.update() por ação"""
+    @wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        with self.render.batch():
+            return handler(self, *args, **kwargs)
+    return wrapper
 
 class StockControlApp:
     """Aplicação principal do Sistema de Controle de Estoque"""
     
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, controller: ProductController = None):
         self.page = page
-        self.controller = ProductController()
+        self.render = RenderScheduler(page)
+        self.controller = controller or ProductController()
+        self.my_jobs = set()
+        self.controller.jobs.subscribe(self.on_job_update)
+        self.scanner = ScanBuffer(self.controller, on_flush=self.on_scan_flush)
+        self.selected_count_id = None
         self.setup_page()
         self.selected_product_id = None
+    
+    def close(self, e=None):
+        """Encerra a sessão: grava leituras pendentes e deixa de ouvir a fila de tarefas"""
+        self.controller.jobs.unsubscribe(self.on_job_update)
+        self.scanner.on_flush = None
+        self.scanner.flush()
         
     def setup_page(self):
         """Configura as propriedades da página"""
@@ -399,6 +5562,7 @@ class StockControlApp:
         self.page.window_width = 1200
         self.page.window_height = 900
         self.page.window_resizable = True
+        self.page.on_close = self.close  # sessão do navegador expirada
         
         self.build_interface()
     
@@ -419,7 +5583,10 @@ class StockControlApp:
                 ft.Tab(text="Dashboard", icon=ft.Icons.DASHBOARD, content=self.build_dashboard()),
                 ft.Tab(text="Produtos", icon=ft.Icons.INVENTORY, content=self.build_products_tab()),
                 ft.Tab(text="Movimentações", icon=ft.Icons.SWAP_HORIZ, content=self.build_movements_tab()),
-                ft.Tab(text="Relatórios", icon=ft.Icons.ANALYTICS, content=self.build_reports_tab())
+                ft.Tab(text="Relatórios", icon=ft.Icons.ANALYTICS, content=self.build_reports_tab()),
+                ft.Tab(text="Diagnóstico", icon=ft.Icons.SPEED, content=self.build_diagnostics_tab()),
+                ft.Tab(text="Compras", icon=ft.Icons.SHOPPING_CART, content=self.build_purchasing_tab()),
+                ft.Tab(text="Inventário", icon=ft.Icons.FACT_CHECK, content=self.build_counting_tab())
             ]
         )
 
@@ -444,11 +5611,11 @@ class StockControlApp:
     def build_dashboard(self) -> ft.Container:
         """Constrói o dashboard principal"""
         # Métricas principais
-        products = self.controller.get_products()
-        total_products = len(products)
-        low_stock = len([p for p in products if p['estoque_atual'] <= p['estoque_minimo']])
+        snapshot = self.controller.get_inventory_snapshot()
+        total_products = len(snapshot)
+        low_stock = snapshot.low_stock_count()
         
-        valor_total_estoque = sum(p['estoque_atual'] * p['preco_venda'] for p in products)
+        valor_total_estoque = snapshot.total_value()
         
         metrics_row = ft.Row([
             self.create_metric_card("Total de Produtos", str(total_products), ft.Icons.INVENTORY, ft.Colors.BLUE),
@@ -457,7 +5624,7 @@ class StockControlApp:
         ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
         
         # Produtos com estoque baixo
-        low_stock_products = [p for p in products if p['estoque_atual'] <= p['estoque_minimo']]
+        low_stock_products = self.controller.get_low_stock_products(10)
         
         low_stock_table = ft.DataTable(
             columns=[
@@ -468,9 +5635,9 @@ class StockControlApp:
             ],
             rows=[
                 ft.DataRow(cells=[
-                    ft.DataCell(ft.Text(product['nome'])),
-                    ft.DataCell(ft.Text(str(product['estoque_atual']))),
-                    ft.DataCell(ft.Text(str(product['estoque_minimo']))),
+                    ft.DataCell(ft.Text(product.nome)),
+                    ft.DataCell(ft.Text(str(product.estoque_atual))),
+                    ft.DataCell(ft.Text(str(product.estoque_minimo))),
                     ft.DataCell(
                         ft.Container(
                             content=ft.Text("BAIXO", color=ft.Colors.WHITE, size=12),
@@ -479,7 +5646,35 @@ class StockControlApp:
                             border_radius=5
                         )
                     ),
-                ]) for product in low_stock_products[:10]
+                ]) for product in low_stock_products
+            ]
+        )
+        
+        # Lotes vencidos ou a vencer nos próximos 30 dias
+        expiring_lots = self.controller.get_expiring_lots(30, limit=10)
+        hoje = datetime.now().strftime('%Y-%m-%d')
+        
+        expiring_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Produto", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Lote", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Local", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Validade", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Saldo", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(lot['produto_nome'])),
+                    ft.DataCell(ft.Text(lot['numero_lote'])),
+                    ft.DataCell(ft.Text(lot['local_nome'])),
+                    ft.DataCell(
+                        ft.Text(
+                            datetime.strptime(lot['data_validade'], '%Y-%m-%d').strftime('%d/%m/%Y'),
+                            color=ft.Colors.RED if lot['data_validade'] < hoje else ft.Colors.ORANGE
+                        )
+                    ),
+                    ft.DataCell(ft.Text(str(lot['saldo']))),
+                ]) for lot in expiring_lots
             ]
         )
         
@@ -490,6 +5685,12 @@ class StockControlApp:
             ft.Container(
                 content=low_stock_table if low_stock_products else ft.Text("✅ Nenhum produto com estoque baixo!"),
                 padding=10
+            ),
+            ft.Divider(),
+            ft.Text("⏳ Lotes a Vencer (30 dias)", size=20, weight=ft.FontWeight.BOLD),
+            ft.Container(
+                content=expiring_table if expiring_lots else ft.Text("✅ Nenhum lote vencendo!"),
+                padding=10
             )
         ],scroll="auto")
         
@@ -558,6 +5759,12 @@ class StockControlApp:
         self.estoque_minimo_field = ft.TextField(label="Estoque Mínimo", width=150, value="0")
         self.estoque_maximo_field = ft.TextField(label="Estoque Máximo", width=150, value="100")
         self.unidade_field = ft.TextField(label="Unidade", width=100, value="UN")
+        self.sku_field = ft.TextField(label="SKU", width=150)
+        self.ean_field = ft.TextField(label="EAN (código de barras)", width=200)
+        self.kit_field = ft.TextField(
+            label="Componentes do kit (código;quantidade por linha)", width=300,
+            multiline=True, min_lines=1, max_lines=4
+        )
         
         # Botões
         self.save_button = ft.ElevatedButton(
@@ -585,7 +5792,8 @@ class StockControlApp:
         # Layout do formulário
         form_layout = ft.Column([
             ft.Row([self.nome_field, self.categoria_dropdown, self.fornecedor_dropdown]),
-            ft.Row([self.descricao_field]),
+            ft.Row([self.descricao_field, self.sku_field, self.ean_field]),
+            ft.Row([self.kit_field]),
             ft.Row([
                 self.preco_compra_field, self.preco_venda_field, self.unidade_field,
                 self.estoque_atual_field, self.estoque_minimo_field, self.estoque_maximo_field
@@ -610,11 +5818,28 @@ class StockControlApp:
                 ft.DataColumn(ft.Text("Estoque", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Preço Venda", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Status", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Classe", weight=ft.FontWeight.BOLD)),
                 ft.DataColumn(ft.Text("Ações", weight=ft.FontWeight.BOLD)),
             ],
             rows=[]
         )
         
+        # Filtros pela classificação ABC/XYZ
+        self.classe_abc_filter = ft.Dropdown(
+            label="Classe ABC",
+            width=140,
+            value="",
+            options=[ft.dropdown.Option("", "Todas")] + [ft.dropdown.Option(c) for c in "ABC"],
+            on_change=lambda _: self.refresh_products_table()
+        )
+        self.classe_xyz_filter = ft.Dropdown(
+            label="Classe XYZ",
+            width=140,
+            value="",
+            options=[ft.dropdown.Option("", "Todas")] + [ft.dropdown.Option(c) for c in "XYZ"],
+            on_change=lambda _: self.refresh_products_table()
+        )
+        
         self.refresh_products_table()
         
         return ft.Container(
@@ -623,6 +5848,12 @@ class StockControlApp:
                     ft.ElevatedButton(
                         "🔄 Atualizar Lista",
                         on_click=lambda _: self.refresh_products_table()
+                    ),
+                    self.classe_abc_filter,
+                    self.classe_xyz_filter,
+                    ft.ElevatedButton(
+                        "🔤 Classificar ABC/XYZ",
+                        on_click=lambda _: self.enqueue_job('classificar_produtos')
                     )
                 ]),
                 self.products_datatable
@@ -632,28 +5863,38 @@ class StockControlApp:
     
     def refresh_products_table(self):
         """Atualiza a tabela de produtos"""
-        products = self.controller.get_products()
+        products = self.controller.get_products(
+            classe_abc=self.classe_abc_filter.value or None,
+            classe_xyz=self.classe_xyz_filter.value or None
+        )
+        kits = self.controller.kits.get_availability()
         self.products_datatable.rows.clear()
         
         for product in products:
-            # Status do estoque
-            if product['estoque_atual'] <= product['estoque_minimo']:
+            # Status do estoque (kits não têm saldo próprio: mostra quantos podem ser montados)
+            if product.id in kits:
+                status_color = ft.Colors.BLUE
+                status_text = "KIT"
+                estoque_text = f"{kits[product.id]} montáveis"
+            elif product.estoque_atual <= product.estoque_minimo:
                 status_color = ft.Colors.RED
                 status_text = "BAIXO"
-            elif product['estoque_atual'] >= product['estoque_maximo']:
+            elif product.estoque_atual >= product.estoque_maximo:
                 status_color = ft.Colors.ORANGE
                 status_text = "ALTO"
             else:
                 status_color = ft.Colors.GREEN
                 status_text = "NORMAL"
+            if product.id not in kits:
+                estoque_text = f"{product.estoque_atual} {product.unidade_medida}"
             
             self.products_datatable.rows.append(
                 ft.DataRow(cells=[
-                    ft.DataCell(ft.Text(str(product['id']))),
-                    ft.DataCell(ft.Text(product['nome'])),
-                    ft.DataCell(ft.Text(product['categoria_nome'] or 'Sem categoria')),
-                    ft.DataCell(ft.Text(f"{product['estoque_atual']} {product['unidade_medida']}")),
-                    ft.DataCell(ft.Text(f"R$ {product['preco_venda']:.2f}")),
+                    ft.DataCell(ft.Text(str(product.id))),
+                    ft.DataCell(ft.Text(product.nome)),
+                    ft.DataCell(ft.Text(product.categoria_nome or 'Sem categoria')),
+                    ft.DataCell(ft.Text(estoque_text)),
+                    ft.DataCell(ft.Text(f"R$ {product.preco_venda:.2f}")),
                     ft.DataCell(
                         ft.Container(
                             content=ft.Text(status_text, color=ft.Colors.WHITE, size=10),
@@ -662,25 +5903,27 @@ class StockControlApp:
                             border_radius=3
                         )
                     ),
+                    ft.DataCell(ft.Text((product.classe_abc or '') + (product.classe_xyz or '') or '-')),
                     ft.DataCell(
                         ft.Row([
                             ft.IconButton(
                                 ft.Icons.EDIT,
                                 tooltip="Editar",
-                                on_click=lambda _, pid=product['id']: self.edit_product(pid)
+                                on_click=lambda _, pid=product.id: self.edit_product(pid)
                             ),
                             ft.IconButton(
                                 ft.Icons.DELETE,
                                 tooltip="Excluir",
-                                on_click=lambda _, pid=product['id']: self.delete_product_confirm(pid)
+                                on_click=lambda _, pid=product.id: self.delete_product_confirm(pid)
                             )
                         ])
                     ),
                 ])
             )
         
-        self.page.update()
+        self.request_update()
     
+    @batched_render
     def save_product(self, e):
         """Salva um novo produto"""
         if not self.nome_field.value or not self.nome_field.value.strip():
@@ -719,7 +5962,10 @@ class StockControlApp:
                 'preco_venda': preco_venda,
                 'estoque_minimo': estoque_minimo,
                 'estoque_maximo': estoque_maximo,
-                'unidade_medida': self.unidade_field.value.strip() if self.unidade_field.value else 'UN'
+                'unidade_medida': self.unidade_field.value.strip() if self.unidade_field.value else 'UN',
+                'sku': (self.sku_field.value or '').strip(),
+                'ean': (self.ean_field.value or '').strip(),
+                'componentes': self.parse_kit_components(self.kit_field.value)
             }
             
             if self.controller.create_product(product_data):
@@ -728,7 +5974,7 @@ class StockControlApp:
                 self.refresh_products_table()
                 self.refresh_reports()
             else:
-                self.show_message("❌ Erro ao cadastrar produto! Verifique se o nome não está duplicado.", ft.Colors.RED)
+                self.show_message("❌ Erro ao cadastrar produto! Verifique se nome, SKU ou EAN não estão duplicados.", ft.Colors.RED)
                 
         except ValueError as ve:
             self.show_message(f"❌ Erro nos dados numéricos: Verifique os valores inseridos!", ft.Colors.RED)
@@ -736,36 +5982,43 @@ class StockControlApp:
             print(f"Erro detalhado: {ex}")  # Para debug
             self.show_message(f"❌ Erro inesperado ao salvar produto!", ft.Colors.RED)
         
+    @batched_render
     def edit_product(self, product_id: int):
         """Carrega um produto para edição"""
-        products = self.controller.get_products(filter_active=False)
-        product = next((p for p in products if p['id'] == product_id), None)
+        product = self.controller.get_product(product_id)
         
         if not product:
             self.show_message("❌ Produto não encontrado!", ft.Colors.RED)
             return
 
         # Preencher formulário
-        self.nome_field.value = product['nome']
-        self.descricao_field.value = product['descricao'] or ''
-        self.categoria_dropdown.value = str(product['categoria_id']) if product['categoria_id'] else None
-        self.fornecedor_dropdown.value = str(product['fornecedor_id']) if product['fornecedor_id'] else None
-        self.preco_compra_field.value = str(product['preco_compra'])
-        self.preco_venda_field.value = str(product['preco_venda'])
-        self.estoque_minimo_field.value = str(product['estoque_minimo'])
-        self.estoque_maximo_field.value = str(product['estoque_maximo'])
-        self.unidade_field.value = product['unidade_medida']
+        self.nome_field.value = product.nome
+        self.descricao_field.value = product.descricao or ''
+        self.categoria_dropdown.value = str(product.categoria_id) if product.categoria_id else None
+        self.fornecedor_dropdown.value = str(product.fornecedor_id) if product.fornecedor_id else None
+        self.preco_compra_field.value = str(product.preco_compra)
+        self.preco_venda_field.value = str(product.preco_venda)
+        self.estoque_minimo_field.value = str(product.estoque_minimo)
+        self.estoque_maximo_field.value = str(product.estoque_maximo)
+        self.unidade_field.value = product.unidade_medida
+        self.sku_field.value = product.sku or ''
+        self.ean_field.value = product.ean or ''
+        self.kit_field.value = '\n'.join(
+            f"{self.product_code(componente_id)};{quantidade}"
+            for componente_id, quantidade in self.controller.kits.get_structure(product.id).items()
+        )
 
         # Atualiza estado interno para saber qual produto está sendo editado
-        self.selected_product_id = product['id']
+        self.selected_product_id = product.id
 
         # Mostrar botão de atualização e ocultar botão de salvar
         self.save_button.visible = False
         self.update_button.visible = True
 
         # Atualizar a interface
-        self.page.update()
+        self.request_update()
 
+    @batched_render
     def update_product(self, e):
         """Atualiza um produto existente"""
         if not self.selected_product_id:
@@ -786,7 +6039,10 @@ class StockControlApp:
                 'preco_venda': float(self.preco_venda_field.value or 0),
                 'estoque_minimo': int(self.estoque_minimo_field.value or 0),
                 'estoque_maximo': int(self.estoque_maximo_field.value or 100),
-                'unidade_medida': self.unidade_field.value.strip() or 'UN'
+                'unidade_medida': self.unidade_field.value.strip() or 'UN',
+                'sku': (self.sku_field.value or '').strip(),
+                'ean': (self.ean_field.value or '').strip(),
+                'componentes': self.parse_kit_components(self.kit_field.value)
             }
             
             if self.controller.update_product(self.selected_product_id, product_data):
@@ -802,6 +6058,25 @@ class StockControlApp:
         except Exception as ex:
             self.show_message(f"❌ Erro inesperado: {ex}", ft.Colors.RED)
     
+    def parse_kit_components(self, text: str) -> Dict[int, int]:
+        """Converte linhas 'código;quantidade' (SKU, EAN ou ID) em {produto_id: quantidade}"""
+        components = {}
+        for line in (text or '').splitlines():
+            if not line.strip():
+                continue
+            code, _, quantidade = line.partition(';')
+            product_id = self.controller.codes.lookup(code)
+            if product_id is None and code.strip().isdigit():
+                product_id = int(code)
+            if product_id is None:
+                raise ValueError(f"componente não encontrado: {code.strip()}")
+            components[product_id] = components.get(product_id, 0) + int(quantidade or 1)
+        return components
+    
+    def product_code(self, product_id: int) -> str:
+        product = self.controller.get_product(product_id)
+        return (product and (product.sku or product.ean)) or str(product_id)
+    
     def clear_form(self, e):
         """Limpa o formulário"""
         self.nome_field.value = ""
@@ -814,51 +6089,50 @@ class StockControlApp:
         self.estoque_minimo_field.value = "0"
         self.estoque_maximo_field.value = "100"
         self.unidade_field.value = "UN"
+        self.sku_field.value = ""
+        self.ean_field.value = ""
+        self.kit_field.value = ""
         
         # Resetar botões
         self.save_button.visible = True
         self.update_button.visible = False
         self.selected_product_id = None
         
-        self.page.update()
+        self.request_update()
     
     def delete_product_confirm(self, product_id: int):
         """Confirma a exclusão de um produto"""
         
         # Primeiro: verificar se o produto tem estoque > 0
-        products = self.controller.get_products(filter_active=False)
-        product = next((p for p in products if p['id'] == product_id), None)
+        product = self.controller.get_product(product_id)
         
         if not product:
             self.show_message("❌ Produto não encontrado!", ft.Colors.RED)
             return
         
-        if product['estoque_atual'] > 0:
+        if product.estoque_atual > 0:
             self.show_message(
-                f"❌ Não é possível excluir o produto '{product['nome']}' pois possui estoque de {product['estoque_atual']} {product['unidade_medida']}!", 
+                f"❌ Não é possível excluir o produto '{product.nome}' pois possui estoque de {product.estoque_atual} {product.unidade_medida}!", 
                 ft.Colors.RED
             )
             return
         
         # Funções do diálogo
         def delete_confirmed(e):
-            if self.controller.delete_product(product_id):
-                self.show_message("✅ Produto removido com sucesso!", ft.Colors.GREEN)
-                self.refresh_products_table()
-                self.refresh_reports()
-            else:
-                self.show_message("❌ Erro ao remover produto!", ft.Colors.RED)
-            
-            # Fechar diálogo corretamente
-            self.dialog.open = False
-            self.page.update()
+            with self.render.batch():
+                # Fechar o diálogo de confirmação antes de abrir a mensagem
+                confirmation_dialog.open = False
+                if self.controller.delete_product(product_id):
+                    self.show_message("✅ Produto removido com sucesso!", ft.Colors.GREEN)
+                    self.refresh_products_table()
+                    self.refresh_reports()
+                else:
+                    self.show_message("❌ Erro ao remover produto!", ft.Colors.RED)
         
         def cancel_delete(e):
             # Fechar diálogo corretamente
-            if self.dialog:
-                self.dialog.open = False
-                self.dialog.update()
-            self.page.update()
+            confirmation_dialog.open = False
+            self.request_update()
         
         # Criar diálogo
         confirmation_dialog = ft.AlertDialog(
@@ -866,7 +6140,7 @@ class StockControlApp:
             title=ft.Text("⚠️ Confirmar Exclusão", size=18, weight=ft.FontWeight.BOLD),
             content=ft.Container(
                 content=ft.Text(
-                    f"Tem certeza que deseja remover o produto:\n\n'{product['nome']}'?\n\nEsta ação não pode ser desfeita.",
+                    f"Tem certeza que deseja remover o produto:\n\n'{product.nome}'?\n\nEsta ação não pode ser desfeita.",
                     size=14
                 ),
                 width=300,
@@ -889,10 +6163,7 @@ class StockControlApp:
         
         # Definir e abrir diálogo
         self.dialog = confirmation_dialog
-        if not self.dialog.open:
-            self.dialog.open = True
-        self.page.add(self.dialog)
-        self.page.update()
+        self.open_dialog(self.dialog)
             
     def build_movements_tab(self) -> ft.Container:
         """Constrói a aba de movimentações"""
@@ -920,7 +6191,7 @@ class StockControlApp:
         self.produto_movimento_dropdown = ft.Dropdown(
             label="Produto *",
             width=300,
-            options=[ft.dropdown.Option(prod['id'], f"{prod['nome']} (Estoque: {prod['estoque_atual']})") for prod in products]
+            options=[ft.dropdown.Option(prod.id, f"{prod.nome} (Estoque: {prod.estoque_atual})") for prod in products]
         )
         
         # Tipo de movimentação
@@ -929,13 +6200,32 @@ class StockControlApp:
             width=200,
             options=[
                 ft.dropdown.Option("ENTRADA", "Entrada"),
-                ft.dropdown.Option("SAIDA", "Saída")
-            ]
+                ft.dropdown.Option("SAIDA", "Saída"),
+                ft.dropdown.Option("TRANSFERENCIA", "Transferência")
+            ],
+            on_change=self.on_movement_type_change
+        )
+        
+        # Locais (origem/destino)
+        locations = self.controller.get_locations()
+        self.local_movimento_dropdown = ft.Dropdown(
+            label="Local",
+            width=200,
+            value=str(DatabaseManager.DEFAULT_LOCATION_ID),
+            options=[ft.dropdown.Option(loc['id'], loc['nome']) for loc in locations]
+        )
+        self.destino_movimento_dropdown = ft.Dropdown(
+            label="Local de Destino *",
+            width=200,
+            visible=False,
+            options=[ft.dropdown.Option(loc['id'], loc['nome']) for loc in locations]
         )
         
         # Campos da movimentação
         self.quantidade_movimento_field = ft.TextField(label="Quantidade *", width=150, value="1")
         self.valor_unitario_movimento_field = ft.TextField(label="Valor Unitário", width=150, value="0.00")
+        self.lote_movimento_field = ft.TextField(label="Lote (entrada)", width=150)
+        self.validade_movimento_field = ft.TextField(label="Validade (DD/MM/AAAA)", width=200)
         self.observacao_movimento_field = ft.TextField(
             label="Observação", 
             width=400, 
@@ -958,12 +6248,26 @@ class StockControlApp:
             color=ft.Colors.WHITE
         )
         
+        # Modo leitura: cada código lido (SKU/EAN) movimenta 1 unidade do tipo e local selecionados
+        self.leitura_field = ft.TextField(
+            label="📷 Modo Leitura (SKU/EAN)",
+            width=300,
+            on_submit=self.scan_submit
+        )
+        self.leitura_status = ft.Text("", size=12, color=ft.Colors.GREY)
+        
         # Layout do formulário
         form_layout = ft.Column([
             ft.Row([self.produto_movimento_dropdown, self.tipo_movimento_dropdown]),
-            ft.Row([self.quantidade_movimento_field, self.valor_unitario_movimento_field]),
+            ft.Row([self.local_movimento_dropdown, self.destino_movimento_dropdown]),
+            ft.Row([
+                self.quantidade_movimento_field, self.valor_unitario_movimento_field,
+                self.lote_movimento_field, self.validade_movimento_field
+            ]),
             ft.Row([self.observacao_movimento_field]),
-            ft.Row([self.registrar_movimento_button, self.limpar_movimento_button])
+            ft.Row([self.registrar_movimento_button, self.limpar_movimento_button]),
+            ft.Divider(),
+            ft.Row([self.leitura_field, self.leitura_status])
         ])
         
         return ft.Container(
@@ -1003,40 +6307,101 @@ class StockControlApp:
             height=400
         )
     
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def format_minute(minute: int) -> str:
+        """Formata um minuto (época // 60) como DD/MM/AAAA HH:MM; vários registros compartilham o resultado"""
+        return time.strftime('%d/%m/%Y %H:%M', time.gmtime(minute * 60))
+    
     def refresh_movements_table(self):
         """Atualiza a tabela de movimentações"""
         movements = self.controller.get_movements()
         self.movements_datatable.rows.clear()
         
         for movement in movements:
-            # Formatar data
-            data_movimento = datetime.strptime(movement['data_movimentacao'], '%Y-%m-%d %H:%M:%S')
-            data_formatada = data_movimento.strftime('%d/%m/%Y %H:%M')
+            data_formatada = self.format_minute(movement.data_epoch // 60)
             
             # Cor do tipo
-            tipo_color = ft.Colors.GREEN if movement['tipo'] == 'ENTRADA' else ft.Colors.RED
+            tipo_color = ft.Colors.GREEN if movement.tipo == 'ENTRADA' else ft.Colors.RED
             
             self.movements_datatable.rows.append(
                 ft.DataRow(cells=[
                     ft.DataCell(ft.Text(data_formatada, size=12)),
-                    ft.DataCell(ft.Text(movement['produto_nome'], size=12)),
+                    ft.DataCell(ft.Text(movement.produto_nome, size=12)),
                     ft.DataCell(
                         ft.Container(
-                            content=ft.Text(movement['tipo'], color=ft.Colors.WHITE, size=10),
+                            content=ft.Text(movement.tipo, color=ft.Colors.WHITE, size=10),
                             bgcolor=tipo_color,
                             padding=3,
                             border_radius=3
                         )
                     ),
-                    ft.DataCell(ft.Text(str(movement['quantidade']), size=12)),
-                    ft.DataCell(ft.Text(f"R$ {movement['valor_unitario']:.2f}", size=12)),
-                    ft.DataCell(ft.Text(f"R$ {movement['valor_total']:.2f}", size=12)),
-                    ft.DataCell(ft.Text(movement['observacao'] or '', size=12)),
+                    ft.DataCell(ft.Text(str(movement.quantidade), size=12)),
+                    ft.DataCell(ft.Text(f"R$ {movement.valor_unitario:.2f}", size=12)),
+                    ft.DataCell(ft.Text(f"R$ {movement.valor_total:.2f}", size=12)),
+                    ft.DataCell(ft.Text(movement.observacao or '', size=12)),
                 ])
             )
         
-        self.page.update()
+        self.request_update()
+    
+    def refresh_after_movement(self):
+        """Atualiza as tabelas e o dropdown de produtos após movimentações"""
+        self.refresh_movements_table()
+        self.refresh_products_table()
+        self.refresh_reports()
+        
+        # Atualizar dropdown de produtos
+        products = self.controller.get_products()
+        self.produto_movimento_dropdown.options = [
+            ft.dropdown.Option(prod.id, f"{prod.nome} (Estoque: {prod.estoque_atual})")
+            for prod in products
+        ]
+        self.request_update()
+    
+    @batched_render
+    def scan_submit(self, e):
+        """Processa um código lido no modo leitura"""
+        code = (self.leitura_field.value or '').strip()
+        self.leitura_field.value = ""
+        if not code:
+            return
+        
+        tipo = self.tipo_movimento_dropdown.value
+        if tipo not in ('ENTRADA', 'SAIDA'):
+            tipo = 'SAIDA'
+        local_id = int(self.local_movimento_dropdown.value or DatabaseManager.DEFAULT_LOCATION_ID)
+        
+        if self.scanner.scan(code, tipo, 1, local_id) is None:
+            self.leitura_status.value = f"❌ Código não encontrado: {code}"
+            self.leitura_status.color = ft.Colors.RED
+        else:
+            self.leitura_status.value = f"📷 {code} ({tipo}) - {self.scanner.pending_count()} leitura(s) pendente(s)"
+            self.leitura_status.color = ft.Colors.GREY
+        self.leitura_field.focus()
+        self.request_update()
+    
+    @batched_render
+    def on_scan_flush(self, result: Dict[str, Any]):
+        """Recebe o resultado da gravação de um lote de leituras"""
+        if not hasattr(self, 'leitura_status'):
+            return
+        if result.get('erro'):
+            self.leitura_status.value = f"❌ Erro ao gravar leituras: {result['erro']}"
+            self.leitura_status.color = ft.Colors.RED
+        elif result['rejeitadas'] or result['descartadas']:
+            self.leitura_status.value = (
+                f"⚠️ {result['movimentacoes']} item(ns) gravado(s), "
+                f"{len(result['rejeitadas'])} item(ns) sem saldo no local, "
+                f"{len(result['descartadas'])} descartado(s) após falhas"
+            )
+            self.leitura_status.color = ft.Colors.ORANGE
+        else:
+            self.leitura_status.value = f"✅ {result['leituras']} leitura(s) gravada(s)"
+            self.leitura_status.color = ft.Colors.GREEN
+        self.refresh_after_movement()
     
+    @batched_render
     def register_movement_click(self, e):
         """Registra uma nova movimentação"""
         if not self.produto_movimento_dropdown.value:
@@ -1061,34 +6426,55 @@ class StockControlApp:
             produto_id = int(self.produto_movimento_dropdown.value)
             tipo = self.tipo_movimento_dropdown.value
             observacao = self.observacao_movimento_field.value.strip() if self.observacao_movimento_field.value else ''
+            local_id = int(self.local_movimento_dropdown.value or DatabaseManager.DEFAULT_LOCATION_ID)
+            lote = self.lote_movimento_field.value.strip() if self.lote_movimento_field.value else None
+            validade = None
+            if self.validade_movimento_field.value and self.validade_movimento_field.value.strip():
+                try:
+                    validade = datetime.strptime(
+                        self.validade_movimento_field.value.strip(), '%d/%m/%Y'
+                    ).strftime('%Y-%m-%d')
+                except ValueError:
+                    self.show_message("❌ Validade inválida! Use DD/MM/AAAA.", ft.Colors.RED)
+                    return
             
-            # Verificar se há estoque suficiente para saída
-            if tipo == 'SAIDA':
-                products = self.controller.get_products()
-                product = next((p for p in products if p['id'] == produto_id), None)
-                if product and product['estoque_atual'] < quantidade:
-                    self.show_message(
-                        f"❌ Estoque insuficiente! Disponível: {product['estoque_atual']} {product['unidade_medida']}", 
-                        ft.Colors.RED
-                    )
+            if validade and not lote:
+                self.show_message("❌ Informe o número do lote para a validade!", ft.Colors.RED)
+                return
+            
+            if tipo == 'TRANSFERENCIA':
+                if not self.destino_movimento_dropdown.value:
+                    self.show_message("❌ Selecione o local de destino!", ft.Colors.RED)
                     return
+                if int(self.destino_movimento_dropdown.value) == local_id:
+                    self.show_message("❌ Origem e destino devem ser diferentes!", ft.Colors.RED)
+                    return
+            
+            # O saldo disponível é conferido pelo controlador, dentro da transação da gravação
+            if tipo == 'TRANSFERENCIA':
+                success = self.controller.transfer_stock(
+                    produto_id, local_id, int(self.destino_movimento_dropdown.value), quantidade, observacao
+                )
+            else:
+                success = self.controller.register_movement(
+                    produto_id, tipo, quantidade, valor_unitario, observacao, local_id, lote, validade
+                )
             
-            if self.controller.register_movement(produto_id, tipo, quantidade, valor_unitario, observacao):
+            if success:
                 self.show_message("✅ Movimentação registrada com sucesso!", ft.Colors.GREEN)
                 self.clear_movement_form(None)
-                self.refresh_movements_table()
-                self.refresh_products_table()
-                self.refresh_reports()
-                
-                # Atualizar dropdown de produtos
-                products = self.controller.get_products()
-                self.produto_movimento_dropdown.options = [
-                    ft.dropdown.Option(prod['id'], f"{prod['nome']} (Estoque: {prod['estoque_atual']})")
-                    for prod in products
-                ]
-                self.page.update()
+                self.refresh_after_movement()
             else:
-                self.show_message("❌ Erro ao registrar movimentação!", ft.Colors.RED)
+                # Saída/transferência recusada por falta de saldo: informa o disponível atual
+                product = self.controller.get_product(produto_id)
+                disponivel = self.controller.get_available_stock(produto_id, local_id)
+                if tipo != 'ENTRADA' and product and disponivel < quantidade:
+                    self.show_message(
+                        f"❌ Estoque insuficiente no local! Disponível: {disponivel} {product.unidade_medida}",
+                        ft.Colors.RED
+                    )
+                else:
+                    self.show_message("❌ Erro ao registrar movimentação!", ft.Colors.RED)
                 
         except ValueError as ve:
             self.show_message("❌ Erro nos dados: Verifique os valores numéricos!", ft.Colors.RED)
@@ -1103,194 +6489,902 @@ class StockControlApp:
         self.quantidade_movimento_field.value = "1"
         self.valor_unitario_movimento_field.value = "0.00"
         self.observacao_movimento_field.value = ""
-        self.page.update()
+        self.lote_movimento_field.value = ""
+        self.validade_movimento_field.value = ""
+        self.local_movimento_dropdown.value = str(DatabaseManager.DEFAULT_LOCATION_ID)
+        self.destino_movimento_dropdown.value = None
+        self.destino_movimento_dropdown.visible = False
+        self.request_update()
+    
+    def on_movement_type_change(self, e):
+        """Exibe o local de destino apenas para transferências"""
+        self.destino_movimento_dropdown.visible = self.tipo_movimento_dropdown.value == 'TRANSFERENCIA'
+        self.request_update()
     
     def refresh_reports(self):
         """Atualiza os dados dos relatórios"""
         if hasattr(self, 'tabs') and len(self.tabs.tabs) > 3:
             self.tabs.tabs[3].content = self.build_reports_tab()
-            self.page.update()
+            self.request_update()
+    
+    def build_reports_tab(self) -> ft.Container:
+        """Constrói a aba de relatórios"""
+        # Relatório de produtos
+        snapshot = self.controller.get_inventory_snapshot()
+        
+        # Estatísticas gerais
+        total_produtos = len(snapshot)
+        produtos_baixo_estoque = snapshot.low_stock_count()
+        valor_total_estoque = snapshot.total_value()
+        
+        # Relatório de movimentações
+        movements = self.controller.get_movements()
+        total_movimentacoes = len(movements)
+        entradas = len([m for m in movements if m.tipo == 'ENTRADA'])
+        saidas = len([m for m in movements if m.tipo == 'SAIDA'])
+        
+        # Cards de estatísticas
+        stats_row1 = ft.Row([
+            self.create_metric_card("Total Produtos", str(total_produtos), ft.Icons.INVENTORY, ft.Colors.BLUE),
+            self.create_metric_card("Estoque Baixo", str(produtos_baixo_estoque), ft.Icons.WARNING, ft.Colors.ORANGE),
+            self.create_metric_card("Valor Total", f"R$ {valor_total_estoque:,.2f}", ft.Icons.ATTACH_MONEY, ft.Colors.GREEN),
+        ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
+        
+        valuation = self.controller.get_valuation_totals()
+        stats_valuation = ft.Row([
+            self.create_metric_card("Custo Médio", f"R$ {valuation['valor_custo_medio']:,.2f}", ft.Icons.CALCULATE, ft.Colors.TEAL),
+            self.create_metric_card("Custo FIFO", f"R$ {valuation['valor_fifo']:,.2f}", ft.Icons.LAYERS, ft.Colors.INDIGO),
+            self.create_metric_card("Valor de Venda", f"R$ {valuation['valor_venda']:,.2f}", ft.Icons.SELL, ft.Colors.GREEN),
+        ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
+        
+        stats_row2 = ft.Row([
+            self.create_metric_card("Total Movimentações", str(total_movimentacoes), ft.Icons.SWAP_HORIZ, ft.Colors.PURPLE),
+            self.create_metric_card("Entradas", str(entradas), ft.Icons.ARROW_DOWNWARD, ft.Colors.GREEN),
+            self.create_metric_card("Saídas", str(saidas), ft.Icons.ARROW_UPWARD, ft.Colors.RED),
+        ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
+        
+        # Tabela de produtos por categoria
+        categories_report = self.create_categories_report()
+        
+        # Tabela de estoque por local
+        locations_report = self.create_locations_report()
+        
+        # Botões de exportação
+        export_buttons = [
+            ft.ElevatedButton(
+                "📄 Exportar Produtos (JSON)",
+                on_click=self.export_products_json,
+                bgcolor=ft.Colors.BLUE,
+                color=ft.Colors.WHITE
+            ),
+            ft.ElevatedButton(
+                "🗄️ Arquivar Anos Fechados",
+                on_click=self.archive_movements_click,
+                bgcolor=ft.Colors.GREY,
+                color=ft.Colors.WHITE
+            ),
+        ]
+        # Exportação e relatório por período rodam em processos que leem o arquivo do banco
+        if self.controller.db.backend.supports_files:
+            export_buttons[1:1] = [
+                ft.ElevatedButton(
+                    "📄 Exportar Movimentações (JSON)",
+                    on_click=self.export_movements_json,
+                    bgcolor=ft.Colors.GREEN,
+                    color=ft.Colors.WHITE
+                ),
+                ft.ElevatedButton(
+                    "📊 Relatório por Período (JSON)",
+                    on_click=self.export_period_report,
+                    bgcolor=ft.Colors.PURPLE,
+                    color=ft.Colors.WHITE
+                ),
+            ]
+        
+        reports_content = ft.Column([
+            ft.Text("📈 Relatórios e Estatísticas", size=20, weight=ft.FontWeight.BOLD),
+            ft.Divider(),
+            ft.Text("📊 Estatísticas Gerais", size=18, weight=ft.FontWeight.BOLD),
+            stats_row1,
+            ft.Container(height=10),  # Espaçamento
+            stats_row2,
+            ft.Divider(),
+            ft.Text("💰 Valorização do Estoque", size=18, weight=ft.FontWeight.BOLD),
+            stats_valuation,
+            ft.Divider(),
+            ft.Text("🔤 Classificação ABC/XYZ", size=18, weight=ft.FontWeight.BOLD),
+            self.create_classification_report(),
+            ft.Divider(),
+            ft.Text("📋 Produtos por Categoria", size=18, weight=ft.FontWeight.BOLD),
+            categories_report,
+            ft.Divider(),
+            ft.Text("🏬 Estoque por Local", size=18, weight=ft.FontWeight.BOLD),
+            locations_report,
+            ft.Divider(),
+            ft.Text("💾 Exportação de Dados", size=18, weight=ft.FontWeight.BOLD),
+            ft.Row(export_buttons),
+            ft.Divider(),
+            ft.Text("⏳ Tarefas em Segundo Plano", size=18, weight=ft.FontWeight.BOLD),
+            self.create_jobs_panel()
+        ], scroll="auto")
+        
+        return ft.Container(content=reports_content, padding=20, expand=True)
+    
+    def create_categories_report(self) -> ft.Container:
+        """Cria relatório de produtos por categoria"""
+        categories = self.controller.get_categories()
+        totals = self.controller.get_inventory_snapshot().totals_by_category()
+        
+        categories_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Categoria", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Qtd Produtos", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Valor Total", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[]
+        )
+        
+        for category in categories:
+            category_totals = totals.get(category['id'], {'count': 0, 'value': 0.0})
+            qtd_produtos = category_totals['count']
+            valor_total = category_totals['value']
+            
+            categories_table.rows.append(
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(category['nome'])),
+                    ft.DataCell(ft.Text(str(qtd_produtos))),
+                    ft.DataCell(ft.Text(f"R$ {valor_total:.2f}")),
+                ])
+            )
+        
+        # Produtos sem categoria
+        sem_categoria = totals.get(InventorySnapshot.NO_CATEGORY)
+        if sem_categoria:
+            qtd_sem_categoria = sem_categoria['count']
+            valor_sem_categoria = sem_categoria['value']
+            categories_table.rows.append(
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text("Sem Categoria")),
+                    ft.DataCell(ft.Text(str(qtd_sem_categoria))),
+                    ft.DataCell(ft.Text(f"R$ {valor_sem_categoria:.2f}")),
+                ])
+            )
+        
+        return ft.Container(content=categories_table, height=300)
+    
+    def create_classification_report(self) -> ft.Container:
+        """Cria a matriz de produtos por classe ABC (valor) e XYZ (variação da demanda)"""
+        summary = self.controller.get_classification_summary()
+        
+        classification_table = ft.DataTable(
+            columns=[ft.DataColumn(ft.Text("Classe", weight=ft.FontWeight.BOLD))] + [
+                ft.DataColumn(ft.Text(xyz, weight=ft.FontWeight.BOLD)) for xyz in "XYZ"
+            ],
+            rows=[
+                ft.DataRow(cells=[ft.DataCell(ft.Text(abc, weight=ft.FontWeight.BOLD))] + [
+                    ft.DataCell(ft.Text(str(summary.get(abc + xyz, 0)))) for xyz in "XYZ"
+                ]) for abc in "ABC"
+            ]
+        )
+        
+        return ft.Container(content=classification_table)
+    
+    def create_locations_report(self) -> ft.Container:
+        """Cria relatório de estoque por local"""
+        totals = self.controller.get_location_totals()
+        
+        locations_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Local", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Qtd Produtos", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Quantidade", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Valor Total", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(location['local_nome'])),
+                    ft.DataCell(ft.Text(str(location['qtd_produtos']))),
+                    ft.DataCell(ft.Text(str(location['quantidade']))),
+                    ft.DataCell(ft.Text(f"R$ {location['valor']:.2f}")),
+                ]) for location in totals['locais']
+            ]
+        )
+        
+        geral = totals['geral']
+        locations_table.rows.append(
+            ft.DataRow(cells=[
+                ft.DataCell(ft.Text("Total Geral", weight=ft.FontWeight.BOLD)),
+                ft.DataCell(ft.Text(str(geral['qtd_produtos']), weight=ft.FontWeight.BOLD)),
+                ft.DataCell(ft.Text(str(geral['quantidade']), weight=ft.FontWeight.BOLD)),
+                ft.DataCell(ft.Text(f"R$ {geral['valor']:.2f}", weight=ft.FontWeight.BOLD)),
+            ])
+        )
+        
+        return ft.Container(content=locations_table)
+    
+    def export_products_json(self, e):
+        """Exporta produtos para JSON (em segundo plano)"""
+        self.enqueue_job('exportar_produtos')
+    
+    def export_movements_json(self, e):
+        """Exporta todo o histórico de movimentações para JSON (em segundo plano)"""
+        self.enqueue_job('exportar_movimentacoes')
+    
+    def export_period_report(self, e):
+        """Gera o relatório mensal por produto (em segundo plano)"""
+        self.enqueue_job('relatorio_periodos')
+    
+    def enqueue_job(self, tipo: str, parametros: Dict[str, Any] = None):
+        """Coloca uma tarefa na fila e acompanha seu andamento"""
+        try:
+            job_id = self.controller.jobs.enqueue(tipo, parametros)
+            self.my_jobs.add(job_id)
+            self.show_message("⏳ Tarefa adicionada à fila. Acompanhe o progresso em Relatórios.", ft.Colors.BLUE)
+        except Exception as ex:
+            self.show_message(f"❌ Erro ao iniciar tarefa: {ex}", ft.Colors.RED)
+    
+    @batched_render
+    def on_job_update(self, job: Dict[str, Any]):
+        """Recebe atualizações da fila de tarefas (threads de execução)"""
+        if hasattr(self, 'jobs_panel'):
+            self.refresh_jobs_panel()
+        
+        if job['id'] in self.my_jobs and job['status'] in ('CONCLUIDO', 'FALHOU', 'CANCELADO'):
+            self.my_jobs.discard(job['id'])
+            if job['status'] == 'CONCLUIDO':
+                self.show_message(f"✅ Tarefa concluída: {job['resultado']}", ft.Colors.GREEN)
+            elif job['status'] == 'FALHOU':
+                self.show_message(f"❌ Tarefa falhou: {job['mensagem']}", ft.Colors.RED)
+    
+    def create_jobs_panel(self) -> ft.Container:
+        """Cria o painel de tarefas em segundo plano"""
+        self.jobs_panel = ft.Column()
+        self.refresh_jobs_panel(update=False)
+        return ft.Container(content=self.jobs_panel)
+    
+    def refresh_jobs_panel(self, update: bool = True):
+        """Atualiza o painel de tarefas"""
+        status_colors = {
+            'PENDENTE': ft.Colors.GREY,
+            'EXECUTANDO': ft.Colors.BLUE,
+            'CONCLUIDO': ft.Colors.GREEN,
+            'FALHOU': ft.Colors.RED,
+            'CANCELADO': ft.Colors.ORANGE,
+        }
+        
+        self.jobs_panel.controls = [
+            ft.Row([
+                ft.Text(f"#{job['id']} {job['tipo']}", width=250, size=12),
+                ft.Container(
+                    content=ft.Text(job['status'], color=ft.Colors.WHITE, size=10),
+                    bgcolor=status_colors.get(job['status'], ft.Colors.GREY),
+                    padding=3,
+                    border_radius=3
+                ),
+                ft.ProgressBar(value=(job['progresso'] or 0) / 100, width=200),
+                ft.Text(job['mensagem'] or '', size=12, width=250),
+                ft.IconButton(
+                    ft.Icons.CANCEL,
+                    tooltip="Cancelar",
+                    visible=job['status'] in ('PENDENTE', 'EXECUTANDO'),
+                    on_click=lambda _, job_id=job['id']: self.controller.jobs.cancel(job_id)
+                )
+            ]) for job in self.controller.jobs.list_jobs(10)
+        ]
+        if update:
+            self.request_update()
+    
+    @batched_render
+    def archive_movements_click(self, e):
+        """Arquiva as movimentações dos anos anteriores"""
+        archived = self.controller.archive_movements()
+        total = sum(archived.values())
+        
+        if total:
+            anos = ', '.join(str(year) for year in sorted(archived))
+            self.show_message(f"✅ {total} movimentações arquivadas ({anos})", ft.Colors.GREEN)
+            self.refresh_movements_table()
+            self.refresh_reports()
+        else:
+            self.show_message("ℹ️ Nenhuma movimentação de anos fechados para arquivar.", ft.Colors.BLUE)
+    
+    def build_diagnostics_tab(self) -> ft.Container:
+        """Constrói a aba de diagnóstico de desempenho do banco"""
+        metrics = self.controller.db.get_metrics()
+        cache = self.controller.db.cache.stats()
+        storage = self.controller.db.storage_stats()
+        total_execucoes = sum(s['count'] for s in metrics['statements'])
+        
+        profiling_switch = ft.Switch(
+            label="Instrumentação de queries ativa",
+            value=metrics['enabled'],
+            on_change=self.toggle_profiling
+        )
+        
+        self.slow_threshold_field = ft.TextField(
+            label="Limite query lenta (ms)",
+            width=200,
+            value=f"{metrics['slow_threshold_ms']:g}"
+        )
+        
+        stats_row = ft.Row([
+            self.create_metric_card("Execuções", str(total_execucoes), ft.Icons.PLAY_ARROW, ft.Colors.BLUE),
+            self.create_metric_card("Queries Lentas", str(len(metrics['slow_queries'])), ft.Icons.WARNING, ft.Colors.ORANGE),
+            self.create_metric_card("Commit Médio", f"{metrics['commits']['avg_ms']:.2f} ms", ft.Icons.SAVE, ft.Colors.GREEN),
+            self.create_metric_card(
+                "Cache Relatórios", f"{cache['taxa_acerto']:.0%} ({cache['bytes'] / 1024:.0f} KB)",
+                ft.Icons.BOLT, ft.Colors.PURPLE
+            ),
+            self.create_metric_card(
+                "Páginas do Banco", f"{storage['page_count']} ({storage['freelist_count']} livres)",
+                ft.Icons.STORAGE, ft.Colors.TEAL
+            ),
+        ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
+        
+        statements_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("SQL", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Execuções", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Média (ms)", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Máx (ms)", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Linhas", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(stmt['sql'][:80], size=12, tooltip=stmt['sql'])),
+                    ft.DataCell(ft.Text(str(stmt['count']), size=12)),
+                    ft.DataCell(ft.Text(f"{stmt['avg_ms']:.2f}", size=12)),
+                    ft.DataCell(ft.Text(f"{stmt['max_ms']:.2f}", size=12)),
+                    ft.DataCell(ft.Text(str(stmt['rows']), size=12)),
+                ]) for stmt in metrics['statements'][:20]
+            ]
+        )
+        
+        slow_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Data", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("SQL", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Tempo (ms)", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Plano", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(slow['timestamp'], size=12)),
+                    ft.DataCell(ft.Text(slow['sql'][:60], size=12, tooltip=slow['sql'])),
+                    ft.DataCell(ft.Text(f"{slow['elapsed_ms']:.2f}", size=12)),
+                    ft.DataCell(ft.Text(' | '.join(slow['plan']), size=12)),
+                ]) for slow in reversed(metrics['slow_queries'])
+            ]
+        )
+        
+        backups_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Data", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Tamanho", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Ações", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(backup['timestamp'].strftime('%d/%m/%Y %H:%M:%S'), size=12)),
+                    ft.DataCell(ft.Text(f"{backup['size'] / 1024:.1f} KB", size=12)),
+                    ft.DataCell(
+                        ft.IconButton(
+                            ft.Icons.RESTORE,
+                            tooltip="Restaurar",
+                            on_click=lambda _, path=backup['path']: self.restore_backup_confirm(path)
+                        )
+                    ),
+                ]) for backup in self.controller.backups.list_backups()[:10]
+            ]
+        )
+        
+        diagnostics_content = ft.Column([
+            ft.Text("🩺 Diagnóstico do Banco de Dados", size=20, weight=ft.FontWeight.BOLD),
+            ft.Divider(),
+            ft.Row([
+                profiling_switch,
+                self.slow_threshold_field,
+                ft.ElevatedButton("🔄 Atualizar", on_click=lambda _: self.refresh_diagnostics()),
+                ft.ElevatedButton(
+                    "🗑️ Zerar Métricas",
+                    on_click=self.reset_metrics,
+                    bgcolor=ft.Colors.GREY,
+                    color=ft.Colors.WHITE
+                ),
+                ft.ElevatedButton(
+                    "🧹 Manutenção do Banco",
+                    on_click=lambda _: self.enqueue_job('manutencao'),
+                    bgcolor=ft.Colors.TEAL,
+                    color=ft.Colors.WHITE
+                ),
+            ]),
+            stats_row,
+            ft.Divider(),
+            ft.Text("📋 Comandos por Tempo Total", size=18, weight=ft.FontWeight.BOLD),
+            statements_table,
+            ft.Divider(),
+            ft.Text("🐢 Queries Lentas", size=18, weight=ft.FontWeight.BOLD),
+            slow_table if metrics['slow_queries'] else ft.Text("✅ Nenhuma query lenta registrada!"),
+            ft.Divider(),
+            ft.Row([
+                ft.Text("💾 Backups", size=18, weight=ft.FontWeight.BOLD),
+                ft.ElevatedButton(
+                    "💾 Criar Backup",
+                    on_click=self.create_backup_click,
+                    bgcolor=ft.Colors.GREEN,
+                    color=ft.Colors.WHITE
+                ),
+            ]),
+            backups_table,
+            ft.Divider(),
+            self.create_replication_panel()
+        ], scroll="auto")
+        
+        return ft.Container(content=diagnostics_content, padding=20, expand=True)
+    
+    def create_replication_panel(self) -> ft.Column:
+        """Exportação e importação dos pacotes de alterações entre lojas"""
+        replication = self.controller.replication
+        self.replication_peer_dropdown = ft.Dropdown(
+            label="Loja de destino (vazio: tudo)",
+            width=260,
+            options=[ft.dropdown.Option(peer['peer_id'], peer['peer_id'][:12]) for peer in replication.get_peers()]
+        )
+        self.replication_file_field = ft.TextField(label="Pacote recebido (.json.gz)", width=360)
+        return ft.Column([
+            ft.Row([
+                ft.Text("🔁 Replicação", size=18, weight=ft.FontWeight.BOLD),
+                ft.Text(f"Nó: {replication.node_id[:12]}", size=12, color=ft.Colors.GREY_400),
+            ]),
+            ft.Row([
+                self.replication_peer_dropdown,
+                ft.ElevatedButton("📤 Exportar Alterações", on_click=self.export_delta_click),
+            ]),
+            ft.Row([
+                self.replication_file_field,
+                ft.ElevatedButton("📥 Importar Pacote", on_click=self.import_delta_click),
+            ])
+        ])
+    
+    def export_delta_click(self, e):
+        """Gera o pacote de alterações para outra loja"""
+        result = self.controller.export_replication_delta(self.replication_peer_dropdown.value or None)
+        if result:
+            self.show_message(
+                f"✅ {result['alteracoes']} alterações ({result['bytes'] / 1024:.1f} KB): {result['arquivo']}",
+                ft.Colors.GREEN
+            )
+        else:
+            self.show_message("❌ Erro ao exportar alterações!", ft.Colors.RED)
+    
+    @batched_render
+    def import_delta_click(self, e):
+        """Aplica um pacote de alterações recebido de outra loja"""
+        path = (self.replication_file_field.value or '').strip()
+        if not path or not os.path.exists(path):
+            self.show_message("❌ Arquivo não encontrado!", ft.Colors.RED)
+            return
+        result = self.controller.import_replication_delta(path)
+        if result is None:
+            self.show_message("❌ Erro ao importar pacote!", ft.Colors.RED)
+            return
+        message = f"✅ {result['aplicadas']} alterações aplicadas, {result['ignoradas']} já conhecidas"
+        if result['pendentes']:
+            message += f", {result['pendentes']} pendentes (aguardando pacote anterior)"
+        if result['conflitos']:
+            message += f", {len(result['conflitos'])} conflito(s) de código: " + '; '.join(result['conflitos'][:3])
+        warn = result['pendentes'] or result['conflitos']
+        self.show_message(message, ft.Colors.ORANGE if warn else ft.Colors.GREEN)
+        self.refresh_products_table()
+        self.refresh_movements_table()
+        self.refresh_diagnostics()
+    
+    def refresh_diagnostics(self):
+        """Atualiza a aba de diagnóstico"""
+        if hasattr(self, 'tabs') and len(self.tabs.tabs) > 4:
+            self.tabs.tabs[4].content = self.build_diagnostics_tab()
+            self.request_update()
+    
+    def toggle_profiling(self, e):
+        """Liga/desliga a instrumentação de queries"""
+        try:
+            if e.control.value:
+                self.controller.db.enable_profiling(float(self.slow_threshold_field.value or 100))
+            else:
+                self.controller.db.disable_profiling()
+            self.refresh_diagnostics()
+        except ValueError:
+            self.show_message("❌ Limite de query lenta inválido!", ft.Colors.RED)
     
-    def build_reports_tab(self) -> ft.Container:
-        """Constrói a aba de relatórios"""
-        # Relatório de produtos
-        products = self.controller.get_products()
-        
-        # Estatísticas gerais
-        total_produtos = len(products)
-        produtos_baixo_estoque = len([p for p in products if p['estoque_atual'] <= p['estoque_minimo']])
-        valor_total_estoque = sum(p['estoque_atual'] * p['preco_venda'] for p in products)
-        
-        # Relatório de movimentações
-        movements = self.controller.get_movements()
-        total_movimentacoes = len(movements)
-        entradas = len([m for m in movements if m['tipo'] == 'ENTRADA'])
-        saidas = len([m for m in movements if m['tipo'] == 'SAIDA'])
-        
-        # Cards de estatísticas
-        stats_row1 = ft.Row([
-            self.create_metric_card("Total Produtos", str(total_produtos), ft.Icons.INVENTORY, ft.Colors.BLUE),
-            self.create_metric_card("Estoque Baixo", str(produtos_baixo_estoque), ft.Icons.WARNING, ft.Colors.ORANGE),
-            self.create_metric_card("Valor Total", f"R$ {valor_total_estoque:,.2f}", ft.Icons.ATTACH_MONEY, ft.Colors.GREEN),
-        ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
+    @batched_render
+    def create_backup_click(self, e):
+        """Cria um backup do banco"""
+        path = self.controller.create_backup()
+        if path:
+            self.show_message(f"✅ Backup criado: {path}", ft.Colors.GREEN)
+            self.refresh_diagnostics()
+        else:
+            self.show_message("❌ Erro ao criar backup!", ft.Colors.RED)
+    
+    def restore_backup_confirm(self, path: str):
+        """Confirma a restauração de um backup"""
+        def restore_confirmed(e):
+            with self.render.batch():
+                self.dialog.open = False
+                if self.controller.restore_backup(path):
+                    self.show_message("✅ Backup restaurado com sucesso!", ft.Colors.GREEN)
+                    self.refresh_products_table()
+                    self.refresh_movements_table()
+                    self.refresh_reports()
+                else:
+                    self.show_message("❌ Erro ao restaurar backup!", ft.Colors.RED)
         
-        stats_row2 = ft.Row([
-            self.create_metric_card("Total Movimentações", str(total_movimentacoes), ft.Icons.SWAP_HORIZ, ft.Colors.PURPLE),
-            self.create_metric_card("Entradas", str(entradas), ft.Icons.ARROW_DOWNWARD, ft.Colors.GREEN),
-            self.create_metric_card("Saídas", str(saidas), ft.Icons.ARROW_UPWARD, ft.Colors.RED),
-        ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
+        self.dialog = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("⚠️ Confirmar Restauração", size=18, weight=ft.FontWeight.BOLD),
+            content=ft.Text(
+                f"Restaurar o backup:\n\n{os.path.basename(path)}?\n\nAs alterações posteriores serão perdidas.",
+                size=14
+            ),
+            actions=[
+                ft.TextButton("❌ Cancelar", on_click=lambda e: self.close_dialog()),
+                ft.TextButton(
+                    "♻️ Restaurar",
+                    on_click=restore_confirmed,
+                    style=ft.ButtonStyle(color=ft.Colors.RED)
+                ),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        self.open_dialog(self.dialog)
+    
+    def reset_metrics(self, e):
+        """Zera as métricas coletadas"""
+        self.controller.db.metrics.reset()
+        self.refresh_diagnostics()
+    
+    def build_purchasing_tab(self) -> ft.Container:
+        """Constrói a aba de compras (reposição e pedidos)"""
+        suggestions = self.controller.purchasing.get_suggestions()
+        open_orders = self.controller.purchasing.get_open_orders()
         
-        # Tabela de produtos por categoria
-        categories_report = self.create_categories_report()
+        suggestions_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Fornecedor", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Produto", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Estoque", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Em Pedido", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Comprar", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(suggestion['fornecedor_nome'] or 'Sem fornecedor')),
+                    ft.DataCell(ft.Text(suggestion['produto_nome'])),
+                    ft.DataCell(ft.Text(f"{suggestion['estoque_atual']} / {suggestion['estoque_minimo']}")),
+                    ft.DataCell(ft.Text(str(suggestion['em_pedido']))),
+                    ft.DataCell(ft.Text(str(suggestion['quantidade']))),
+                ]) for suggestion in suggestions[:50]
+            ]
+        )
         
-        # Botões de exportação
-        export_buttons = ft.Row([
-            ft.ElevatedButton(
-                "📄 Exportar Produtos (JSON)",
-                on_click=self.export_products_json,
-                bgcolor=ft.Colors.BLUE,
-                color=ft.Colors.WHITE
-            ),
-            ft.ElevatedButton(
-                "📄 Exportar Movimentações (JSON)",
-                on_click=self.export_movements_json,
-                bgcolor=ft.Colors.GREEN,
-                color=ft.Colors.WHITE
-            ),
-        ])
+        orders_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Pedido", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Fornecedor", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Itens", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Valor", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Ações", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
+                ft.DataRow(cells=[
+                    ft.DataCell(ft.Text(f"#{order['id']}")),
+                    ft.DataCell(ft.Text(order['fornecedor_nome'])),
+                    ft.DataCell(ft.Text(str(order['qtd_itens']))),
+                    ft.DataCell(ft.Text(f"R$ {order['valor_total']:.2f}")),
+                    ft.DataCell(
+                        ft.Row([
+                            ft.IconButton(
+                                ft.Icons.MOVE_TO_INBOX,
+                                tooltip="Receber",
+                                on_click=lambda _, oid=order['id']: self.receive_order_click(oid)
+                            ),
+                            ft.IconButton(
+                                ft.Icons.CANCEL,
+                                tooltip="Cancelar",
+                                on_click=lambda _, oid=order['id']: self.cancel_order_click(oid)
+                            )
+                        ])
+                    ),
+                ]) for order in open_orders
+            ]
+        )
         
-        reports_content = ft.Column([
-            ft.Text("📈 Relatórios e Estatísticas", size=20, weight=ft.FontWeight.BOLD),
-            ft.Divider(),
-            ft.Text("📊 Estatísticas Gerais", size=18, weight=ft.FontWeight.BOLD),
-            stats_row1,
-            ft.Container(height=10),  # Espaçamento
-            stats_row2,
+        purchasing_content = ft.Column([
+            ft.Text("🛒 Compras e Reposição", size=20, weight=ft.FontWeight.BOLD),
             ft.Divider(),
-            ft.Text("📋 Produtos por Categoria", size=18, weight=ft.FontWeight.BOLD),
-            categories_report,
+            ft.Row([
+                ft.Text(f"📋 Sugestões de Reposição ({len(suggestions)})", size=18, weight=ft.FontWeight.BOLD),
+                ft.ElevatedButton(
+                    "🧾 Gerar Pedidos",
+                    on_click=self.generate_orders_click,
+                    bgcolor=ft.Colors.GREEN,
+                    color=ft.Colors.WHITE
+                ),
+            ]),
+            suggestions_table if suggestions else ft.Text("✅ Nenhum produto precisa de reposição!"),
             ft.Divider(),
-            ft.Text("💾 Exportação de Dados", size=18, weight=ft.FontWeight.BOLD),
-            export_buttons
+            ft.Text("📦 Pedidos em Aberto", size=18, weight=ft.FontWeight.BOLD),
+            orders_table if open_orders else ft.Text("Nenhum pedido em aberto.")
         ], scroll="auto")
         
-        return ft.Container(content=reports_content, padding=20, expand=True)
+        return ft.Container(content=purchasing_content, padding=20, expand=True)
     
-    def create_categories_report(self) -> ft.Container:
-        """Cria relatório de produtos por categoria"""
-        categories = self.controller.get_categories()
-        products = self.controller.get_products()
+    def refresh_purchasing(self):
+        """Atualiza a aba de compras"""
+        if hasattr(self, 'tabs') and len(self.tabs.tabs) > 5:
+            self.tabs.tabs[5].content = self.build_purchasing_tab()
+            self.request_update()
+    
+    @batched_render
+    def generate_orders_click(self, e):
+        """Gera os pedidos de compra das sugestões"""
+        order_ids = self.controller.generate_purchase_orders()
+        if order_ids:
+            self.show_message(f"✅ {len(order_ids)} pedido(s) de compra gerado(s)!", ft.Colors.GREEN)
+        else:
+            self.show_message("ℹ️ Nenhum pedido gerado (sem sugestões com fornecedor).", ft.Colors.BLUE)
+        self.refresh_purchasing()
+    
+    @batched_render
+    def receive_order_click(self, order_id: int):
+        """Recebe um pedido de compra"""
+        if self.controller.receive_purchase_order(order_id):
+            self.show_message(f"✅ Pedido #{order_id} recebido!", ft.Colors.GREEN)
+            self.refresh_purchasing()
+            self.refresh_products_table()
+            self.refresh_movements_table()
+            self.refresh_reports()
+        else:
+            self.show_message("❌ Erro ao receber pedido!", ft.Colors.RED)
+    
+    @batched_render
+    def cancel_order_click(self, order_id: int):
+        """Cancela um pedido de compra"""
+        if self.controller.purchasing.cancel_order(order_id):
+            self.show_message(f"✅ Pedido #{order_id} cancelado!", ft.Colors.GREEN)
+            self.refresh_purchasing()
+        else:
+            self.show_message("❌ Erro ao cancelar pedido!", ft.Colors.RED)
+    
+    def build_counting_tab(self) -> ft.Container:
+        """Constrói a aba de inventário (contagens físicas)"""
+        sessions = self.controller.counts.get_open_sessions()
+        if self.selected_count_id not in {session['id'] for session in sessions}:
+            self.selected_count_id = None
         
-        categories_table = ft.DataTable(
+        self.contagem_local_dropdown = ft.Dropdown(
+            label="Local",
+            width=200,
+            value=str(DatabaseManager.DEFAULT_LOCATION_ID),
+            options=[ft.dropdown.Option(loc['id'], loc['nome']) for loc in self.controller.get_locations()]
+        )
+        
+        sessions_table = ft.DataTable(
             columns=[
-                ft.DataColumn(ft.Text("Categoria", weight=ft.FontWeight.BOLD)),
-                ft.DataColumn(ft.Text("Qtd Produtos", weight=ft.FontWeight.BOLD)),
-                ft.DataColumn(ft.Text("Valor Total", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Contagem", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Local", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Contados", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Ações", weight=ft.FontWeight.BOLD)),
             ],
-            rows=[]
+            rows=[
+                ft.DataRow(
+                    selected=session['id'] == self.selected_count_id,
+                    cells=[
+                        ft.DataCell(ft.Text(f"#{session['id']}")),
+                        ft.DataCell(ft.Text(session['local_nome'])),
+                        ft.DataCell(ft.Text(f"{session['qtd_contados']} / {session['qtd_itens']}")),
+                        ft.DataCell(
+                            ft.Row([
+                                ft.IconButton(
+                                    ft.Icons.EDIT_NOTE,
+                                    tooltip="Registrar contagem",
+                                    on_click=lambda _, cid=session['id']: self.select_count_click(cid)
+                                ),
+                                ft.IconButton(
+                                    ft.Icons.CANCEL,
+                                    tooltip="Cancelar",
+                                    on_click=lambda _, cid=session['id']: self.cancel_count_click(cid)
+                                )
+                            ])
+                        ),
+                    ]
+                ) for session in sessions
+            ]
         )
         
-        for category in categories:
-            category_products = [p for p in products if p['categoria_id'] == category['id']]
-            qtd_produtos = len(category_products)
-            valor_total = sum(p['estoque_atual'] * p['preco_venda'] for p in category_products)
-            
-            categories_table.rows.append(
-                ft.DataRow(cells=[
-                    ft.DataCell(ft.Text(category['nome'])),
-                    ft.DataCell(ft.Text(str(qtd_produtos))),
-                    ft.DataCell(ft.Text(f"R$ {valor_total:.2f}")),
-                ])
-            )
+        counting_content = ft.Column([
+            ft.Text("📋 Inventário (Contagem Física)", size=20, weight=ft.FontWeight.BOLD),
+            ft.Divider(),
+            ft.Row([
+                self.contagem_local_dropdown,
+                ft.ElevatedButton(
+                    "📋 Iniciar Contagem",
+                    on_click=self.start_count_click,
+                    bgcolor=ft.Colors.GREEN,
+                    color=ft.Colors.WHITE
+                ),
+            ]),
+            sessions_table if sessions else ft.Text("Nenhuma contagem em aberto."),
+        ], scroll="auto")
         
-        # Produtos sem categoria
-        sem_categoria = [p for p in products if not p['categoria_id']]
-        if sem_categoria:
-            qtd_sem_categoria = len(sem_categoria)
-            valor_sem_categoria = sum(p['estoque_atual'] * p['preco_venda'] for p in sem_categoria)
-            categories_table.rows.append(
+        if self.selected_count_id:
+            counting_content.controls.extend(self.create_count_session_panel(self.selected_count_id))
+        
+        return ft.Container(content=counting_content, padding=20, expand=True)
+    
+    def create_count_session_panel(self, count_id: int) -> List[ft.Control]:
+        """Leitura, importação e divergências de uma contagem aberta"""
+        variances = self.controller.counts.get_variances(count_id)
+        
+        self.contagem_leitura_field = ft.TextField(
+            label="📷 Leitura (SKU/EAN)",
+            width=300,
+            on_submit=self.count_scan_submit
+        )
+        self.contagem_importacao_field = ft.TextField(
+            label="Importar (uma linha por produto: código;quantidade)",
+            width=500,
+            multiline=True,
+            min_lines=3,
+            max_lines=8
+        )
+        
+        variances_table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Produto", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Congelado", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Contado", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Diferença", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[
                 ft.DataRow(cells=[
-                    ft.DataCell(ft.Text("Sem Categoria")),
-                    ft.DataCell(ft.Text(str(qtd_sem_categoria))),
-                    ft.DataCell(ft.Text(f"R$ {valor_sem_categoria:.2f}")),
-                ])
-            )
+                    ft.DataCell(ft.Text(variance['produto_nome'])),
+                    ft.DataCell(ft.Text(str(variance['estoque_congelado']))),
+                    ft.DataCell(ft.Text(str(variance['quantidade_contada']))),
+                    ft.DataCell(ft.Text(
+                        f"{variance['diferenca']:+d}",
+                        color=ft.Colors.GREEN if variance['diferenca'] > 0 else ft.Colors.RED
+                    )),
+                ]) for variance in variances[:100]
+            ]
+        )
         
-        return ft.Container(content=categories_table, height=300)
+        return [
+            ft.Divider(),
+            ft.Text(f"📝 Contagem #{count_id}", size=18, weight=ft.FontWeight.BOLD),
+            ft.Row([self.contagem_leitura_field]),
+            ft.Row([
+                self.contagem_importacao_field,
+                ft.ElevatedButton("📥 Importar", on_click=self.import_counts_click)
+            ]),
+            ft.Row([
+                ft.Text(f"⚠️ Divergências ({len(variances)})", size=16, weight=ft.FontWeight.BOLD),
+                ft.ElevatedButton(
+                    "✅ Aprovar Ajustes",
+                    on_click=lambda _: self.post_count_click(count_id),
+                    bgcolor=ft.Colors.BLUE,
+                    color=ft.Colors.WHITE
+                ),
+            ]),
+            variances_table if variances else ft.Text("Nenhuma divergência até agora.")
+        ]
     
-    def export_products_json(self, e):
-        """Exporta produtos para JSON"""
-        try:
-            products = self.controller.get_products()
-            products_data = []
-            
-            for product in products:
-                products_data.append({
-                    'id': product['id'],
-                    'nome': product['nome'],
-                    'descricao': product['descricao'],
-                    'categoria': product['categoria_nome'],
-                    'fornecedor': product['fornecedor_nome'],
-                    'preco_compra': product['preco_compra'],
-                    'preco_venda': product['preco_venda'],
-                    'estoque_atual': product['estoque_atual'],
-                    'estoque_minimo': product['estoque_minimo'],
-                    'estoque_maximo': product['estoque_maximo'],
-                    'unidade_medida': product['unidade_medida'],
-                    'status_estoque': product['status_estoque']
-                })
-            
-            # Salvar arquivo
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'data/produtos_export_{timestamp}.json'
-            
-            os.makedirs('data', exist_ok=True)
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(products_data, f, ensure_ascii=False, indent=2)
-            
-            self.show_message(f"✅ Produtos exportados para: {filename}", ft.Colors.GREEN)
-            
-        except Exception as ex:
-            self.show_message(f"❌ Erro ao exportar: {ex}", ft.Colors.RED)
+    def refresh_counting(self):
+        """Atualiza a aba de inventário"""
+        if hasattr(self, 'tabs') and len(self.tabs.tabs) > 6:
+            self.tabs.tabs[6].content = self.build_counting_tab()
+            self.request_update()
     
-    def export_movements_json(self, e):
-        """Exporta movimentações para JSON"""
+    @batched_render
+    def start_count_click(self, e):
+        """Abre uma contagem no local selecionado"""
+        local_id = int(self.contagem_local_dropdown.value or DatabaseManager.DEFAULT_LOCATION_ID)
+        count_id = self.controller.start_count(local_id)
+        if count_id:
+            self.selected_count_id = count_id
+            self.refresh_counting()
+        else:
+            self.show_message("❌ Erro ao iniciar contagem!", ft.Colors.RED)
+    
+    @batched_render
+    def select_count_click(self, count_id: int):
+        self.selected_count_id = count_id
+        self.refresh_counting()
+    
+    @batched_render
+    def count_scan_submit(self, e):
+        """Cada leitura soma uma unidade ao produto na contagem"""
+        code = (self.contagem_leitura_field.value or '').strip()
+        if not code or not self.selected_count_id:
+            return
+        result = self.controller.counts.record_codes(self.selected_count_id, [code])
+        if result['codigos_desconhecidos']:
+            self.show_message(f"❌ Código não encontrado: {code}", ft.Colors.RED)
+            return
+        self.refresh_counting()
+        self.contagem_leitura_field.focus()
+    
+    @batched_render
+    def import_counts_click(self, e):
+        """Importa quantidades contadas no formato código;quantidade"""
+        counts, invalid = {}, []
+        for line in (self.contagem_importacao_field.value or '').splitlines():
+            if not line.strip():
+                continue
+            code, _, quantidade = line.replace(',', ';').partition(';')
+            product_id = self.controller.codes.lookup(code)
+            if product_id is None or not quantidade.strip().isdigit():
+                invalid.append(line.strip())
+                continue
+            counts[product_id] = int(quantidade)
+        
         try:
-            movements = self.controller.get_movements()
-            movements_data = []
-            
-            for movement in movements:
-                movements_data.append({
-                    'id': movement['id'],
-                    'produto': movement['produto_nome'],
-                    'tipo': movement['tipo'],
-                    'quantidade': movement['quantidade'],
-                    'valor_unitario': movement['valor_unitario'],
-                    'valor_total': movement['valor_total'],
-                    'observacao': movement['observacao'],
-                    'data_movimentacao': movement['data_movimentacao'],
-                    'usuario': movement['usuario']
-                })
-            
-            # Salvar arquivo
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'data/movimentacoes_export_{timestamp}.json'
-            
-            os.makedirs('data', exist_ok=True)
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(movements_data, f, ensure_ascii=False, indent=2)
-            
-            self.show_message(f"✅ Movimentações exportadas para: {filename}", ft.Colors.GREEN)
-            
+            result = self.controller.counts.record_counts(self.selected_count_id, counts)
         except Exception as ex:
-            self.show_message(f"❌ Erro ao exportar: {ex}", ft.Colors.RED)
+            self.show_message(f"❌ Erro ao importar contagem: {ex}", ft.Colors.RED)
+            return
+        
+        self.refresh_counting()
+        if invalid or result['ignorados']:
+            self.show_message(
+                f"⚠️ {result['atualizados']} produto(s) importado(s); "
+                f"{len(invalid) + len(result['ignorados'])} linha(s) ignorada(s).",
+                ft.Colors.ORANGE
+            )
+    
+    @batched_render
+    def post_count_click(self, count_id: int):
+        """Aprova os ajustes da contagem"""
+        posted = self.controller.post_count_adjustments(count_id)
+        if posted is None:
+            self.show_message("❌ Erro ao lançar ajustes da contagem!", ft.Colors.RED)
+            return
+        self.selected_count_id = None
+        self.show_message(f"✅ Contagem #{count_id} fechada com {posted} ajuste(s)!", ft.Colors.GREEN)
+        self.refresh_counting()
+        self.refresh_products_table()
+        self.refresh_movements_table()
+        self.refresh_reports()
+    
+    @batched_render
+    def cancel_count_click(self, count_id: int):
+        """Cancela uma contagem aberta"""
+        if self.controller.counts.cancel(count_id):
+            self.show_message(f"✅ Contagem #{count_id} cancelada!", ft.Colors.GREEN)
+            self.refresh_counting()
+        else:
+            self.show_message("❌ Erro ao cancelar contagem!", ft.Colors.RED)
+    
+    def request_update(self):
+        """Pede a atualização da tela (enviada uma vez por quadro/ação)"""
+        self.render.request()
+    
+    def open_dialog(self, dialog: ft.AlertDialog):
+        """Abre um AlertDialog, descartando os diálogos já fechados da página"""
+        self.page.controls[:] = [
+            control for control in self.page.controls
+            if not (isinstance(control, ft.AlertDialog) and not control.open)
+        ]
+        self.dialog = dialog
+        dialog.open = True
+        self.page.controls.append(dialog)
+        self.request_update()
     
     def close_dialog(self):
         """Fecha o AlertDialog atual"""
         if self.dialog:
             self.dialog.open = False
-            self.dialog.update()
-            self.page.update()
+            self.request_update()
         
     def show_message(self, message: str, color=ft.Colors.BLUE):
         """Exibe as mensagens usando AlertDialog"""
@@ -1304,11 +7398,9 @@ class StockControlApp:
             actions_alignment=ft.MainAxisAlignment.END,
         )
 
-        if not self.dialog.open:
-            self.dialog.open = True
-        self.page.add(self.dialog)
-        self.page.update()
+        self.open_dialog(self.dialog)
         
+    @batched_render
     def on_tab_change(self, e):
         """Callback para mudança de aba"""
         # Atualizar dados quando necessário
@@ -1320,20 +7412,444 @@ class StockControlApp:
             products = self.controller.get_products()
             if hasattr(self, 'produto_movimento_dropdown'):
                 self.produto_movimento_dropdown.options = [
-                    ft.dropdown.Option(prod['id'], f"{prod['nome']} (Estoque: {prod['estoque_atual']})")
+                    ft.dropdown.Option(prod.id, f"{prod.nome} (Estoque: {prod.estoque_atual})")
                     for prod in products
                 ]
         elif e.control.selected_index == 3:  # Relatórios
             # Reconstruir relatórios com dados atualizados
             self.tabs.tabs[3].content = self.build_reports_tab()
+        elif e.control.selected_index == 4:  # Diagnóstico
+            self.tabs.tabs[4].content = self.build_diagnostics_tab()
+        elif e.control.selected_index == 5:  # Compras
+            self.tabs.tabs[5].content = self.build_purchasing_tab()
+        elif e.control.selected_index == 6:  # Inventário
+            self.tabs.tabs[6].content = self.build_counting_tab()
         
-        self.page.update()
+        self.request_update()
+
+class HeadlessPage:
+    """Página sem interface para sessões simuladas (testes de carga)
+    
+    Recebe as mesmas propriedades de configuração da ft.Page e só conta
+    as atualizações que seriam enviadas ao navegador.
+    """
+    
+    def __init__(self):
+        self.controls = []
+        self.updates = 0
+    
+    def add(self, *controls):
+        self.controls.extend(controls)
+        self.update()
+    
+    def update(self, *controls):
+        self.updates += 1
+
+class LoadTestRunner:
+    """Gerador de carga: várias sessões simultâneas sobre o mesmo DatabaseManager
+    
+    Cada sessão (thread ou tarefa asyncio) sorteia operações conforme as
+    proporções de escrita e de tela: leituras e gravações chamam o
+    ProductController compartilhado, e as operações de tela passam pelos
+    handlers de uma StockControlApp própria, sobre uma HeadlessPage (e
+    fechada ao fim). Exceções são contadas no relatório, que traz
+    latência (p50/p95/p99) e espera pelo lock de escrita por operação,
+    além da vazão, e pode ser comparado com o de outra execução.
+    """
+    
+    MODES = ('threads', 'asyncio')
+    READ_OPERATIONS = (
+        'listar_produtos', 'buscar_codigo', 'estoque_baixo',
+        'historico_produto', 'totais_locais', 'disponivel'
+    )
+    WRITE_OPERATIONS = ('entrada', 'saida', 'reserva')
+    UI_OPERATIONS = ('tela_movimentacao', 'tela_produtos')
+    CODE_PREFIX = 'CARGA-'
+    INITIAL_STOCK = 100000
+    
+    def __init__(self, db: DatabaseManager, sessions: int = 50, duration: float = 30.0,
+                 mode: str = 'threads', write_ratio: float = 0.2, ui_ratio: float = 0.1,
+                 think_ms: float = 0.0, products: int = 500, seed: int = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Modo inválido: {mode} (use {' ou '.join(self.MODES)})")
+        if write_ratio < 0 or ui_ratio < 0 or write_ratio + ui_ratio > 1:
+            raise ValueError("As proporções de escrita e de tela devem somar no máximo 1")
+        
+        self.db = db
+        self.controller = ProductController(db)
+        self.sessions = sessions
+        self.duration = duration
+        self.mode = mode
+        self.write_ratio = write_ratio
+        self.ui_ratio = ui_ratio
+        self.think_ms = think_ms
+        self.products = products
+        self.seed = seed if seed is not None else int(time.time())
+        self.product_ids = []
+        self._samples = {}
+        self._errors = {}
+        self._exceptions = {}  # operação -> (quantidade, última mensagem)
+        self._samples_lock = threading.Lock()
+    
+    def prepare(self):
+        """Cadastra os produtos de carga com estoque inicial (só os que faltam)"""
+        rows = self.db.execute_query(
+            'SELECT id FROM produtos WHERE sku LIKE ? AND ativo = 1 ORDER BY sku',
+            (self.CODE_PREFIX + '%',)
+        )
+        self.product_ids = [row['id'] for row in rows]
+        
+        for index in range(len(self.product_ids), self.products):
+            code = self.code(index)
+            self.controller.create_product({
+                'nome': f'Produto de carga {index:05d}',
+                'sku': code,
+                'preco_compra': 5.0,
+                'preco_venda': 8.0,
+                'estoque_minimo': 10,
+                'estoque_maximo': self.INITIAL_STOCK * 2,
+                'estoque_atual': self.INITIAL_STOCK
+            })
+            self.product_ids.append(self.controller.codes.lookup(code))
+        self.product_ids = self.product_ids[:self.products]
+    
+    def code(self, index: int) -> str:
+        return f'{self.CODE_PREFIX}{index:05d}'
+    
+    def new_session(self, number: int) -> Dict[str, Any]:
+        """Sessão simulada: gerador próprio e, se houver operações de tela, uma app sem interface"""
+        app = None
+        if self.ui_ratio > 0:
+            app = StockControlApp(HeadlessPage(), self.controller)
+        return {'id': number, 'rng': random.Random(self.seed + number), 'app': app}
+    
+    def choose(self, rng: random.Random) -> str:
+        draw = rng.random()
+        if draw < self.ui_ratio:
+            return rng.choice(self.UI_OPERATIONS)
+        if draw < self.ui_ratio + self.write_ratio:
+            return rng.choice(self.WRITE_OPERATIONS)
+        return rng.choice(self.READ_OPERATIONS)
+    
+    def operate(self, session: Dict[str, Any], name: str) -> bool:
+        """Executa uma operação; False indica falha (erro ou recusa)"""
+        controller = self.controller
+        rng = session['rng']
+        index = rng.randrange(len(self.product_ids))
+        product_id = self.product_ids[index]
+        
+        if name == 'listar_produtos':
+            controller.get_products()
+        elif name == 'buscar_codigo':
+            return controller.find_product_by_code(self.code(index)) is not None
+        elif name == 'estoque_baixo':
+            controller.get_low_stock_products(10)
+        elif name == 'historico_produto':
+            controller.get_movements(product_id)
+        elif name == 'totais_locais':
+            controller.get_location_totals()
+        elif name == 'disponivel':
+            controller.get_available_stock(product_id)
+        elif name == 'entrada':
+            return controller.register_movement(product_id, 'ENTRADA', rng.randint(1, 10), 5.0, 'Carga')
+        elif name == 'saida':
+            quantidade = rng.randint(1, 5)
+            if controller.get_available_stock(product_id) < quantidade:
+                return False
+            return controller.register_movement(product_id, 'SAIDA', quantidade, 8.0, 'Carga')
+        elif name == 'reserva':
+            reservation_id = controller.reserve_stock(product_id, 1, referencia='Carga')
+            return reservation_id is not None and controller.release_reservation(reservation_id)
+        elif name == 'tela_movimentacao':
+            app = session['app']
+            app.produto_movimento_dropdown.value = str(product_id)
+            app.tipo_movimento_dropdown.value = rng.choice(('ENTRADA', 'SAIDA'))
+            app.quantidade_movimento_field.value = str(rng.randint(1, 5))
+            app.valor_unitario_movimento_field.value = '5.0'
+            app.observacao_movimento_field.value = 'Carga (tela)'
+            app.local_movimento_dropdown.value = str(DatabaseManager.DEFAULT_LOCATION_ID)
+            app.destino_movimento_dropdown.value = None
+            app.lote_movimento_field.value = ''
+            app.validade_movimento_field.value = ''
+            app.register_movement_click(None)
+        elif name == 'tela_produtos':
+            session['app'].refresh_products_table()
+        else:
+            raise ValueError(f"Operação desconhecida: {name}")
+        return True
+    
+    def execute(self, session: Dict[str, Any], name: str) -> tuple:
+        """Roda a operação na thread atual e devolve (sucesso, espera pelo lock em ms, erro)"""
+        wait_start = self.db.lock_wait_ms()
+        error = None
+        try:
+            ok = bool(self.operate(session, name))
+        except Exception as e:
+            # Sob carga não imprime a cada falha: o relatório conta e guarda a última mensagem
+            ok, error = False, f'{type(e).__name__}: {e}'
+        return ok, self.db.lock_wait_ms() - wait_start, error
+    
+    def record(self, name: str, latency_ms: float, wait_ms: float, ok: bool, error: str = None):
+        with self._samples_lock:
+            self._samples.setdefault(name, []).append((latency_ms, wait_ms))
+            if not ok:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            if error is not None:
+                count, _ = self._exceptions.get(name, (0, None))
+                self._exceptions[name] = (count + 1, error)
+    
+    def _think(self, rng: random.Random) -> float:
+        return rng.uniform(0, 2 * self.think_ms) / 1000 if self.think_ms else 0.0
+    
+    def _run_threads(self, sessions: List[Dict[str, Any]], deadline: float):
+        def worker(session):
+            while time.perf_counter() < deadline:
+                name = self.choose(session['rng'])
+                start = time.perf_counter()
+                ok, wait_ms, error = self.execute(session, name)
+                self.record(name, (time.perf_counter() - start) * 1000, wait_ms, ok, error)
+                time.sleep(self._think(session['rng']))
+        
+        threads = [
+            threading.Thread(target=worker, args=(session,), name=f"carga-{session['id']}", daemon=True)
+            for session in sessions
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    
+    def _run_asyncio(self, sessions: List[Dict[str, Any]], deadline: float):
+        # Como o Flet com handlers síncronos: a tarefa espera a operação no pool de threads
+        # padrão do loop, então a latência inclui a fila do pool
+        async def task(session):
+            while time.perf_counter() < deadline:
+                name = self.choose(session['rng'])
+                start = time.perf_counter()
+                ok, wait_ms, error = await asyncio.to_thread(self.execute, session, name)
+                self.record(name, (time.perf_counter() - start) * 1000, wait_ms, ok, error)
+                await asyncio.sleep(self._think(session['rng']))
+        
+        async def run_all():
+            await asyncio.gather(*(task(session) for session in sessions))
+        
+        asyncio.run(run_all())
+    
+    def run(self) -> Dict[str, Any]:
+        """Prepara os dados, executa a carga pelo tempo configurado e monta o relatório"""
+        if not self.product_ids:
+            self.prepare()
+        sessions = [self.new_session(number) for number in range(self.sessions)]
+        self._samples.clear()
+        self._errors.clear()
+        self._exceptions.clear()
+        self.db.reset_lock_stats()
+        cache_before = self.db.cache.stats()
+        
+        started_at = datetime.now()
+        start = time.perf_counter()
+        try:
+            if self.mode == 'threads':
+                self._run_threads(sessions, start + self.duration)
+            else:
+                self._run_asyncio(sessions, start + self.duration)
+        finally:
+            for session in sessions:
+                if session['app'] is not None:
+                    session['app'].close()
+        elapsed = time.perf_counter() - start
+        
+        return self.build_report(started_at, elapsed, sessions, cache_before)
+    
+    @staticmethod
+    def percentile(values: List[float], percent: float) -> float:
+        """Percentil pelo posto mais próximo (values já ordenados)"""
+        if not values:
+            return 0.0
+        rank = max(1, math.ceil(percent / 100 * len(values)))
+        return values[min(rank, len(values)) - 1]
+    
+    def build_report(self, started_at: datetime, elapsed: float, sessions: List[Dict[str, Any]],
+                     cache_before: Dict[str, Any]) -> Dict[str, Any]:
+        operations = {}
+        total = 0
+        for name, samples in sorted(self._samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            waits = [sample[1] for sample in samples]
+            total += len(samples)
+            exceptions, last_error = self._exceptions.get(name, (0, None))
+            operations[name] = {
+                'quantidade': len(samples),
+                'erros': self._errors.get(name, 0),
+                'excecoes': exceptions,
+                'ultimo_erro': last_error,
+                'ops_s': round(len(samples) / elapsed, 2),
+                'media_ms': round(sum(latencies) / len(latencies), 3),
+                'p50_ms': round(self.percentile(latencies, 50), 3),
+                'p95_ms': round(self.percentile(latencies, 95), 3),
+                'p99_ms': round(self.percentile(latencies, 99), 3),
+                'max_ms': round(latencies[-1], 3),
+                'espera_lock_media_ms': round(sum(waits) / len(waits), 3),
+                'espera_lock_max_ms': round(max(waits), 3),
+            }
+        
+        apps = [session['app'] for session in sessions if session['app'] is not None]
+        cache_after = self.db.cache.stats()
+        return {
+            'inicio': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'configuracao': {
+                'banco': self.db.backend.name,
+                'modo': self.mode,
+                'sessoes': self.sessions,
+                'duracao_s': self.duration,
+                'proporcao_escrita': self.write_ratio,
+                'proporcao_tela': self.ui_ratio,
+                'pausa_ms': self.think_ms,
+                'produtos': len(self.product_ids),
+                'semente': self.seed,
+            },
+            'duracao_real_s': round(elapsed, 3),
+            'operacoes': total,
+            'erros': sum(self._errors.values()),
+            'excecoes': sum(count for count, _ in self._exceptions.values()),
+            'vazao_ops_s': round(total / elapsed, 2),
+            'lock_escrita': self.db.lock_stats(),
+            'cache': {
+                'acertos': cache_after['acertos'] - cache_before['acertos'],
+                'falhas': cache_after['falhas'] - cache_before['falhas'],
+            },
+            'telas': {
+                'pedidos_atualizacao': sum(app.render.requests for app in apps),
+                'atualizacoes_enviadas': sum(app.page.updates for app in apps),
+            },
+            'por_operacao': operations,
+        }
+    
+    def save_report(self, report: Dict[str, Any], filename: str = None) -> str:
+        """Grava o relatório em JSON (padrão: data/carga/carga_<data>.json)"""
+        if filename is None:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = os.path.join(self.db.data_dir, 'carga', f'carga_{timestamp}.json')
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return filename
+    
+    @staticmethod
+    def compare(base: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Variação (%) de vazão, p50 e p99 por operação entre dois relatórios"""
+        def change(old, new):
+            return round((new - old) / old * 100, 1) if old else None
+        
+        rows = []
+        names = sorted(set(base['por_operacao']) | set(current['por_operacao']))
+        for name in names:
+            old = base['por_operacao'].get(name)
+            new = current['por_operacao'].get(name)
+            if not old or not new:
+                continue
+            rows.append({
+                'operacao': name,
+                'ops_s': change(old['ops_s'], new['ops_s']),
+                'p50_ms': change(old['p50_ms'], new['p50_ms']),
+                'p99_ms': change(old['p99_ms'], new['p99_ms']),
+            })
+        rows.append({
+            'operacao': 'TOTAL',
+            'ops_s': change(base['vazao_ops_s'], current['vazao_ops_s']),
+            'p50_ms': None,
+            'p99_ms': None,
+        })
+        return rows
+    
+    @classmethod
+    def format_report(cls, report: Dict[str, Any], base: Dict[str, Any] = None) -> str:
+        """Resumo em texto do relatório (e da comparação, se houver base)"""
+        config = report['configuracao']
+        lock = report['lock_escrita']
+        lines = [
+            f"📊 Carga: {config['sessoes']} sessões ({config['modo']}), {report['duracao_real_s']:.1f} s, "
+            f"escrita {config['proporcao_escrita']:.0%}, tela {config['proporcao_tela']:.0%}",
+            f"   {report['operacoes']} operações, {report['vazao_ops_s']:.1f} ops/s, "
+            f"{report['erros']} erros ({report['excecoes']} exceções)",
+            f"   Lock de escrita: {lock['disputadas']}/{lock['aquisicoes']} aquisições disputadas, "
+            f"espera total {lock['espera_total_ms']:.1f} ms (máx {lock['espera_max_ms']:.1f} ms)",
+            '',
+            f"{'Operação':<20}{'Qtd':>8}{'Erros':>7}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Lock ms':>9}",
+        ]
+        for name, op in report['por_operacao'].items():
+            lines.append(
+                f"{name:<20}{op['quantidade']:>8}{op['erros']:>7}{op['ops_s']:>9.1f}{op['p50_ms']:>9.2f}"
+                f"{op['p95_ms']:>9.2f}{op['p99_ms']:>9.2f}{op['espera_lock_media_ms']:>9.2f}"
+            )
+        for name, op in report['por_operacao'].items():
+            if op['excecoes']:
+                lines.append(f"   ⚠️ {name}: {op['excecoes']} exceções (última: {op['ultimo_erro']})")
+        
+        if base is not None:
+            def fmt(value):
+                return f"{value:+.1f}%" if value is not None else '-'
+            lines += ['', f"Comparação com {base['inicio']}:", f"{'Operação':<20}{'ops/s':>10}{'p50':>10}{'p99':>10}"]
+            for row in cls.compare(base, report):
+                lines.append(f"{row['operacao']:<20}{fmt(row['ops_s']):>10}{fmt(row['p50_ms']):>10}{fmt(row['p99_ms']):>10}")
+        return '\n'.join(lines)
+
+def run_load_test(argv: List[str]) -> int:
+    """Linha de comando do teste de carga: python stock-control.py carga [opções]"""
+    parser = argparse.ArgumentParser(
+        prog='stock-control.py carga',
+        description='Simula várias sessões registrando movimentações e consultando o estoque ao mesmo tempo'
+    )
+    parser.add_argument('--sessoes', type=int, default=50, help='sessões simultâneas (padrão: 50)')
+    parser.add_argument('--duracao', type=float, default=30.0, help='duração em segundos (padrão: 30)')
+    parser.add_argument('--modo', choices=LoadTestRunner.MODES, default='threads')
+    parser.add_argument('--escrita', type=float, default=0.2, help='proporção de gravações (padrão: 0.2)')
+    parser.add_argument('--tela', type=float, default=0.1, help='proporção de operações de tela (padrão: 0.1)')
+    parser.add_argument('--pausa-ms', type=float, default=0.0, help='pausa média entre operações de uma sessão')
+    parser.add_argument('--produtos', type=int, default=500, help='produtos de carga (padrão: 500)')
+    parser.add_argument('--semente', type=int, default=None, help='semente do sorteio (reprodutível)')
+    parser.add_argument('--banco', default=None, help='URL do banco (padrão: data/estoque_carga.db, recriado)')
+    parser.add_argument('--saida', default=None, help='arquivo JSON do relatório')
+    parser.add_argument('--comparar', default=None, help='relatório JSON anterior para comparação')
+    args = parser.parse_args(argv)
+    
+    url = args.banco
+    if url is None:
+        # Banco descartável: nunca carrega o data/estoque.db de produção
+        url = os.path.join('data', 'estoque_carga.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(url + suffix):
+                os.remove(url + suffix)
+    
+    db = DatabaseManager(url)
+    try:
+        runner = LoadTestRunner(
+            db, sessions=args.sessoes, duration=args.duracao, mode=args.modo,
+            write_ratio=args.escrita, ui_ratio=args.tela, think_ms=args.pausa_ms,
+            products=args.produtos, seed=args.semente
+        )
+        report = runner.run()
+        path = runner.save_report(report, args.saida)
+        
+        base = None
+        if args.comparar:
+            with open(args.comparar, encoding='utf-8') as f:
+                base = json.load(f)
+        print(LoadTestRunner.format_report(report, base))
+        print(f"📄 Relatório salvo em {path}")
+        return 0
+        
+    except Exception as e:
+        print(f"❌ Erro no teste de carga: {e}")
+        return 1
+    finally:
+        db.close()
 
-def main(page: ft.Page):
+def main(page: ft.Page, controller: ProductController = None):
     
-    """Função principal da aplicação"""
+    """Função principal da aplicação (controller: o mesmo para todas as sessões)"""
     try:
-        app = StockControlApp(page)
+        app = StockControlApp(page, controller)
         print("🚀 Aplicação iniciada com sucesso!")
     except Exception as e:
         print(f"❌ Erro ao iniciar aplicação: {e}")
@@ -1341,4 +7857,24 @@ def main(page: ft.Page):
 
 if __name__ == "__main__":
     warnings.filterwarnings("ignore", category=DeprecationWarning) #Apenas para ignorar as warnings de depreciação
-    ft.app(target=main, view=ft.WEB_BROWSER, port=8080)
\ No newline at end of file
+    
+    if sys.argv[1:2] == ['carga']:
+        sys.exit(run_load_test(sys.argv[2:]))
+    
+    # Tarefas em segundo plano: backup de hora em hora, expiração de reservas a cada
+    # 5 minutos, exportação, reconciliação, classificação ABC/XYZ e manutenção noturnas
+    controller = ProductController()
+    nightly = (datetime.now() + timedelta(days=1)).replace(hour=2, minute=0, second=0, microsecond=0)
+    if controller.db.backend.supports_files:
+        controller.jobs.schedule_recurring('backup', 3600)
+        controller.jobs.schedule_recurring('exportar_movimentacoes', 86400, first_run=nightly)
+    controller.jobs.schedule_recurring('expirar_reservas', 300)
+    controller.jobs.schedule_recurring('reconciliacao', 86400, first_run=nightly)
+    controller.jobs.schedule_recurring('classificar_produtos', 86400, first_run=nightly)
+    controller.jobs.schedule_recurring('manutencao', 86400, first_run=nightly + timedelta(hours=1))
+    controller.jobs.start()
+    
+    # API local para integrações (ERP, e-commerce)
+    ApiServer(controller).start()
+    
+    ft.app(target=lambda page: main(page, controller), view=ft.WEB_BROWSER, port=8080)
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""Arquivamento anual: anos fechados pelo calendário UTC"""
+
+import time
+from datetime import datetime
+
+import pytest
+
+
+def test_closed_year_follows_utc(sc, file_db, monkeypatch):
+    controller = sc.ProductController(file_db)
+    assert controller.create_product({'nome': 'Caneta'})
+    product = file_db.execute_query('SELECT id FROM produtos')[0][0]
+    year = datetime.now().year
+    file_db.execute_command(
+        '''INSERT INTO movimentacoes (produto_id, tipo, quantidade, data_movimentacao, data_epoch, local_id)
+           VALUES (?, 'ENTRADA', 1, ?, ?, 1)''',
+        (product, f'{year}-06-01 10:00:00', sc.to_epoch(f'{year}-06-01 10:00:00'))
+    )
+    # Primeiros minutos do ano seguinte em UTC (ainda o ano atual em fusos a oeste)
+    monkeypatch.setattr(time, 'time', lambda: sc.to_epoch(f'{year + 1}-01-01 00:30:00'))
+
+    assert controller.archiver.archive_year(year) == 1
+
+
+def test_current_utc_year_is_not_closed(sc, db):
+    archiver = sc.MovementArchiver(db)
+    with pytest.raises(ValueError):
+        archiver.archive_year(time.gmtime().tm_year)
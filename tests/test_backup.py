@@ -0,0 +1,69 @@
+"""Backups: restauração de versões anteriores e arquivos anuais"""
+
+import gzip
+import shutil
+import sqlite3
+
+
+def downgrade(path):
+    # Backup feito antes da coluna transferencia_id (schema 8)
+    plain = path[:-len('.gz')]
+    with gzip.open(path, 'rb') as source, open(plain, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    connection = sqlite3.connect(plain)
+    connection.execute('ALTER TABLE movimentacoes DROP COLUMN transferencia_id')
+    connection.execute('PRAGMA user_version = 8')
+    connection.commit()
+    connection.close()
+    with open(plain, 'rb') as source, gzip.open(path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+
+
+def test_restore_migrates_an_older_backup(sc, file_db):
+    controller = sc.ProductController(file_db)
+    assert controller.create_product({'nome': 'Caneta'})
+    product = file_db.execute_query('SELECT id FROM produtos')[0][0]
+    backup = controller.create_backup()
+    downgrade(backup)
+
+    assert controller.restore_backup(backup)
+
+    assert file_db.execute_query('PRAGMA user_version')[0][0] == file_db.SCHEMA_VERSION
+    assert controller.register_movement(product, 'ENTRADA', 2, 1.0)
+    assert controller.get_product(product).estoque_atual == 2
+
+
+def test_restore_refuses_a_newer_backup(sc, file_db):
+    controller = sc.ProductController(file_db)
+    backup = controller.create_backup()
+    plain = backup[:-len('.gz')]
+    with gzip.open(backup, 'rb') as source, open(plain, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    connection = sqlite3.connect(plain)
+    connection.execute(f'PRAGMA user_version = {file_db.SCHEMA_VERSION + 1}')
+    connection.commit()
+    connection.close()
+    with open(plain, 'rb') as source, gzip.open(backup, 'wb') as target:
+        shutil.copyfileobj(source, target)
+
+    assert not controller.restore_backup(backup)
+    assert file_db.execute_query('PRAGMA user_version')[0][0] == file_db.SCHEMA_VERSION
+
+
+def test_restore_does_not_duplicate_archived_movements(sc, file_db):
+    controller = sc.ProductController(file_db)
+    assert controller.create_product({'nome': 'Caneta'})
+    product = file_db.execute_query('SELECT id FROM produtos')[0][0]
+    assert controller.register_movement(product, 'ENTRADA', 5, 1.0)
+    file_db.execute_command(
+        "UPDATE movimentacoes SET data_movimentacao = '2020-06-01 10:00:00', data_epoch = ?",
+        (sc.to_epoch('2020-06-01'),)
+    )
+    backup = controller.create_backup()
+    assert controller.archiver.archive_year(2020) == 1
+
+    assert controller.restore_backup(backup)
+
+    assert file_db.execute_query('SELECT COUNT(*) FROM movimentacoes')[0][0] == 0
+    assert len(controller.get_movement_history('2020-01-01', '2021-01-01')) == 1
+    assert file_db.execute_query("SELECT SUM(entradas) FROM movimentacoes_resumo WHERE periodo = '2020'")[0][0] == 5
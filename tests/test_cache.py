@@ -0,0 +1,47 @@
+"""Cache de consultas e fotografia do estoque: invalidação por escrita e rollback"""
+
+import pytest
+
+
+def test_write_invalidates_cached_listing(controller, make_product):
+    product = make_product('Caneta')
+    assert controller.get_movements(product) == []
+
+    assert controller.register_movement(product, 'ENTRADA', 3, 1.0)
+
+    assert [m.quantidade for m in controller.get_movements(product)] == [3]
+    assert [p.nome for p in controller.get_low_stock_products()] == []
+
+
+def test_rollback_does_not_leave_uncommitted_rows_in_cache(controller, make_product):
+    make_product('Caneta')
+    with pytest.raises(RuntimeError):
+        with controller.db.transaction():
+            controller.db.execute_command("INSERT INTO categorias (nome) VALUES ('Temporária')")
+            # Lida (e guardada) dentro da transação que será desfeita
+            assert 'Temporária' in [row['nome'] for row in controller.get_categories()]
+            raise RuntimeError('falha')
+
+    assert 'Temporária' not in [row['nome'] for row in controller.get_categories()]
+
+
+def test_snapshot_follows_movements_and_rollbacks(controller, make_product):
+    product = make_product('Caneta', preco_venda=2.0)
+    assert controller.register_movement(product, 'ENTRADA', 5, 1.0)
+    assert controller.snapshot.refresh().total_value() == 10.0
+
+    with pytest.raises(RuntimeError):
+        with controller.db.transaction():
+            controller._post_movement(product, 'ENTRADA', 100, 1.0, '')
+            raise RuntimeError('falha')
+    assert controller.register_movement(product, 'SAIDA', 1, 2.0)
+
+    assert controller.snapshot.refresh().total_value() == 8.0
+
+
+def test_product_edit_is_seen_by_code_lookup(controller, make_product):
+    product = make_product('Caneta', sku='CAN')
+    assert controller.update_product(product, {'nome': 'Caneta azul', 'sku': 'CAN-AZ', 'preco_venda': 8.0})
+
+    assert controller.codes.lookup('CAN') is None
+    assert controller.find_product_by_code('CAN-AZ').nome == 'Caneta azul'
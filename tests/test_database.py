@@ -0,0 +1,31 @@
+"""Banco: modo WAL, leituras confirmadas e manutenção"""
+
+
+def test_file_database_uses_wal(file_db):
+    connection = file_db.get_connection()
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def test_open_read_does_not_block_writer(file_db):
+    with file_db.read_committed() as fetch:
+        before = next(iter(fetch('snapshot.ultima_movimentacao')))[0]
+        file_db.execute_command("INSERT INTO categorias (nome) VALUES ('Durante a leitura')")
+        assert next(iter(fetch('snapshot.ultima_movimentacao')))[0] == before
+
+    rows = file_db.execute_query("SELECT COUNT(*) FROM categorias WHERE nome = 'Durante a leitura'")
+    assert rows[0][0] == 1
+
+
+def test_compact_frees_every_free_page(file_db):
+    file_db.executemany('INSERT INTO categorias (nome) VALUES (?)', [('x' * 500 + str(i),) for i in range(2000)])
+    file_db.execute_command("DELETE FROM categorias WHERE nome LIKE 'xxx%'")
+    assert file_db.storage_stats()['freelist_count'] > 10
+
+    file_db.compact(max_pages=10)
+    free = file_db.storage_stats()['freelist_count']
+    file_db.compact()
+
+    assert free > 0
+    assert file_db.storage_stats()['freelist_count'] == 0
+    assert not file_db.get_connection().in_transaction
@@ -0,0 +1,27 @@
+"""Exportação em vários processos"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_export_workers_are_spawned(sc, file_db, monkeypatch):
+    start_methods = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        # Threads no lugar de processos: o módulo de testes não é importável por um filho
+        def __init__(self, max_workers=None, mp_context=None):
+            start_methods.append(mp_context and mp_context.get_start_method())
+            super().__init__(max_workers)
+
+    monkeypatch.setattr(sc, 'ProcessPoolExecutor', RecordingExecutor)
+    controller = sc.ProductController(file_db)
+    assert controller.create_product({'nome': 'Caneta'})
+    product = file_db.execute_query('SELECT id FROM produtos')[0][0]
+    assert controller.register_movement(product, 'ENTRADA', 3, 1.0)
+
+    path = controller.get_job_runner().export_movements()
+
+    assert start_methods == ['spawn']
+    with open(path, encoding='utf-8') as f:
+        exported = json.load(f)
+    assert [row['quantidade'] for row in exported] == [3]
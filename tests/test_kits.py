@@ -0,0 +1,58 @@
+"""Kits: explosão em componentes e caches compartilhados entre controladores"""
+
+
+def test_kit_movement_posts_components(controller, make_product):
+    c1 = make_product('Componente 1')
+    c2 = make_product('Componente 2')
+    kit = make_product('Kit', componentes={c1: 2, c2: 1})
+
+    assert controller.register_movement(kit, 'ENTRADA', 3, 0.0, '')
+    assert controller.get_product(kit).estoque_atual == 0
+    assert controller.get_product(c1).estoque_atual == 6
+    assert controller.get_product(c2).estoque_atual == 3
+    assert controller.get_available_stock(kit) == 3
+
+
+def test_nested_kit_is_flattened(controller, make_product):
+    c1 = make_product('Parafuso')
+    inner = make_product('Kit interno', componentes={c1: 4})
+    outer = make_product('Kit externo', componentes={inner: 2})
+
+    assert controller.kits.components(outer) == {c1: 8}
+
+
+def test_kit_created_by_one_controller_is_seen_by_another(sc, db, make_product):
+    other = sc.ProductController(db)
+    c1 = make_product('Componente')
+    kit = make_product('Kit', sku='KIT1', componentes={c1: 2})
+
+    assert other.codes.lookup('KIT1') == kit
+    assert other.kits.is_kit(kit)
+    assert other.register_movement(kit, 'ENTRADA', 5, 0.0, '')
+    assert other.get_product(kit).estoque_atual == 0
+    assert other.get_product(c1).estoque_atual == 10
+
+
+def test_kit_is_not_low_stock_nor_suggested(sc, controller, make_product):
+    supplier = controller.db.execute_command("INSERT INTO fornecedores (nome) VALUES ('Fornecedor')")
+    c1 = make_product('Componente', fornecedor_id=supplier, estoque_minimo=5, estoque_maximo=20)
+    kit = make_product('Kit', fornecedor_id=supplier, estoque_minimo=5, estoque_maximo=20,
+                       componentes={c1: 2})
+
+    assert [p.id for p in controller.get_low_stock_products()] == [c1]
+    assert controller.get_product(kit).status_estoque == 'NORMAL'
+    assert [row['produto_id'] for row in sc.PurchasingManager(controller).get_suggestions()] == [c1]
+
+    snapshot = controller.snapshot.refresh()
+    assert snapshot.low_stock_count() == 1
+    assert snapshot.status_counts() == {'BAIXO': 1, 'NORMAL': 0, 'ALTO': 0}
+
+
+def test_cached_low_stock_list_drops_product_turned_into_kit(controller, make_product):
+    c1 = make_product('Componente', estoque_minimo=5)
+    product = make_product('Conjunto', estoque_minimo=5)
+    assert [p.id for p in controller.get_low_stock_products()] == [c1, product]
+
+    controller.kits.set_components(product, {c1: 1})
+    assert [p.id for p in controller.get_low_stock_products()] == [c1]
+    assert controller.snapshot.refresh().low_stock_count() == 1
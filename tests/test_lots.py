@@ -0,0 +1,23 @@
+"""Lotes: separação FEFO (vence primeiro, sai primeiro)"""
+
+
+def test_exit_consumes_lots_by_expiry(controller, make_product):
+    product = make_product('Iogurte')
+    assert controller.register_movement(product, 'ENTRADA', 5, 1.0, lote='TARDE', validade='2031-01-01')
+    assert controller.register_movement(product, 'ENTRADA', 5, 1.0, lote='CEDO', validade='2030-01-01')
+
+    assert [(lot['numero_lote'], qtd) for lot, qtd in controller.pick_lots(product, 7)] == [('CEDO', 5), ('TARDE', 2)]
+    assert controller.register_movement(product, 'SAIDA', 7, 2.0)
+
+    assert [(lot['numero_lote'], lot['saldo']) for lot in controller.get_product_lots(product)] == [('TARDE', 3)]
+    assert controller.get_product(product).estoque_atual == 3
+
+
+def test_transfer_keeps_lots_at_destination(controller, make_product):
+    destino = controller.db.execute_command("INSERT INTO locais (nome) VALUES ('Loja 2')")
+    product = make_product('Iogurte')
+    assert controller.register_movement(product, 'ENTRADA', 4, 1.0, lote='L1', validade='2030-01-01')
+
+    assert controller.transfer_stock(product, controller.db.DEFAULT_LOCATION_ID, destino, 3)
+
+    assert [(lot['numero_lote'], qtd) for lot, qtd in controller.pick_lots(product, 10, destino)] == [('L1', 3)]
@@ -0,0 +1,47 @@
+"""Manutenção: arquivamento de produtos inativos sem deixar linhas órfãs"""
+
+import pytest
+
+
+@pytest.fixture
+def retire(controller):
+    def retire(product_id):
+        # Simula o histórico já arquivado e a desativação há mais de um ano
+        db = controller.db
+        db.execute_command('DELETE FROM movimentacoes WHERE produto_id = ?', (product_id,))
+        db.execute_command(
+            "UPDATE produtos SET ativo = 0, updated_at = '2020-01-01 00:00:00' WHERE id = ?", (product_id,)
+        )
+    return retire
+
+
+def count(db, sql, product_id):
+    return db.execute_query(sql, (product_id,))[0][0]
+
+
+def test_purge_removes_empty_lots_with_the_product(controller, make_product, retire):
+    product = make_product('Iogurte')
+    assert controller.register_movement(product, 'ENTRADA', 5, 1.0, lote='L1', validade='2030-01-01')
+    assert controller.register_movement(product, 'SAIDA', 5, 2.0)
+    retire(product)
+
+    assert controller.maintenance.purge_inactive() == 1
+
+    db = controller.db
+    assert count(db, 'SELECT COUNT(*) FROM produtos_arquivados WHERE id = ?', product) == 1
+    assert count(db, 'SELECT COUNT(*) FROM lotes WHERE produto_id = ?', product) == 0
+    assert db.execute_query('SELECT COUNT(*) FROM movimentacoes_lotes')[0][0] == 0
+
+
+def test_purge_keeps_products_with_transfers_or_kits(controller, make_product, retire):
+    destino = controller.db.execute_command("INSERT INTO locais (nome) VALUES ('Loja 2')")
+    moved = make_product('Transferido')
+    assert controller.register_movement(moved, 'ENTRADA', 3, 1.0)
+    assert controller.transfer_stock(moved, controller.db.DEFAULT_LOCATION_ID, destino, 3)
+    assert controller.register_movement(moved, 'SAIDA', 3, 1.0, local_id=destino)
+    component = make_product('Componente')
+    make_product('Kit', componentes={component: 1})
+    retire(moved)
+    retire(component)
+
+    assert controller.maintenance.purge_inactive() == 0
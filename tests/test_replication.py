@@ -0,0 +1,81 @@
+"""Replicação: pacotes idempotentes e identidade do nó compartilhada"""
+
+import pytest
+
+
+@pytest.fixture
+def store_a(sc):
+    database = sc.DatabaseManager(':memory:')
+    yield sc.ProductController(database)
+    database.close()
+
+
+@pytest.fixture
+def store_b(sc):
+    database = sc.DatabaseManager(':memory:')
+    yield sc.ProductController(database)
+    database.close()
+
+
+def test_importing_a_bundle_twice_changes_nothing(store_a, store_b):
+    assert store_a.create_product({'nome': 'Caneta', 'sku': 'CAN', 'preco_venda': 2.0})
+    pen = store_a.codes.lookup('CAN')
+    assert store_a.register_movement(pen, 'ENTRADA', 10, 1.0)
+    assert store_a.register_movement(pen, 'SAIDA', 3, 2.0)
+    store_a.replication.export_bundle('a.json.gz')
+
+    first = store_b.replication.import_bundle('a.json.gz')
+    second = store_b.replication.import_bundle('a.json.gz')
+
+    assert first['aplicadas'] == 3 and first['pendentes'] == 0
+    assert second == {'aplicadas': 0, 'ignoradas': 3, 'pendentes': 0, 'conflitos': []}
+    assert store_b.find_product_by_code('CAN').estoque_atual == 7
+
+
+def test_code_clash_is_reported_without_aborting_the_import(store_a, store_b):
+    assert store_b.create_product({'nome': 'Caneta local', 'sku': 'CAN'})
+    local = store_b.codes.lookup('CAN')
+    assert store_a.create_product({'nome': 'Caneta', 'sku': 'CAN', 'ean': '789'})
+    assert store_a.register_movement(store_a.codes.lookup('CAN'), 'ENTRADA', 4, 1.0)
+    store_a.replication.export_bundle('a.json.gz')
+
+    result = store_b.replication.import_bundle('a.json.gz')
+
+    assert result['aplicadas'] == 2 and result['pendentes'] == 0
+    assert len(result['conflitos']) == 1 and 'CAN' in result['conflitos'][0]
+    assert store_b.codes.lookup('CAN') == local
+    replicated = store_b.find_product_by_code('789')
+    assert replicated.nome == 'Caneta' and replicated.sku is None and replicated.estoque_atual == 4
+
+
+def test_restore_gives_every_controller_the_new_node(sc, file_db):
+    first = sc.ProductController(file_db)
+    second = sc.ProductController(file_db)
+    assert first.create_product({'nome': 'Caneta', 'sku': 'CAN'})
+    pen = first.codes.lookup('CAN')
+    backup = first.create_backup()
+    old_node = second.replication.node_id
+
+    assert first.restore_backup(backup)
+    assert second.register_movement(pen, 'ENTRADA', 1, 1.0)
+
+    node_id = file_db.execute_query('SELECT node_id FROM replicacao_no')[0][0]
+    assert node_id != old_node
+    assert second.replication.node_id == node_id
+    logged = file_db.execute_query(
+        "SELECT node_id FROM replicacao_log WHERE tipo = 'MOVIMENTACAO'"
+    )
+    assert [row[0] for row in logged] == [node_id]
+
+
+def test_rollback_forgets_uid_generated_in_transaction(controller):
+    # Produto anterior à replicação, ainda sem uid
+    product = controller.db.execute_command("INSERT INTO produtos (nome) VALUES ('Caneta')")
+    with pytest.raises(RuntimeError):
+        with controller.db.transaction():
+            controller.replication.product_uid(product)
+            raise RuntimeError('falha')
+
+    uid = controller.replication.product_uid(product)
+    stored = controller.db.execute_query('SELECT uid FROM produtos WHERE id = ?', (product,))[0][0]
+    assert uid == stored
@@ -0,0 +1,24 @@
+"""Reservas: expiração conta só o que foi de fato finalizado"""
+
+
+def test_expire_counts_only_finalized_reservations(controller, make_product, monkeypatch):
+    product = make_product('Caneta')
+    assert controller.register_movement(product, 'ENTRADA', 10, 1.0)
+    reservations = controller.reservations
+    stale = reservations.reserve(product, 2, ttl_seconds=-1)
+    confirmed = reservations.reserve(product, 3, ttl_seconds=-1)
+    # A reserva confirmada ainda aparece na lista de vencidas lida antes da confirmação
+    vencidas = controller.db.query_named('reservas.vencidas', (2 ** 40, 10))
+    assert controller.commit_reservation(confirmed)
+
+    query_named = controller.db.query_named
+
+    def stale_query(name, *args, **kwargs):
+        return vencidas if name == 'reservas.vencidas' else query_named(name, *args, **kwargs)
+
+    monkeypatch.setattr(controller.db, 'query_named', stale_query)
+
+    assert reservations.expire_stale() == 1
+    status = dict(controller.db.execute_query('SELECT id, status FROM reservas'))
+    assert status == {stale: 'EXPIRADA', confirmed: 'CONFIRMADA'}
+    assert controller.get_available_stock(product) == 7
@@ -0,0 +1,65 @@
+"""Leituras de código de barras: gravação por item e novas tentativas"""
+
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def products(controller, make_product):
+    return make_product('Caneta', sku='CAN'), make_product('Lápis', sku='LAP')
+
+
+def fail_for(controller, monkeypatch, failing_id):
+    post = controller._post_movement
+
+    def post_movement(product_id, *args, **kwargs):
+        if product_id == failing_id:
+            raise RuntimeError('falha simulada')
+        return post(product_id, *args, **kwargs)
+
+    monkeypatch.setattr(controller, '_post_movement', post_movement)
+
+
+def test_failing_item_does_not_undo_the_others(sc, controller, products, monkeypatch):
+    pen, pencil = products
+    buffer = sc.ScanBuffer(controller, flush_interval=60)
+    buffer.scan('CAN', 'ENTRADA', 2)
+    buffer.scan('LAP', 'ENTRADA', 3)
+    fail_for(controller, monkeypatch, pencil)
+
+    result = buffer.flush()
+
+    assert result['movimentacoes'] == 1
+    assert controller.get_product(pen).estoque_atual == 2
+    assert controller.get_product(pencil).estoque_atual == 0
+    assert buffer.pending_count() == 1
+
+
+def test_requeued_scans_are_flushed_by_the_timer(sc, controller, products, monkeypatch):
+    pen, _ = products
+    flushed = threading.Event()
+    buffer = sc.ScanBuffer(controller, flush_interval=0.05,
+                           on_flush=lambda result: result['movimentacoes'] and flushed.set())
+    buffer.scan('CAN', 'ENTRADA', 4)
+    fail_for(controller, monkeypatch, pen)
+    assert 'erro' in buffer.flush()
+    monkeypatch.undo()
+
+    assert flushed.wait(2)
+    assert controller.get_product(pen).estoque_atual == 4
+    assert buffer.pending_count() == 0
+
+
+def test_item_is_dropped_after_max_attempts(sc, controller, products, monkeypatch):
+    pen, _ = products
+    buffer = sc.ScanBuffer(controller, flush_interval=60, max_attempts=2)
+    buffer.scan('CAN', 'ENTRADA', 5)
+    fail_for(controller, monkeypatch, pen)
+
+    assert buffer.flush()['descartadas'] == []
+    result = buffer.flush()
+
+    assert result['descartadas'] == [(pen, 'ENTRADA', sc.DatabaseManager.DEFAULT_LOCATION_ID, 5)]
+    assert buffer.pending_count() == 0
+    assert buffer.flush()['leituras'] == 0
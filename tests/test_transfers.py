@@ -0,0 +1,68 @@
+"""Transferências entre locais: marcadas pela coluna transferencia_id"""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def stores(controller):
+    destino = controller.db.execute_command("INSERT INTO locais (nome) VALUES ('Loja 2')")
+    return controller.db.DEFAULT_LOCATION_ID, destino
+
+
+def demand(db):
+    rows = db.execute_query('SELECT produto_id, SUM(quantidade) FROM demanda_mensal GROUP BY produto_id')
+    return {row[0]: row[1] for row in rows}
+
+
+def test_transfer_movements_carry_the_transfer_id(controller, make_product, stores):
+    origem, destino = stores
+    product = make_product('Caneta')
+    assert controller.register_movement(product, 'ENTRADA', 10, 5.0)
+    assert controller.transfer_stock(product, origem, destino, 4, 'reposição')
+
+    rows = controller.db.execute_query(
+        'SELECT tipo, transferencia_id FROM movimentacoes WHERE transferencia_id IS NOT NULL ORDER BY id'
+    )
+    transfer_id = controller.db.execute_query('SELECT id FROM transferencias')[0][0]
+    assert [tuple(row) for row in rows] == [('SAIDA', transfer_id), ('ENTRADA', transfer_id)]
+
+
+def test_demand_ignores_transfers_but_not_matching_notes(controller, make_product, stores):
+    origem, destino = stores
+    product = make_product('Caneta')
+    assert controller.register_movement(product, 'ENTRADA', 10, 5.0)
+    assert controller.transfer_stock(product, origem, destino, 4)
+    # Observação digitada pelo usuário não faz de uma venda uma transferência
+    assert controller.register_movement(product, 'SAIDA', 2, 8.0, 'Transferência #99 combinada')
+
+    controller.classifier.refresh()
+    assert demand(controller.db) == {product: 2}
+    controller.classifier.refresh(full=True)
+    assert demand(controller.db) == {product: 2}
+
+
+def test_old_database_is_backfilled_from_the_note(sc, workdir):
+    path = str(workdir / 'data' / 'estoque.db')
+    db = sc.DatabaseManager(path)
+    controller = sc.ProductController(db)
+    assert controller.create_product({'nome': 'Caneta'})
+    product = controller.db.execute_query('SELECT id FROM produtos')[0][0]
+    destino = db.execute_command("INSERT INTO locais (nome) VALUES ('Loja 2')")
+    assert controller.register_movement(product, 'ENTRADA', 10, 5.0)
+    assert controller.transfer_stock(product, db.DEFAULT_LOCATION_ID, destino, 4, 'ajuste')
+    db.close()
+
+    connection = sqlite3.connect(path)
+    connection.execute('ALTER TABLE movimentacoes DROP COLUMN transferencia_id')
+    connection.execute('PRAGMA user_version = 8')
+    connection.commit()
+    connection.close()
+
+    db = sc.DatabaseManager(path)
+    try:
+        marked = db.execute_query('SELECT COUNT(*) FROM movimentacoes WHERE transferencia_id = 1')[0][0]
+        assert marked == 2
+    finally:
+        db.close()